@@ -1,40 +1,19 @@
-from multiprocessing import Pool
-from time import sleep
-from random import random
-
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
-from uniswap_simulator import GeometricBrownianMotion, Position, compare_to_hodl
+from uniswap_simulator import Position, adaptive_sweep
+from uniswap_simulator.executor import LocalTransport
+from uniswap_simulator.tick_math import MIN_TICK, MAX_TICK, MIN_PRICE, MAX_PRICE, tick_to_price
 
 from strategies.static_main_position.compounding_strategy import CompoundingStrategy
 
 
-MIN_TICK = -887272
-MAX_TICK = +887272
-
-
-def get_performance(args):
-    # sleep so that threads don't go swallowing memory for the GBM all at once
-    sleep(random() * 10.0)
-
-    p0, mu, sigma, dt, T = args
-
-    gbm = GeometricBrownianMotion(p0, mu, sigma, dt, T)
-    prices = gbm.sample(1000).astype('float64')
-    prices = np.clip(
-        prices,
-        a_min=1.0001 ** MIN_TICK,
-        a_max=1.0001 ** MAX_TICK
-    )
+def make_strategy(price):
+    lower = np.full_like(price, tick_to_price(MIN_TICK // 2))
+    upper = np.full_like(price, tick_to_price(MAX_TICK // 2))
 
-    lower = np.full_like(prices[0], 1.0001 ** (MIN_TICK / 2))
-    upper = np.full_like(prices[0], 1.0001 ** (MAX_TICK / 2))
-
-    strategy = Position(prices[0], lower, upper, 5.00/100)
-    # strategy = CompoundingStrategy(prices[0], lower, upper, 5.0/100)
-
-    return np.array(compare_to_hodl(strategy, prices, T))
+    return Position(price, lower, upper, 5.00/100)
+    # return CompoundingStrategy(price, lower, upper, 5.0/100)
 
 
 def main():
@@ -43,23 +22,37 @@ def main():
     sigmas = np.linspace(0.1, 2.0, 20)
     mus = np.linspace(-0.8, 2.0, 20)
 
-    x_grid, y_grid = np.meshgrid(mus, sigmas)
-    z_grid = np.zeros((*x_grid.shape, 2))
-
     dt = 1. / 20000.
     T = 1.
 
-    ij = []
-    args = []
-    for i in range(len(sigmas)):
-        for j in range(len(mus)):
-            ij.append((i, j))
-            args.append((p0, mus[j], sigmas[i], dt, T))
-
-    with Pool(12) as p:
-        performances = p.map(get_performance, args)
-        for k, performance in enumerate(performances):
-            z_grid[ij[k][0], ij[k][1]] = performance
+    # each batch of 5 (mu, sigma) cells is simulated in rounds of 256 trajectories per cell, until
+    # G - G_hodl is known to within 0.01 (95% confidence) or 4096 trajectories have been used
+    x_grid, y_grid, z_grid = adaptive_sweep(
+        make_strategy,
+        p0,
+        mus,
+        sigmas,
+        dt,
+        T,
+        tolerance=0.01,
+        batch_size=256,
+        max_paths=4096,
+        cells_per_batch=5,
+        # batches are handed out to 12 local workers as they become free; to use several machines, pass
+        # e.g. TCPTransport(('0.0.0.0', 6000), authkey=b'...') and start workers with
+        # `python -m uniswap_simulator tcp HOST:6000 ...` on each of them
+        transport=LocalTransport(12),
+        seed=0,
+        price_bounds=(MIN_PRICE, MAX_PRICE),
+        # static positions are simulated a whole block at a time; other strategies are stepped as usual
+        engine='vectorized',
+        # paths come in mirrored pairs, and HODL's exact expected growth corrects each cell's estimate
+        method='antithetic',
+        control_variate=True,
+        # batches are snapshotted here after every round; rerunning after a crash resumes from the snapshots
+        checkpoint_dir='results/checkpoints'
+    )
+    print('paths per cell: {:.0f} on average, {:.0f} at most'.format(z_grid[..., 4].mean(), z_grid[..., 4].max()))
 
     # Save simulation results
     np.save('results/xgrid.npy', x_grid)
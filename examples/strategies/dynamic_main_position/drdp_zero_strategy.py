@@ -1,15 +1,11 @@
+from math import gcd
 from random import random
 
 import numpy as np
 
 from uniswap_simulator import Position
-
-
-def coerce_to_tick_spacing(spacing, ticks):
-    ticks = ticks.copy()
-    ticks[...,0] -= np.mod(ticks[...,0], spacing)
-    ticks[...,1] -= np.mod(ticks[...,1], spacing) - spacing
-    return ticks
+from uniswap_simulator.tick_math import MIN_TICK, MAX_TICK, LOG_TICK_BASE, floor_to_spacing, price_to_tick, \
+    tick_to_sqrt_price
 
 
 class DRDP0Strategy:
@@ -23,7 +19,7 @@ class DRDP0Strategy:
         elif fee == 1.0 / 100:
             self._tick_spacing = 100
 
-        self.half_width = (np.log(upper) - np.log(lower)) / (2 * np.log(1.0001))
+        self.half_width = np.rint((np.log(upper) - np.log(lower)) / (2 * LOG_TICK_BASE)).astype(np.int64)
         self.position = Position(price, lower, upper, fee)
         self.limit_order = Position(price, lower, price / 1.0001, fee)
 
@@ -40,23 +36,18 @@ class DRDP0Strategy:
 
         self._compound(price, amounts.copy())
 
-        center = np.log(price) / np.log(1.0001)
+        center = price_to_tick(price)
         lower = np.zeros_like(center)
         upper = np.zeros_like(center)
-        mask = center < 0.0
+        mask = center < 0
         lower[mask] = np.clip(center - self.half_width,
-                              a_min=-887272, a_max=None)[mask]
+                              a_min=MIN_TICK, a_max=None)[mask]
         upper[mask] = (lower + 2 * self.half_width)[mask]
         upper[~mask] = np.clip(center + self.half_width,
-                               a_min=None, a_max=+887272)[~mask]
+                               a_min=None, a_max=MAX_TICK)[~mask]
         lower[~mask] = (upper - 2 * self.half_width)[~mask]
-        lower = np.power(1.0001, lower)
-        upper = np.power(1.0001, upper)
 
-        burned = self.position.burn()
-        self.position = Position(price, lower, upper, self.position.fee)
-        used = self.position.mint(burned[..., 0], burned[..., 1])
-        self.position._earned = np.clip(burned - used, a_min=0, a_max=None)
+        self.position.burn_and_remint(lower, upper, ticks=True)
 
         return amounts
 
@@ -76,22 +67,16 @@ class DRDP0Strategy:
             print((amounts[...,0] / amounts.sum(axis=-1)).mean())
         excess0 = amounts[...,0] > amounts[...,1]
         # compute active trading range (defined by lower and upper ticks)
-        active_ticks = np.log(price) / np.log(1.0001)
-        active_ticks = coerce_to_tick_spacing(
-            self._tick_spacing,
-            np.vstack((active_ticks, active_ticks)).T
-        )
+        active_lower = floor_to_spacing(price_to_tick(price), self._tick_spacing)
+        active_upper = active_lower + self._tick_spacing
 
         w = max(DRDP0Strategy.limit_order_width, self._tick_spacing)
-        new_bounds = np.zeros_like(active_ticks)
-        new_bounds[excess0, 0] = active_ticks[excess0, 1]
-        new_bounds[excess0, 1] = active_ticks[excess0, 1] + w
-        new_bounds[~excess0, 0] = active_ticks[~excess0, 0] - w
-        new_bounds[~excess0, 1] = active_ticks[~excess0, 0]
-        new_bounds = np.power(1.0001, new_bounds)
-        new_bounds = np.sqrt(new_bounds)
+        new_lower = np.where(excess0, active_upper, active_lower - w)
+        new_upper = np.where(excess0, active_upper + w, active_lower)
+        # every bound is a multiple of this, so sqrt prices can come from one (small) table
+        spacing = gcd(w, self._tick_spacing)
         
-        m = np.sqrt(new_bounds[...,0] * new_bounds[...,1])
+        m = np.sqrt(tick_to_sqrt_price(new_lower, spacing) * tick_to_sqrt_price(new_upper, spacing))
         x = np.zeros_like(m)
         y = np.zeros_like(m)
         
@@ -111,8 +96,7 @@ class DRDP0Strategy:
         y = np.clip(y, a_min=0, a_max=earned[...,1] * fraction)
         y[~inactive_limit_orders] = earned[~inactive_limit_orders, 1] * fraction
 
-        self.limit_order._lower_sqrt[inactive_limit_orders] = new_bounds[inactive_limit_orders, 0]
-        self.limit_order._upper_sqrt[inactive_limit_orders] = new_bounds[inactive_limit_orders, 1]
+        self.limit_order.rerange(new_lower, new_upper, mask=inactive_limit_orders, ticks=True, spacing=spacing)
         used = self.limit_order.mint(x, y)
 
         self.position._earned = earned - used
@@ -1,14 +1,14 @@
 import numpy as np
 
 from uniswap_simulator import Position
+from uniswap_simulator.tick_math import LOG_TICK_BASE, price_to_tick
 
 
 class LiquiditySilos():
 
     def __init__(self, price, lower, upper, fee):
         self.position = Position(price, lower, upper, fee)
-        self.half_width = (np.log(upper) - np.log(lower)) / \
-            (2 * np.log(1.0001))
+        self.half_width = np.rint((np.log(upper) - np.log(lower)) / (2 * LOG_TICK_BASE)).astype(np.int64)
 
         self.portion_in_uni = 1.0 - np.power(1.0001, -self.half_width / 2.0)
         print('{:.3f}% in Uniswap'.format(100 * self.portion_in_uni.mean()))
@@ -36,16 +36,10 @@ class LiquiditySilos():
     def update(self, price):
         amounts = self.position.update(price) + self.silos
 
-        center = np.log(price) / np.log(1.0001)
-        lower = center - self.half_width
-        upper = center + self.half_width
-        lower = np.power(1.0001, lower)
-        upper = np.power(1.0001, upper)
-
-        burned = self.position.burn()
+        center = price_to_tick(price)
+        burned = self.position.rerange(center - self.half_width, center + self.half_width, ticks=True)
         to_mint = (burned + self.silos) * self.portion_in_uni[..., np.newaxis]
 
-        self.position = Position(self.position._price, lower, upper, self.position.fee)
         used = self.position.mint(to_mint[..., 0], to_mint[..., 1])
         self.silos += burned - used
 
@@ -1,6 +1,7 @@
 import numpy as np
 
 from uniswap_simulator import Position
+from uniswap_simulator.tick_math import MIN_TICK, MAX_TICK, LOG_TICK_BASE, price_to_tick
 
 
 class SplitCompoundingStrategy():
@@ -11,8 +12,7 @@ class SplitCompoundingStrategy():
         self.position_l = Position(price, lower, price, fee)
         self.position_r = Position(price, price, upper, fee)
 
-        self.half_width = (np.log(upper) - np.log(lower)) / \
-            (2 * np.log(1.0001))
+        self.half_width = np.rint((np.log(upper) - np.log(lower)) / (2 * LOG_TICK_BASE)).astype(np.int64)
 
     def reset(self, price):
         self.position.reset(price)
@@ -29,54 +29,38 @@ class SplitCompoundingStrategy():
 
         self._compound(price)
 
-        center = np.log(price) / np.log(1.0001)
+        center = price_to_tick(price)
         lower = np.zeros_like(center)
         upper = np.zeros_like(center)
-        mask = center < 0.0
+        mask = center < 0
         lower[mask] = np.clip(center - self.half_width,
-                              a_min=-887272, a_max=None)[mask]
+                              a_min=MIN_TICK, a_max=None)[mask]
         upper[mask] = (lower + 2 * self.half_width)[mask]
         upper[~mask] = np.clip(center + self.half_width,
-                               a_min=None, a_max=+887272)[~mask]
+                               a_min=None, a_max=MAX_TICK)[~mask]
         lower[~mask] = (upper - 2 * self.half_width)[~mask]
-        lower = np.power(1.0001, lower)
-        upper = np.power(1.0001, upper)
 
-        burned = self.position.burn()
-        self.position = Position(price, lower, upper, self.position.fee)
-        used = self.position.mint(burned[..., 0], burned[..., 1])
-        self.position._earned = np.clip(burned - used, a_min=0, a_max=None)
+        self.position.burn_and_remint(lower, upper, ticks=True)
 
         return amounts
 
     def _compound(self, price, fraction=0.99):
-        earned = self.position._earned.copy()
-        earned += self.position_l.burn()
-        earned += self.position_r.burn()
-
-        edge = price.copy()
+        edge_l = price.copy()
         mask = price <= self.position.lower
-        edge[mask] = self.position.upper[mask]
-        mask = edge > self.position.upper
-        edge[mask] = self.position.upper[mask]
-        self.position_l = Position(
-            price,
-            self.position.lower,
-            edge,
-            self.position.fee
-        )
-
-        edge = price.copy()
+        edge_l[mask] = self.position.upper[mask]
+        mask = edge_l > self.position.upper
+        edge_l[mask] = self.position.upper[mask]
+
+        edge_r = price.copy()
         mask = price >= self.position.upper
-        edge[mask] = self.position.lower[mask]
-        mask = edge < self.position.lower
-        edge[mask] = self.position.lower[mask]
-        self.position_r = Position(
-            price,
-            edge,
-            self.position.upper,
-            self.position.fee
-        )
+        edge_r[mask] = self.position.lower[mask]
+        mask = edge_r < self.position.lower
+        edge_r[mask] = self.position.lower[mask]
+
+        # empty the compounding positions and move them next to the current price
+        earned = self.position._earned.copy()
+        earned += self.position_l.rerange(self.position.lower, edge_l)
+        earned += self.position_r.rerange(edge_r, self.position.upper)
 
         used = self.position_l.mint(np.zeros_like(earned[...,1]), earned[...,1] * fraction)
         used += self.position_r.mint(earned[...,0] * fraction, np.zeros_like(earned[...,0]))
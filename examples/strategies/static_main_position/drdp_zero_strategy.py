@@ -1,13 +1,9 @@
+from math import gcd
+
 import numpy as np
 
 from uniswap_simulator import Position
-
-
-def coerce_to_tick_spacing(spacing, ticks):
-    ticks = ticks.copy()
-    ticks[...,0] -= np.mod(ticks[...,0], spacing)
-    ticks[...,1] -= np.mod(ticks[...,1], spacing) - spacing
-    return ticks
+from uniswap_simulator.tick_math import floor_to_spacing, price_to_tick, tick_to_sqrt_price
 
 
 class DRDP0Strategy:
@@ -54,22 +50,16 @@ class DRDP0Strategy:
         amounts[...,0] *= price
         excess0 = amounts[...,0] > amounts[...,1]
         # compute active trading range (defined by lower and upper ticks)
-        active_ticks = np.log(price) / np.log(1.0001)
-        active_ticks = coerce_to_tick_spacing(
-            self._tick_spacing,
-            np.vstack((active_ticks, active_ticks)).T
-        )
+        active_lower = floor_to_spacing(price_to_tick(price), self._tick_spacing)
+        active_upper = active_lower + self._tick_spacing
 
         w = max(DRDP0Strategy.limit_order_width, self._tick_spacing)
-        new_bounds = np.zeros_like(active_ticks)
-        new_bounds[excess0, 0] = active_ticks[excess0, 1]
-        new_bounds[excess0, 1] = active_ticks[excess0, 1] + w
-        new_bounds[~excess0, 0] = active_ticks[~excess0, 0] - w
-        new_bounds[~excess0, 1] = active_ticks[~excess0, 0]
-        new_bounds = np.power(1.0001, new_bounds)
-        new_bounds = np.sqrt(new_bounds)
+        new_lower = np.where(excess0, active_upper, active_lower - w)
+        new_upper = np.where(excess0, active_upper + w, active_lower)
+        # every bound is a multiple of this, so sqrt prices can come from one (small) table
+        spacing = gcd(w, self._tick_spacing)
         
-        m = np.sqrt(new_bounds[...,0] * new_bounds[...,1])
+        m = np.sqrt(tick_to_sqrt_price(new_lower, spacing) * tick_to_sqrt_price(new_upper, spacing))
         x = np.zeros_like(m)
         y = np.zeros_like(m)
         
@@ -89,8 +79,7 @@ class DRDP0Strategy:
         y = np.clip(y, a_min=0, a_max=earned[...,1] * fraction)
         y[~inactive_limit_orders] = earned[~inactive_limit_orders, 1] * fraction
 
-        self.limit_order._lower_sqrt[inactive_limit_orders] = new_bounds[inactive_limit_orders, 0]
-        self.limit_order._upper_sqrt[inactive_limit_orders] = new_bounds[inactive_limit_orders, 1]
+        self.limit_order.rerange(new_lower, new_upper, mask=inactive_limit_orders, ticks=True, spacing=spacing)
         used = self.limit_order.mint(x, y)
 
         self.position._earned = earned - used
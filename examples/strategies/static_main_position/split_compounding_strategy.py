@@ -1,64 +1,76 @@
 import numpy as np
 
-from uniswap_simulator import Position
+from uniswap_simulator import PositionBook
 
 
 class SplitCompoundingStrategy():
     epsilon = 0.001
 
+    # indices into the position book
+    MAIN = 0
+    LEFT = 1
+    RIGHT = 2
+
     def __init__(self, price, lower, upper, fee):
-        self.position = Position(price, lower, upper, fee)
-        self.position_l = Position(price, lower, price, fee)
-        self.position_r = Position(price, price, upper, fee)
+        self.book = PositionBook(
+            price,
+            np.stack((lower, lower, price)),
+            np.stack((upper, price, upper)),
+            fee
+        )
+
+    @property
+    def position_bounds(self):
+        return self.book.lower[SplitCompoundingStrategy.MAIN], self.book.upper[SplitCompoundingStrategy.MAIN]
 
     def reset(self, price):
-        self.position.reset(price)
-        self.position_l = Position(price, self.position.lower, price, self.position.fee)
-        self.position_r = Position(price, price, self.position.upper, self.position.fee)
+        lower, upper = self.position_bounds
+        self.book.reset(price)
+        self.book.set_bounds(
+            np.stack((lower, price)),
+            np.stack((price, upper)),
+            index=slice(SplitCompoundingStrategy.LEFT, SplitCompoundingStrategy.RIGHT + 1)
+        )
 
     def mint(self, amount0, amount1):
-        return self.position.mint(amount0, amount1)
+        return self.book.mint(amount0, amount1, index=SplitCompoundingStrategy.MAIN)
 
     def update(self, price):
-        amounts = self.position.update(price)
-        amounts += self.position_l.update(price)
-        amounts += self.position_r.update(price)
+        amounts = self.book.update(price)
+        # like `Position.update`, leave the price the pool actually moved to in `price`
+        price[:] = self.book.price
 
         self._compound(price)
         return amounts
 
     def _compound(self, price, fraction=0.99):
-        earned = self.position._earned.copy()
-        earned += self.position_l.burn()
-        earned += self.position_r.burn()
-
-        edge = price.copy()
-        mask = price <= self.position.lower
-        edge[mask] = self.position.upper[mask]
-        mask = edge > self.position.upper
-        edge[mask] = self.position.upper[mask]
-        self.position_l = Position(
-            price,
-            self.position.lower,
-            edge,
-            self.position.fee
-        )
+        sides = slice(SplitCompoundingStrategy.LEFT, SplitCompoundingStrategy.RIGHT + 1)
+        earned = self.book.collectable[SplitCompoundingStrategy.MAIN].copy()
+        earned += self.book.burn(index=sides).sum(axis=0)
+        lower, upper = self.position_bounds
 
-        edge = price.copy()
-        mask = price >= self.position.upper
-        edge[mask] = self.position.lower[mask]
-        mask = edge < self.position.lower
-        edge[mask] = self.position.lower[mask]
-        self.position_r = Position(
-            price,
-            edge,
-            self.position.upper,
-            self.position.fee
-        )
+        edge_l = price.copy()
+        mask = price <= lower
+        edge_l[mask] = upper[mask]
+        mask = edge_l > upper
+        edge_l[mask] = upper[mask]
+
+        edge_r = price.copy()
+        mask = price >= upper
+        edge_r[mask] = lower[mask]
+        mask = edge_r < lower
+        edge_r[mask] = lower[mask]
+
+        self.book.set_bounds(np.stack((lower, edge_r)), np.stack((edge_l, upper)), index=sides)
 
-        used = self.position_l.mint(np.zeros_like(earned[...,1]), earned[...,1] * fraction)
-        used += self.position_r.mint(earned[...,0] * fraction, np.zeros_like(earned[...,0]))
+        zeros = np.zeros_like(earned[..., 0])
+        used = self.book.mint(
+            np.stack((zeros, earned[..., 0] * fraction)),
+            np.stack((earned[..., 1] * fraction, zeros)),
+            index=sides
+        ).sum(axis=0)
 
-        self.position._earned = earned - used
-        assert self.position._earned.min() >= -SplitCompoundingStrategy.epsilon, self.position._earned.min()
-        self.position._earned[self.position._earned < 0] = 0
+        self.book.collectable[SplitCompoundingStrategy.MAIN] = earned - used
+        main_earned = self.book.collectable[SplitCompoundingStrategy.MAIN]
+        assert main_earned.min() >= -SplitCompoundingStrategy.epsilon, main_earned.min()
+        main_earned[main_earned < 0] = 0
@@ -0,0 +1,299 @@
+"""
+Throughput and peak memory of the simulator's hot paths, over a grid of path and step counts.
+
+    python -m tests.benchmark            # print results
+    python -m tests.benchmark --save     # overwrite the baseline
+    python -m tests.benchmark --check    # fail if anything regressed past the threshold
+
+Throughput is in path-steps per second (best of several repeats); peak memory is the largest amount
+traced by `tracemalloc` during one run, which includes numpy's buffers. Results are only comparable
+on the same machine, so regenerate the baseline with `--save` wherever the checks are run. The
+compiled engines are only benchmarked when Numba is installed.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from uniswap_simulator import GeometricBrownianMotion, compare_to_hodl
+from uniswap_simulator.engine import resolve_engine
+from uniswap_simulator.liquidity_amounts import (
+    amounts_for_liquidity,
+    amounts_for_liquidity_fused,
+    liquidity_for_amounts,
+    liquidity_for_amounts_fused
+)
+from tests.factories import make_position, make_position_v2
+
+
+PATH_COUNTS = (100, 10000, 1000000)
+STEP_COUNTS = (10, 1000)
+# grid points with more path-steps than this are skipped, to keep memory and run time in check
+MAX_PATH_STEPS = 2 * 10 ** 7
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+# a benchmark regresses if throughput drops, or peak memory grows, by more than this fraction
+THRESHOLD = 0.25
+# each benchmark is repeated until it has run for at least this long (and at least 5 times)
+MIN_DURATION = 0.5
+
+
+def _prices(paths, steps):
+    return GeometricBrownianMotion(1, 0.1, 1.0, 1. / steps, 1.).sample(paths, rng=0)
+
+
+def _ranges(paths):
+    price_sqrt = np.ones(paths)
+    return price_sqrt, np.full(paths, 0.5), np.full(paths, 2.0)
+
+
+def bench_amounts_for_liquidity(paths, steps):
+    price_sqrt, lower_sqrt, upper_sqrt = _ranges(paths)
+    liquidity = np.full(paths, 1000.)
+
+    def run():
+        for _ in range(steps):
+            amounts_for_liquidity(price_sqrt, lower_sqrt, upper_sqrt, liquidity)
+    return run
+
+
+def bench_liquidity_for_amounts(paths, steps):
+    price_sqrt, lower_sqrt, upper_sqrt = _ranges(paths)
+    amount0 = np.full(paths, 1000.)
+    amount1 = np.full(paths, 1000.)
+
+    def run():
+        for _ in range(steps):
+            liquidity_for_amounts(price_sqrt, lower_sqrt, upper_sqrt, amount0, amount1)
+    return run
+
+
+def bench_amounts_for_liquidity_fused(paths, steps):
+    price_sqrt, lower_sqrt, upper_sqrt = _ranges(paths)
+    liquidity = np.full(paths, 1000.)
+    out = np.empty((paths, 2))
+
+    def run():
+        for _ in range(steps):
+            amounts_for_liquidity_fused(price_sqrt, lower_sqrt, upper_sqrt, liquidity, out=out)
+    return run
+
+
+def bench_liquidity_for_amounts_fused(paths, steps):
+    price_sqrt, lower_sqrt, upper_sqrt = _ranges(paths)
+    amount0 = np.full(paths, 1000.)
+    amount1 = np.full(paths, 1000.)
+    out = np.empty(paths)
+
+    def run():
+        for _ in range(steps):
+            liquidity_for_amounts_fused(price_sqrt, lower_sqrt, upper_sqrt, amount0, amount1, out=out)
+    return run
+
+
+def _bench_update(strategy_factory, paths, steps, method='update'):
+    prices = _prices(paths, steps)
+
+    def run():
+        position = strategy_factory(prices[0])
+        position.mint(np.full(paths, 1000.), np.full(paths, 1000.))
+        update = getattr(position, method)
+        # `update` writes to its argument
+        for price in prices.copy():
+            update(price)
+    return run
+
+
+def bench_position_update(paths, steps):
+    return _bench_update(make_position, paths, steps)
+
+
+def bench_position_update_inplace(paths, steps):
+    return _bench_update(make_position, paths, steps, 'update_inplace')
+
+
+def bench_position_v2_update(paths, steps):
+    return _bench_update(make_position_v2, paths, steps)
+
+
+def _block_runner(strategy_factory, paths, steps, method, engine):
+    prices = _prices(paths, steps)
+
+    def run():
+        position = strategy_factory(prices[0])
+        position.mint(np.full(paths, 1000.), np.full(paths, 1000.))
+        getattr(position, method)(prices[1:].copy(), engine=engine)
+    return run
+
+
+def _bench_block(strategy_factory, paths, steps, method, engine):
+    if engine == 'numba':
+        # compile before anything is measured
+        _block_runner(strategy_factory, 1, 2, method, engine)()
+    return _block_runner(strategy_factory, paths, steps, method, engine)
+
+
+def bench_position_simulate(paths, steps):
+    return _bench_block(make_position, paths, steps, 'simulate', 'numpy')
+
+
+def bench_position_run_numba(paths, steps):
+    return _bench_block(make_position, paths, steps, 'run', 'numba')
+
+
+def bench_position_simulate_numba(paths, steps):
+    return _bench_block(make_position, paths, steps, 'simulate', 'numba')
+
+
+def bench_position_v2_run_numba(paths, steps):
+    return _bench_block(make_position_v2, paths, steps, 'run', 'numba')
+
+
+def bench_gbm_sample(paths, steps):
+    gbm = GeometricBrownianMotion(1, 0.1, 1.0, 1. / steps, 1.)
+
+    def run():
+        gbm.sample(paths, rng=0)
+    return run
+
+
+def bench_compare_to_hodl(paths, steps):
+    prices = _prices(paths, steps)
+
+    def run():
+        position = make_position(prices[0])
+        compare_to_hodl(position, prices.copy(), 1.)
+    return run
+
+
+BENCHMARKS = {
+    'amounts_for_liquidity': bench_amounts_for_liquidity,
+    'amounts_for_liquidity_fused': bench_amounts_for_liquidity_fused,
+    'liquidity_for_amounts': bench_liquidity_for_amounts,
+    'liquidity_for_amounts_fused': bench_liquidity_for_amounts_fused,
+    'Position.update': bench_position_update,
+    'Position.update_inplace': bench_position_update_inplace,
+    'Position.simulate': bench_position_simulate,
+    'PositionV2.update': bench_position_v2_update,
+    'GeometricBrownianMotion.sample': bench_gbm_sample,
+    'compare_to_hodl': bench_compare_to_hodl,
+}
+if resolve_engine('auto') == 'numba':
+    BENCHMARKS.update({
+        'Position.run[engine=numba]': bench_position_run_numba,
+        'Position.simulate[engine=numba]': bench_position_simulate_numba,
+        'PositionV2.run[engine=numba]': bench_position_v2_run_numba,
+    })
+
+
+def grid():
+    for paths in PATH_COUNTS:
+        for steps in STEP_COUNTS:
+            if paths * steps <= MAX_PATH_STEPS:
+                yield paths, steps
+
+
+def key(name, paths, steps):
+    return '{}[paths={},steps={}]'.format(name, paths, steps)
+
+
+def measure(name, paths, steps):
+    run = BENCHMARKS[name](paths, steps)
+
+    tracemalloc.start()
+    try:
+        run()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    durations = []
+    while len(durations) < 5 or sum(durations) < MIN_DURATION:
+        start = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - start)
+
+    return {'throughput': paths * steps / min(durations), 'peak_memory': peak_memory}
+
+
+def run_all(names=None):
+    results = {}
+    for name in names or BENCHMARKS:
+        for paths, steps in grid():
+            results[key(name, paths, steps)] = measure(name, paths, steps)
+    return results
+
+
+def load_baseline(path=BASELINE):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def save_baseline(results, path=BASELINE):
+    with open(path, 'w') as f:
+        json.dump({
+            'machine': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'results': results
+        }, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def regressions(results, baseline, threshold=THRESHOLD):
+    """Returns a message for every result that is worse than its baseline by more than `threshold`."""
+    messages = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        if result['throughput'] < expected['throughput'] * (1 - threshold):
+            messages.append('{}: throughput {:.3g} is below baseline {:.3g}'.format(
+                name, result['throughput'], expected['throughput']))
+        if result['peak_memory'] > expected['peak_memory'] * (1 + threshold):
+            messages.append('{}: peak memory {} exceeds baseline {}'.format(
+                name, result['peak_memory'], expected['peak_memory']))
+    return messages
+
+
+def print_table(results, baseline=None):
+    print('{:<60} {:>14} {:>12} {:>8}'.format('benchmark', 'path-steps/s', 'peak MB', 'vs base'))
+    for name, result in results.items():
+        relative = ''
+        if baseline and name in baseline:
+            relative = '{:.2f}x'.format(result['throughput'] / baseline[name]['throughput'])
+        print('{:<60} {:>14.4g} {:>12.1f} {:>8}'.format(
+            name, result['throughput'], result['peak_memory'] / 2 ** 20, relative))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default: all)')
+    parser.add_argument('--save', action='store_true', help='write results to the baseline')
+    parser.add_argument('--check', action='store_true', help='exit with an error if anything regressed')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args(argv)
+
+    baseline = load_baseline()
+    results = run_all(args.names)
+    print_table(results, baseline)
+
+    if args.save:
+        save_baseline(results)
+    if args.check and baseline is not None:
+        messages = regressions(results, baseline, args.threshold)
+        for message in messages:
+            print(message, file=sys.stderr)
+        return 1 if messages else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
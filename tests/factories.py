@@ -0,0 +1,13 @@
+"""
+Strategy factories shared by the tests and benchmarks. They live in a module of their own, rather than
+being fixtures, so that they pickle by reference for worker processes.
+"""
+from uniswap_simulator import Position, PositionV2
+
+
+def make_position(price):
+    return Position(price, price / 4, price * 4, 1.0 / 100)
+
+
+def make_position_v2(price):
+    return PositionV2(price, 1.0 / 100)
@@ -0,0 +1,87 @@
+from importlib.util import find_spec
+
+import numpy as np
+import pytest
+
+from uniswap_simulator import adaptive_cells, adaptive_sweep
+from uniswap_simulator import adaptive
+from uniswap_simulator.adaptive import RunningMoments
+from uniswap_simulator.checkpoint import load_snapshot
+from uniswap_simulator.sweep import log_growth_cells
+from tests.factories import make_position
+
+
+ARGS = (1., [0., 0.5], [0.05, 1.5], 1. / 200., 1.)
+
+
+def test_running_moments_match_batch_statistics():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(3, 300))
+    y = x + rng.normal(size=(3, 300))
+
+    moments = RunningMoments(4)
+    for start, stop in ((0, 50), (50, 200), (200, 300)):
+        moments.add(np.array([0, 1, 3]), x[:, start:stop], y[:, start:stop])
+    mean_x, mean_y, stderr, stderr_diff = moments.estimate()
+
+    assert np.allclose(mean_x[[0, 1, 3]], x.mean(axis=1))
+    assert np.allclose(mean_y[[0, 1, 3]], y.mean(axis=1))
+    assert np.allclose(stderr[[0, 1, 3]], x.std(axis=1, ddof=1) / np.sqrt(300))
+    assert np.allclose(stderr_diff[[0, 1, 3]], (x - y).std(axis=1, ddof=1) / np.sqrt(300))
+    assert moments.n[2] == 0
+
+
+def test_paths_go_where_the_variance_is():
+    results = adaptive_cells(make_position, *ARGS, tolerance=0.05, batch_size=32, max_paths=512, rng=1)
+    paths = results[:, 4]
+
+    # the low-volatility cell is done after one round, the other one runs until it's done or out of paths
+    assert paths[0] == 32
+    assert paths[0] < paths[1] <= 512
+    assert results[1, 3] * 1.96 <= 0.05 or paths[1] == 512
+
+
+@pytest.mark.skipif(find_spec('scipy') is None, reason='requires scipy')
+def test_sobol_counts_paths_not_replicates():
+    results = adaptive_cells(make_position, *ARGS, tolerance=1e-9, batch_size=128, max_paths=256, rng=5,
+                             method='sobol')
+    assert np.array_equal(results[:, 4], [256, 256])
+
+
+def test_resumed_run_matches_uninterrupted_run(tmp_path, monkeypatch):
+    path = str(tmp_path / 'adaptive.npz')
+    kwargs = dict(tolerance=0.01, batch_size=32, max_paths=256, rng=2, method='antithetic', checkpoint=path)
+    expected = adaptive_cells(make_position, *ARGS, **dict(kwargs, checkpoint=None))
+
+    rounds = []
+
+    def crashing_log_growth_cells(*args, **kwargs):
+        rounds.append(None)
+        if len(rounds) == 3:
+            raise RuntimeError('pre-empted')
+        return log_growth_cells(*args, **kwargs)
+
+    # patched in the library, so that the crashing run has the same arguments as the resumed one
+    with monkeypatch.context() as patch:
+        patch.setattr(adaptive, 'log_growth_cells', crashing_log_growth_cells)
+        with pytest.raises(RuntimeError):
+            adaptive_cells(make_position, *ARGS, **kwargs)
+    assert int(load_snapshot(path)['round']) == 2
+
+    resumed = adaptive_cells(make_position, *ARGS, **kwargs)
+    assert np.array_equal(resumed, expected)
+
+    with pytest.raises(ValueError):
+        adaptive_cells(make_position, *ARGS, **dict(kwargs, rng=3))
+
+
+def test_adaptive_sweep_fills_grid():
+    x_grid, y_grid, z_grid = adaptive_sweep(make_position, *ARGS, tolerance=0.05, batch_size=16, max_paths=64,
+                                            cells_per_batch=3, seed=3, control_variate=True)
+    assert z_grid.shape == (2, 2, 5)
+    assert np.all((z_grid[..., 4] >= 16) & (z_grid[..., 4] <= 64))
+
+
+def test_batch_size_must_hold_whole_groups():
+    with pytest.raises(ValueError):
+        adaptive_cells(make_position, *ARGS, tolerance=0.05, batch_size=33, method='antithetic')
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from tests import benchmark
+
+
+# benchmarks take a few minutes and depend on the machine, so they only run when asked for
+requires_benchmarks = pytest.mark.skipif(
+    not os.environ.get('RUN_BENCHMARKS'),
+    reason='set RUN_BENCHMARKS=1 to run the benchmarks'
+)
+
+
+@requires_benchmarks
+@pytest.mark.parametrize('name', list(benchmark.BENCHMARKS))
+def test_no_regression(name):
+    baseline = benchmark.load_baseline()
+    if baseline is None:
+        pytest.skip('no baseline, create one with `python -m tests.benchmark --save`')
+
+    results = benchmark.run_all([name])
+    benchmark.print_table(results, baseline)
+    assert not benchmark.regressions(results, baseline)
+
+
+def test_regressions_are_detected():
+    baseline = {'f': {'throughput': 100., 'peak_memory': 1000}}
+
+    assert not benchmark.regressions({'f': {'throughput': 80., 'peak_memory': 1200}}, baseline, 0.25)
+    assert len(benchmark.regressions({'f': {'throughput': 70., 'peak_memory': 1300}}, baseline, 0.25)) == 2
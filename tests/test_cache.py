@@ -0,0 +1,111 @@
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+from uniswap_simulator import Position, sweep
+from uniswap_simulator.cache import ResultCache, fingerprint
+from tests.factories import make_position
+
+
+ARGS = (1., [0., 0.5], [0.5, 1.], 1. / 200., 1.)
+
+
+def make_wide_position(price):
+    return Position(price, price / 8, price * 8, 1.0 / 100)
+
+
+class CountingPosition(Position):
+    paths = 0
+
+    def __init__(self, price, *args):
+        CountingPosition.paths += len(price)
+        super().__init__(price, *args)
+
+
+def make_counting_position(price):
+    return CountingPosition(price, price / 4, price * 4, 1.0 / 100)
+
+
+def test_fingerprint_depends_on_code_and_configuration():
+    assert fingerprint(make_position, 1.) == fingerprint(make_position, 1.)
+    assert fingerprint(make_position, 1.) != fingerprint(make_position, 2.)
+    assert fingerprint(make_position) != fingerprint(make_wide_position)
+    assert fingerprint(np.arange(3)) != fingerprint(np.arange(3.))
+
+
+def test_fingerprint_is_stable_across_processes():
+    code = 'from tests.factories import make_position; from uniswap_simulator.cache import fingerprint; ' \
+           'print(fingerprint(make_position, [1., None]))'
+    env = dict(os.environ, PYTHONHASHSEED='123')
+    output = subprocess.check_output([sys.executable, '-c', code], env=env, universal_newlines=True)
+    assert output.strip() == fingerprint(make_position, [1., None])
+
+
+def test_put_get_and_evict(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert cache.get(cache.key('missing')) is None
+
+    keys = [cache.key(i) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, {'values': np.full(1000, i)})
+        os.utime(cache._path(key), (i, i))
+    assert np.array_equal(cache.get(keys[0])['values'], np.zeros(1000))
+
+    # reading the first entry made it the most recently used one
+    cache.evict(cache.size() - 1)
+    assert len(cache) == 2
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+
+
+def test_concurrent_writers(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = cache.key('shared')
+    threads = [threading.Thread(target=cache.put, args=(key, {'values': np.arange(10000)})) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert np.array_equal(cache.get(key)['values'], np.arange(10000))
+    assert os.listdir(os.path.dirname(cache._path(key))) == [key + '.npz']
+
+
+def test_sweep_only_simulates_new_cells(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    kwargs = dict(count=32, cells_per_batch=3, seed=4, control_variate=True)
+
+    CountingPosition.paths = 0
+    _, _, z_grid = sweep(make_counting_position, *ARGS, cache=cache, **kwargs)
+    assert CountingPosition.paths == 4 * 32
+    assert len(cache) == 4
+
+    # growing the grid only simulates the new column, and the old cells come back unchanged
+    CountingPosition.paths = 0
+    _, _, grown = sweep(make_counting_position, 1., [0., 0.5, 1.], [0.5, 1.], 1. / 200., 1., cache=cache, **kwargs)
+    assert CountingPosition.paths == 2 * 32
+    assert np.allclose(grown[:, :2], z_grid, rtol=1e-12, atol=0)
+
+    # cells don't depend on how they were batched
+    _, _, fresh = sweep(make_counting_position, *ARGS, cache=ResultCache(str(tmp_path / 'fresh')),
+                        **dict(kwargs, cells_per_batch=1))
+    assert np.allclose(fresh, z_grid, rtol=1e-12, atol=0)
+
+
+def test_sweep_cache_requires_seed(tmp_path):
+    with pytest.raises(ValueError):
+        sweep(make_position, *ARGS, count=8, cache=ResultCache(str(tmp_path)))
+
+
+def test_children_of_a_seed_sequence_are_cached_separately(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    first, second = np.random.SeedSequence(5).spawn(2)
+    a = sweep(make_position, *ARGS, count=16, seed=first, cache=cache)[2]
+    b = sweep(make_position, *ARGS, count=16, seed=second, cache=cache)[2]
+
+    assert len(cache) == 8
+    assert not np.any(a == b)
@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pytest
+
+from uniswap_simulator import GeometricBrownianMotion, Position, PositionV2, run_cells, sweep
+from uniswap_simulator.checkpoint import load_snapshot, log_growth_checkpointed, restore_state, snapshot_state
+from uniswap_simulator.compare_to_hodl import log_growth_streaming
+from tests.factories import make_position
+
+
+GBM = GeometricBrownianMotion(1, 0.2, 1.0, 1. / 1000., 1.)
+COUNT = 50
+
+
+class CrashingPosition(Position):
+    steps = 0
+
+    def update(self, price):
+        CrashingPosition.steps += 1
+        if CrashingPosition.steps == 700:
+            raise RuntimeError('pre-empted')
+        return super().update(price)
+
+
+def test_resumed_run_matches_uninterrupted_run(tmp_path):
+    path = str(tmp_path / 'run.npz')
+    price = np.ones(COUNT)
+    expected = log_growth_streaming(make_position(price), GBM.sample_blocks(COUNT, 64, rng=3))
+
+    with pytest.raises(RuntimeError):
+        crashing = CrashingPosition(price, price / 4, price * 4, 1.0 / 100)
+        log_growth_checkpointed(crashing, GBM.sample_blocks(COUNT, 64, rng=3), path, interval=128)
+
+    # the last snapshot is from somewhere in the middle of the trajectories
+    assert 0 < int(load_snapshot(path)['sampler/start']) < len(GBM)
+
+    resumed = log_growth_checkpointed(make_position(price), GBM.sample_blocks(COUNT, 64, rng=3), path, interval=128)
+    assert np.array_equal(resumed, expected)
+
+
+def test_run_cells_checkpoint(tmp_path):
+    path = str(tmp_path / 'cells.npz')
+    args = (make_position, 1, [0.0, 1.0], [0.5, 1.5], 1. / 1000., 1., COUNT)
+
+    expected = run_cells(*args, rng=0)
+    assert np.array_equal(run_cells(*args, rng=0, checkpoint=path, checkpoint_interval=100), expected)
+    # resuming a finished run only reads the final snapshot
+    assert np.array_equal(run_cells(*args, rng=0, checkpoint=path, checkpoint_interval=100), expected)
+    # but a snapshot of another run isn't resumed
+    with pytest.raises(ValueError):
+        run_cells(*args, rng=1, checkpoint=path, checkpoint_interval=100)
+
+
+def test_sweep_checkpoints_are_keyed_to_arguments(tmp_path):
+    args = (make_position, 1, [0.0, 1.0], [0.5, 1.5], 1. / 1000., 1.)
+    kwargs = dict(count=COUNT, seed=0, checkpoint_dir=str(tmp_path))
+
+    first = sweep(*args, **kwargs)[2]
+    assert np.array_equal(sweep(*args, **kwargs)[2], first)
+    assert len(os.listdir(str(tmp_path))) == 1
+
+    assert np.array_equal(sweep(*args, **dict(kwargs, seed=1))[2], sweep(*args, count=COUNT, seed=1)[2])
+    assert len(os.listdir(str(tmp_path))) == 2
+
+
+def test_position_v2_snapshot_round_trip():
+    price = np.ones(COUNT)
+    blocks = list(GBM.sample_blocks(COUNT, 500, rng=0))
+    position = PositionV2(price, 1.0 / 100)
+    position.mint(np.ones(COUNT), np.ones(COUNT))
+    position.run(blocks[0].copy())
+
+    copy = PositionV2(price, 1.0 / 100)
+    restore_state(copy, snapshot_state(position))
+    assert np.array_equal(copy.run(blocks[1].copy()), position.run(blocks[1].copy()))
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from uniswap_simulator import GeometricBrownianMotion, compare_to_hodl, compare_to_hodl_streaming
+from tests.factories import make_position, make_position_v2
+
+
+PRICES = GeometricBrownianMotion(1, 0.2, 1.5, 1. / 500., 1.).sample(30, rng=0)
+# uneven blocks, including single rows and an empty one
+SPLITS = [1, 2, 2, 9, 100, 101, 317]
+
+
+@pytest.mark.parametrize('strategy_factory', [make_position, make_position_v2])
+@pytest.mark.parametrize('engine', [None, 'auto'])
+def test_streaming_matches_full_array(strategy_factory, engine):
+    expected = compare_to_hodl(strategy_factory(PRICES[0]), PRICES.copy(), 1., engine, return_stderr=True)
+
+    blocks = np.split(PRICES.copy(), SPLITS)
+    assert sorted(len(block) for block in blocks)[:2] == [0, 1]
+    streamed = compare_to_hodl_streaming(strategy_factory(PRICES[0]), blocks, 1., engine, return_stderr=True)
+
+    assert np.array_equal(streamed, expected)
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from uniswap_simulator import GeometricBrownianMotion, Position, PositionV2
+from uniswap_simulator.engine import fee_band_filter
+
+pytest.importorskip('numba')
+
+
+GBM = GeometricBrownianMotion(1, 0.2, 1.5, 1. / 1000., 1.)
+COUNT = 64
+DTYPES = ['float64', 'float32']
+
+
+def make_prices(dtype):
+    # volatile enough for paths to leave [0.5, 2] and come back
+    return GBM.sample(COUNT, rng=0).astype(dtype)[1:]
+
+
+def make_position(dtype):
+    price = np.ones(COUNT)
+    position = Position(price, price / 2, price * 2, 1.0 / 100, dtype=dtype)
+    position.mint(np.ones(COUNT), np.ones(COUNT))
+    return position
+
+
+def make_position_v2(dtype):
+    position = PositionV2(np.ones(COUNT), 1.0 / 100, dtype=dtype)
+    position.mint(np.ones(COUNT), np.ones(COUNT))
+    return position
+
+
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_position_kernel_matches_update(dtype):
+    prices = make_prices(dtype)
+    expected_prices = prices.copy()
+    expected = make_position(dtype)
+    for price in expected_prices:
+        expected.update(price)
+
+    position = make_position(dtype)
+    position.run(prices, engine='numba')
+
+    assert np.array_equal(prices, expected_prices)
+    assert np.array_equal(position._price_sqrt, expected._price_sqrt)
+    assert np.array_equal(position.collectable, expected.collectable)
+    assert np.array_equal(position.amounts, expected.amounts)
+
+
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_position_v2_kernels_match_update(dtype):
+    prices = make_prices(dtype)
+    expected_prices = prices.copy()
+    expected = make_position_v2(dtype)
+    history = np.stack([expected.update(price) for price in expected_prices])
+
+    position = make_position_v2(dtype)
+    assert np.array_equal(position.simulate(prices.copy(), engine='numba'), history)
+
+    position = make_position_v2(dtype)
+    position.run(prices, engine='numba')
+    assert np.array_equal(prices, expected_prices)
+    assert np.array_equal(position.amounts, expected.amounts)
+    assert position.amounts.dtype == np.dtype(dtype)
+
+
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_fee_band_kernel_matches_numpy(dtype):
+    price_sqrt = np.ones(COUNT, dtype=dtype)
+    prices = make_prices(dtype)
+    expected_prices = prices.copy()
+    expected = fee_band_filter(expected_prices, price_sqrt, 1.0 / 100, engine='numpy')
+
+    out = fee_band_filter(prices, price_sqrt, 1.0 / 100, engine='numba')
+    assert out.dtype == expected.dtype
+    assert np.array_equal(prices, expected_prices)
+    assert np.array_equal(out, expected)
+
+
+MIXED = [('float64', 'float32'), ('float32', 'float64')]
+
+
+@pytest.mark.parametrize('prices_dtype, dtype', MIXED)
+@pytest.mark.parametrize('make', [make_position, make_position_v2])
+def test_mixed_dtypes_match_update(make, prices_dtype, dtype):
+    prices = make_prices(prices_dtype)
+    expected_prices = prices.copy()
+    expected = make(dtype)
+    for price in expected_prices:
+        expected.update(price)
+
+    with pytest.raises(ValueError, match='dtype'):
+        make(dtype).run(prices.copy(), engine='numba')
+
+    # 'auto' steps through `update` instead
+    position = make(dtype)
+    position.run(prices, engine='auto')
+    assert np.array_equal(prices, expected_prices)
+    assert np.array_equal(position.amounts, expected.amounts)
+
+
+@pytest.mark.parametrize('prices_dtype, dtype', MIXED)
+def test_fee_band_mixed_dtypes_match_numpy(prices_dtype, dtype):
+    price_sqrt = np.ones(COUNT, dtype=dtype)
+    prices = make_prices(prices_dtype)
+    expected_prices = prices.copy()
+    expected = fee_band_filter(expected_prices, price_sqrt, 1.0 / 100, engine='numpy')
+
+    out = fee_band_filter(prices, price_sqrt, 1.0 / 100, engine='auto')
+    assert np.array_equal(prices, expected_prices)
+    assert np.array_equal(out, expected)
@@ -0,0 +1,93 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from uniswap_simulator import sweep
+from uniswap_simulator.executor import FileTransport, LocalTransport, TCPTransport, WorkStealingQueue, run_tasks
+from tests.factories import make_position
+
+
+def square(x):
+    return x * x
+
+
+def fail_once(args):
+    # fails the first time it's called for a given marker file, in whichever process
+    x, marker = args
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        raise RuntimeError('transient failure')
+    return x
+
+
+def die_once(args):
+    x, marker = args
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return x
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def always_fail(x):
+    raise ValueError('bad task {}'.format(x))
+
+
+def test_work_stealing_queue():
+    tasks = WorkStealingQueue(range(8))
+
+    # the first worker takes the back half of the shared tasks, the second half of what's left
+    assert tasks.next('a') == 4
+    assert tasks.next('b') == 2
+    assert len(tasks) == 6
+
+    # a worker without tasks steals the back half of the largest deque, here a's [5, 6, 7]
+    assert tasks.next('c') == 6
+    assert tasks.next('c') == 7
+    assert tasks.next('a') == 5
+
+    tasks.remove_worker('b')
+    tasks.requeue(7)
+    assert sorted(tasks.next('c') for _ in range(len(tasks))) == [0, 1, 3, 7]
+    assert tasks.next('c') is None
+
+
+@pytest.mark.parametrize('make_transport', [
+    lambda tmp_path: LocalTransport(2),
+    lambda tmp_path: TCPTransport(workers=2),
+    lambda tmp_path: FileTransport(str(tmp_path / 'queue'), workers=2, timeout=5.),
+])
+def test_transports_run_all_tasks(tmp_path, make_transport):
+    assert run_tasks(square, list(range(10)), make_transport(tmp_path), poll_interval=0.01) == [x * x for x in range(10)]
+
+
+def test_file_workers_outlive_timeout(tmp_path):
+    # tasks longer than the heartbeat timeout only finish if the worker keeps beating while it runs them
+    transport = FileTransport(str(tmp_path / 'queue'), workers=1, timeout=0.5)
+    assert run_tasks(sleep, [2.], transport, retries=0, poll_interval=0.01) == [2.]
+
+
+def test_failed_tasks_are_retried(tmp_path):
+    args = [(x, str(tmp_path / 'raised_{}'.format(x))) for x in range(3)]
+    assert run_tasks(fail_once, args, LocalTransport(1), poll_interval=0.01) == [0, 1, 2]
+
+    args = [(x, str(tmp_path / 'died_{}'.format(x))) for x in range(3)]
+    assert run_tasks(die_once, args[:1], LocalTransport(1), poll_interval=0.01) == [0]
+
+
+def test_tasks_that_keep_failing_raise():
+    with pytest.raises(RuntimeError, match='bad task 1'):
+        run_tasks(always_fail, [1], LocalTransport(1), retries=1, poll_interval=0.01)
+
+
+def test_sweep_over_transport_matches_local_sweep():
+    args = (make_position, 1., [0., 0.5], [0.5, 1.], 1. / 200., 1.)
+    kwargs = dict(count=16, cells_per_batch=1, seed=4)
+    expected = sweep(*args, **kwargs)[2]
+    assert np.array_equal(sweep(*args, transport=TCPTransport(workers=2), **kwargs)[2], expected)
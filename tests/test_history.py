@@ -0,0 +1,63 @@
+import numpy as np
+
+from uniswap_simulator import BlockBootstrap, Position, PriceHistory, convert_csv
+from uniswap_simulator.checkpoint import restore_state, snapshot_state
+from uniswap_simulator.compare_to_hodl import log_growth_streaming
+
+
+def write_history(tmp_path, n=1001):
+    prices = np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.01, n)))
+    csv_path = str(tmp_path / 'history.csv')
+    with open(csv_path, 'w') as f:
+        f.write('timestamp,price\n')
+        for i, price in enumerate(prices):
+            f.write('{},{!r}\n'.format(i, float(price)))
+
+    npy_path = str(tmp_path / 'history.npy')
+    assert convert_csv(csv_path, npy_path, column='price', chunk_rows=100) == n
+    return prices, PriceHistory(npy_path)
+
+
+def test_history_is_streamed_in_blocks(tmp_path):
+    prices, history = write_history(tmp_path)
+
+    assert len(history) == len(prices)
+    assert np.array_equal(np.concatenate(list(history.blocks(64))), prices[:, np.newaxis])
+    assert np.allclose(history.log_returns(str(tmp_path / 'returns.npy'), chunk_rows=77), np.diff(np.log(prices)))
+
+    # a single historical path can be backtested like any other stream
+    position = Position(prices[:1], prices[:1] / 2, prices[:1] * 2, 1. / 100)
+    log_growth, log_growth_hodl = log_growth_streaming(position, history.blocks(64))
+    assert log_growth.shape == (1,)
+
+
+def test_bootstrap_draws_historical_returns(tmp_path):
+    prices, history = write_history(tmp_path)
+    returns = history.log_returns(str(tmp_path / 'returns.npy'))
+    bootstrap = BlockBootstrap(returns, 500, mean_block_length=20, x0=2.)
+
+    paths = np.concatenate(list(bootstrap.sample_blocks(30, 64, rng=0)))
+    assert paths.shape == (500, 30)
+    assert np.all(paths[0] == 2.)
+
+    sampled = np.diff(np.log(paths), axis=0)
+    assert np.isclose(sampled[..., np.newaxis], returns, rtol=0, atol=1e-9).any(axis=-1).all()
+
+    # consecutive returns mostly come from consecutive history, in blocks of ~20
+    positions = np.abs(sampled[..., np.newaxis] - returns).argmin(axis=-1)
+    continued = np.mean(np.diff(positions, axis=0) % len(returns) == 1)
+    assert 0.9 < continued < 0.99
+
+
+def test_bootstrap_sampler_snapshot(tmp_path):
+    returns = np.random.default_rng(1).normal(0, 0.01, 100)
+    bootstrap = BlockBootstrap(returns, 300, mean_block_length=10)
+
+    sampler = bootstrap.sample_blocks(8, 50, rng=3)
+    expected = [next(sampler) for _ in range(6)]
+
+    sampler = bootstrap.sample_blocks(8, 50, rng=3)
+    next(sampler), next(sampler)
+    resumed = bootstrap.sample_blocks(8, 50, rng=99)
+    restore_state(resumed, snapshot_state(sampler))
+    assert all(np.array_equal(a, b) for a, b in zip(resumed, expected[2:]))
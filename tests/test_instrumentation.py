@@ -0,0 +1,71 @@
+import json
+import tracemalloc
+
+from uniswap_simulator import GeometricBrownianMotion, Position, compare_to_hodl, instrumentation
+
+
+def run():
+    prices = GeometricBrownianMotion(1, 0.1, 1.0, 1. / 100., 1.).sample(20, rng=0)
+    compare_to_hodl(Position(prices[0], prices[0] / 2, prices[0] * 2, 1. / 100), prices, 1.)
+
+
+def test_nothing_is_recorded_by_default():
+    instrumentation.reset()
+    run()
+    assert instrumentation.summary() == {'timings': {}, 'counters': {}}
+
+
+def test_timings_and_counters():
+    instrumentation.reset()
+    with instrumentation.recording(track_memory=True):
+        run()
+    assert not instrumentation.is_enabled()
+
+    summary = json.loads(instrumentation.to_json())
+    assert summary['timings']['Position.update']['calls'] == 100
+    assert summary['timings']['HodlComparison.step']['peak_bytes'] > 0
+    assert summary['counters']['Position.path_steps'] == 100 * 20
+    assert 0 < summary['counters']['Position.fee_band_crossings'] <= 100 * 20
+    assert 'Position.update' in instrumentation.format_table()
+    instrumentation.reset()
+
+
+@instrumentation.timed
+def allocate(size):
+    return bytearray(size)
+
+
+@instrumentation.timed
+def allocate_then_call_inner():
+    # freed before the nested call resets tracemalloc's peak
+    allocate(2 ** 20)
+    allocate(2 ** 10)
+
+
+def test_nested_calls_keep_outer_peak():
+    instrumentation.reset()
+    with instrumentation.recording(track_memory=True):
+        allocate_then_call_inner()
+
+    timings = instrumentation.summary()['timings']
+    inner = timings['allocate']['peak_bytes']
+    outer = timings['allocate_then_call_inner']['peak_bytes']
+    assert inner >= 2 ** 20
+    assert outer >= 2 ** 20
+    instrumentation.reset()
+
+
+def test_tracing_started_by_the_caller_is_left_running():
+    tracemalloc.start()
+    try:
+        with instrumentation.recording(track_memory=True):
+            run()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+        instrumentation.reset()
+
+    with instrumentation.recording(track_memory=True):
+        run()
+    assert not tracemalloc.is_tracing()
+    instrumentation.reset()
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from uniswap_simulator.liquidity_amounts import amounts_for_liquidity, amounts_for_liquidity_fused, \
+    liquidity_for_amounts, liquidity_for_amounts_fused
+
+
+LOWER_SQRT = np.sqrt(0.64)
+UPPER_SQRT = np.sqrt(1.5625)
+# below, at the lower bound, inside, at the upper bound and above
+PRICE_SQRT = np.array([0.5, LOWER_SQRT, 0.9, 1.0, 1.1, UPPER_SQRT, 2.0])
+N = len(PRICE_SQRT)
+
+
+def test_amounts_match_masked_version():
+    lower = np.full(N, LOWER_SQRT)
+    upper = np.full(N, UPPER_SQRT)
+    liquidity = np.linspace(0., 5., N)
+
+    expected = amounts_for_liquidity(PRICE_SQRT, lower, upper, liquidity)
+    assert np.allclose(amounts_for_liquidity_fused(PRICE_SQRT, lower, upper, liquidity), expected, rtol=1e-15, atol=0)
+
+    out = np.full((N, 2), np.nan)
+    assert amounts_for_liquidity_fused(PRICE_SQRT, lower, upper, liquidity, out=out) is out
+    assert np.allclose(out, expected, rtol=1e-15, atol=0)
+
+
+# the masked version divides by zero at the bounds, and discards the results
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+def test_liquidity_matches_masked_version():
+    lower = np.full(N, LOWER_SQRT)
+    upper = np.full(N, UPPER_SQRT)
+    amount0 = np.linspace(0.5, 2., N)
+    amount1 = np.linspace(2., 0.5, N)
+
+    expected = liquidity_for_amounts(PRICE_SQRT, lower, upper, amount0, amount1)
+    assert np.allclose(liquidity_for_amounts_fused(PRICE_SQRT, lower, upper, amount0, amount1), expected,
+                       rtol=1e-15, atol=0)
+
+    # one of the amounts may be zero, as when minting out of range
+    zero = np.zeros(N)
+    assert np.allclose(liquidity_for_amounts_fused(PRICE_SQRT, lower, upper, amount0, zero),
+                       liquidity_for_amounts(PRICE_SQRT, lower, upper, amount0, zero), rtol=1e-15, atol=0)
+
+
+# the masked version divides by zero at the bounds, and discards the results
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+def test_amounts_broadcast_beyond_prices():
+    lower = np.full(N, LOWER_SQRT)
+    upper = np.full(N, UPPER_SQRT)
+    # one row of amounts per scenario, all over the same prices and ranges
+    amounts = np.linspace(0.5, 2., 3 * N).reshape(3, N)
+    price_sqrt, lower_2d, upper_2d = (np.broadcast_to(x, amounts.shape) for x in (PRICE_SQRT, lower, upper))
+
+    expected = liquidity_for_amounts(price_sqrt, lower_2d, upper_2d, amounts, amounts[::-1])
+    liquidity = liquidity_for_amounts_fused(PRICE_SQRT, lower, upper, amounts, amounts[::-1])
+    assert liquidity.shape == amounts.shape
+    assert np.allclose(liquidity, expected, rtol=1e-15, atol=0)
+
+    expected = amounts_for_liquidity(price_sqrt, lower_2d, upper_2d, amounts)
+    assert np.allclose(amounts_for_liquidity_fused(PRICE_SQRT, lower, upper, amounts), expected, rtol=1e-15, atol=0)
+
+
+def test_empty_range():
+    bound = np.full(N, LOWER_SQRT)
+    with pytest.raises(AssertionError):
+        amounts_for_liquidity(PRICE_SQRT, bound, bound, np.ones(N))
+
+    assert np.all(amounts_for_liquidity_fused(PRICE_SQRT, bound, bound, np.ones(N)) == 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        assert np.all(liquidity_for_amounts_fused(PRICE_SQRT, bound, bound, np.ones(N), np.ones(N)) == 0)
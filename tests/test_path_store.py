@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+
+from uniswap_simulator import GeometricBrownianMotion, PricePathStore, compare_to_hodl
+from uniswap_simulator.path_store import shared_memory
+from uniswap_simulator.sweep import compare_strategies
+from tests.factories import make_position, make_position_v2
+
+
+GBM = GeometricBrownianMotion(1, 0.2, 1.0, 1. / 500., 1.)
+COUNT = 20
+BACKENDS = [
+    'memmap',
+    pytest.param('shm', marks=pytest.mark.skipif(shared_memory is None, reason='requires Python 3.8+'))
+]
+
+
+def make_broken_strategy(price):
+    raise RuntimeError('bad strategy')
+
+
+def create(backend, tmp_path):
+    store = PricePathStore.create((len(GBM), COUNT), backend=backend, directory=str(tmp_path))
+    assert store.write(GBM.sample_blocks(COUNT, 64, rng=0)) == len(GBM)
+    return store
+
+
+def is_unlinked(handle):
+    backend, name, _, _ = handle
+    if backend == 'memmap':
+        return not os.path.exists(name)
+    try:
+        shared_memory.SharedMemory(name=name).close()
+    except FileNotFoundError:
+        return True
+    return False
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_attached_views_share_the_paths(backend, tmp_path):
+    with create(backend, tmp_path) as store:
+        assert np.array_equal(store.prices, GBM.sample(COUNT, rng=0))
+
+        attached = PricePathStore.attach(store.handle)
+        assert np.array_equal(attached.prices, store.prices)
+        with pytest.raises(ValueError):
+            attached.prices[0, 0] = 2.
+
+        # blocks are copies that strategies may write to
+        blocks = list(attached.blocks(100, paths=slice(5, 10)))
+        assert np.array_equal(np.concatenate(blocks), store.prices[:, 5:10])
+        blocks[0][:] = 0
+        assert np.all(store.prices[0] == 1)
+        attached.close()
+
+    assert is_unlinked(store.handle)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_compare_strategies_across_processes(backend, tmp_path):
+    factories = [make_position, make_position_v2]
+    with create(backend, tmp_path) as store:
+        results = compare_strategies(factories, store, 1., processes=2, block_size=64)
+        assert np.array_equal(results, compare_strategies(factories, store, 1., block_size=100))
+
+    for factory, result in zip(factories, results):
+        prices = GBM.sample(COUNT, rng=0)
+        assert np.allclose(result, compare_to_hodl(factory(prices[0]), prices, 1.), rtol=1e-12)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_store_is_unlinked_on_error(backend, tmp_path):
+    with pytest.raises(RuntimeError, match='bad strategy'):
+        with create(backend, tmp_path) as store:
+            compare_strategies([make_broken_strategy], store, 1., processes=2)
+    assert is_unlinked(store.handle)
@@ -0,0 +1,100 @@
+import time
+
+import numpy as np
+import pytest
+
+from uniswap_simulator import GeometricBrownianMotion, run_cells
+from uniswap_simulator.compare_to_hodl import log_growth_streaming
+from uniswap_simulator.pipeline import DoubleBuffer, prefetch
+from tests.factories import make_position
+
+
+GBM = GeometricBrownianMotion(1, 0.2, 1.0, 1. / 1000., 1.)
+
+
+def test_prefetched_run_matches_sequential_run():
+    expected = log_growth_streaming(make_position(np.ones(50)), GBM.sample_blocks(50, 64, rng=1))
+    result = log_growth_streaming(make_position(np.ones(50)), prefetch(GBM.sample_blocks(50, 64, rng=1)))
+    assert np.array_equal(result, expected)
+
+    args = (make_position, 1., [0., 0.5], [1., 1.], 1. / 500., 1., 32)
+    assert np.array_equal(
+        run_cells(*args, rng=2, price_bounds=(0.5, 2.), prefetch=True),
+        run_cells(*args, rng=2, price_bounds=(0.5, 2.))
+    )
+
+
+def test_producer_stays_at_most_one_block_ahead():
+    produced = []
+
+    def blocks():
+        for i in range(20):
+            produced.append(i)
+            yield np.full((3, 2), float(i))
+
+    buffers = set()
+    with DoubleBuffer(blocks()) as buffer:
+        for i, block in enumerate(buffer):
+            assert np.all(block == i)
+            assert len(produced) <= i + 2
+            buffers.add(block.__array_interface__['data'][0])
+    assert len(buffers) == 2
+
+
+@pytest.mark.parametrize('method', ['mc', 'antithetic'])
+def test_samplers_write_into_the_two_buffers(method):
+    # 150 steps in blocks of 64 leaves a shorter last block; an odd count leaves an unpaired antithetic path
+    expected = [block.copy() for block in GBM.sample_blocks(151, 65, rng=4, method=method)]
+    bounds = (0.8, 1.2)
+
+    buffers = set()
+    with DoubleBuffer(GBM.sample_blocks(151, 65, rng=4, method=method), price_bounds=bounds) as buffer:
+        blocks = []
+        for block in buffer:
+            blocks.append(block.copy())
+            buffers.add(block.__array_interface__['data'][0])
+
+    assert len(blocks) == len(expected)
+    for block, expected_block in zip(blocks, expected):
+        assert np.array_equal(block, np.clip(expected_block, *bounds))
+    # every block was generated straight into one of two buffers
+    assert len(buffers) == 2
+
+
+def test_next_block_fills_out():
+    gbm = GeometricBrownianMotion(1, 0.2, 1.0, 1. / 1000., 1., dtype='float32')
+    sampler = gbm.sample_blocks(10, 7, rng=5)
+    expected = list(gbm.sample_blocks(10, 7, rng=5))
+    out = np.empty((7, 10), dtype='float32')
+    block = sampler.next_block(out=out)
+    assert np.shares_memory(block, out)
+    assert np.array_equal(block, expected[0])
+
+
+def test_generation_overlaps_with_consumption():
+    def blocks():
+        for i in range(10):
+            time.sleep(0.02)
+            yield np.zeros(1)
+
+    start = time.perf_counter()
+    for _ in prefetch(blocks()):
+        time.sleep(0.02)
+    # sequentially this would take 0.4s
+    assert time.perf_counter() - start < 0.35
+
+
+def test_producer_errors_reach_consumer():
+    def blocks():
+        yield np.zeros(1)
+        raise RuntimeError('broken source')
+
+    with pytest.raises(RuntimeError, match='broken source'):
+        list(prefetch(blocks()))
+
+
+def test_closing_early_stops_producer():
+    buffer = DoubleBuffer(GBM.sample_blocks(10, 16, rng=3))
+    next(buffer)
+    buffer.close()
+    assert not buffer._thread.is_alive()
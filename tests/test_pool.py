@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from uniswap_simulator import Pool, Position
+from uniswap_simulator.liquidity_amounts import amounts_for_liquidity
+from uniswap_simulator.pool import TickBitmap
+from uniswap_simulator.tick_math import tick_to_sqrt_price
+
+
+N = 5
+RANGES = [(-1000, 1000, 5.), (-200, 300, 7.), (100, 2000, 3.), (-5000, -100, 11.)]
+
+
+def make_pool(fee=0.):
+    pool = Pool(np.ones(N), fee, tick_spacing=10)
+    for lower, upper, liquidity in RANGES:
+        pool.mint(lower, upper, liquidity)
+    return pool
+
+
+def value(price_sqrt):
+    return sum(amounts_for_liquidity(
+        price_sqrt,
+        tick_to_sqrt_price(np.full(N, lower)),
+        tick_to_sqrt_price(np.full(N, upper)),
+        np.full(N, liquidity)
+    ) for lower, upper, liquidity in RANGES)
+
+
+@pytest.mark.parametrize('spacing', [1, 60])
+def test_bitmap_matches_linear_scan(spacing):
+    rng = np.random.default_rng(spacing)
+    initialized = np.unique(rng.integers(-3000, 3000, 100) // spacing * spacing)
+    bitmap = TickBitmap(spacing)
+    bitmap.set(initialized)
+    ticks = rng.integers(-3500, 3500, 1000)
+
+    below, found = bitmap.next_initialized_tick_within_one_word(ticks, np.ones(len(ticks), dtype=bool))
+    for tick, next_tick, ok in zip(ticks, below, found):
+        skipped = initialized[(initialized >= next_tick) & (initialized <= tick)]
+        assert next_tick <= tick and (skipped.max() == next_tick if ok else len(skipped) == 0)
+
+    above, found = bitmap.next_initialized_tick_within_one_word(ticks, np.zeros(len(ticks), dtype=bool))
+    for tick, next_tick, ok in zip(ticks, above, found):
+        skipped = initialized[(initialized > tick) & (initialized <= next_tick)]
+        assert next_tick > tick and (skipped.min() == next_tick if ok else len(skipped) == 0)
+
+
+def test_swap_to_price_crosses_ticks():
+    pool = make_pool()
+    targets = np.array([0.5, 0.95, 1.02, 1.3, 1.0])
+
+    before = value(pool.price_sqrt)
+    amounts = pool.swap_to_price(targets)
+
+    assert np.allclose(pool.price, targets)
+    # without fees, what went into the pool is exactly the change in its reserves
+    assert np.allclose(amounts, value(pool.price_sqrt) - before)
+    assert np.array_equal(pool.liquidity, [0., 16., 15., 0., 12.])
+
+    # burning a range takes its liquidity out of the active set and releases its ticks
+    pool.burn(1)
+    assert np.array_equal(pool.liquidity, [0., 16., 8., 0., 5.])
+    assert -200 not in pool.initialized_ticks
+
+
+def test_exact_input_swap_charges_fee():
+    pool = make_pool(fee=0.003)
+    before = value(pool.price_sqrt)
+    amounts = pool.swap(2., zero_for_one=True)
+
+    assert np.allclose(amounts[:, 0], 2.)
+    assert np.allclose(value(pool.price_sqrt) - before, amounts * [1 - 0.003, 1])
+
+    amounts = pool.swap(100., zero_for_one=False, price_limit=1.01)
+    assert np.allclose(pool.price, 1.01)
+    assert np.all(amounts[:, 0] < 0) and np.all(amounts[:, 1] < 100.)
+
+
+def test_attached_positions_follow_the_pool():
+    price = np.ones(N)
+    position = Position(price, price / 2, price * 2, 0.003)
+    position.mint(np.full(N, 100.), np.full(N, 100.))
+
+    pool = make_pool(fee=0.003)
+    pool.attach(position)
+    liquidity = pool.liquidity
+    pool.run(np.array([[0.9, 0.99, 1.01, 1.1, 1.3]]))
+
+    assert np.allclose(np.square(position._price_sqrt), pool.price)
+    assert np.all(position.collectable.sum(axis=1) > 0)
+
+    pool.detach(position)
+    pool.swap_to_price(1.)
+    assert np.allclose(pool.liquidity, liquidity - position._liquidity)
+
+
+def test_fees_match_per_step_allocation():
+    fee = 0.003
+    ranges = [(-1000, 1000, 5.), (0, 2000, 7.), (-600, 1500, 2.)]
+    boundaries = sorted({tick for lower, upper, _ in ranges for tick in (lower, upper)})
+    path = [500, 1500, 1800, 1200, 300, -500, -900, 100]
+
+    pool = Pool(np.ones(1), fee, tick_spacing=10)
+    ids = [pool.mint(lower, upper, liquidity)[0] for lower, upper, liquidity in ranges]
+    expected = np.zeros((len(ranges), 2))
+
+    tick = 0
+    for target in path:
+        # split each move at range boundaries, so that the active ranges are fixed within each part
+        crossed = [b for b in boundaries if min(tick, target) < b < max(tick, target)]
+        for stop in sorted(crossed, reverse=target < tick) + [target]:
+            mid = (tick + stop) / 2
+            active = [liquidity if lower <= mid < upper else 0. for lower, upper, liquidity in ranges]
+            amounts = pool.swap_to_price(1.0001 ** stop)[0]
+            fees = np.clip(amounts, 0, None) * fee
+            expected += np.outer(active, fees) / max(sum(active), 1e-300)
+            tick = stop
+
+        # touching positions part way through doesn't change what they end up with
+        if target == 1200:
+            expected[1] -= pool.collect(ids[1])[0]
+
+    collected = np.array([pool.collect(i)[0] for i in ids])
+    assert np.allclose(collected, expected, rtol=1e-9)
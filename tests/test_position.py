@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from uniswap_simulator import GeometricBrownianMotion, Position
+
+
+COUNT = 40
+# volatile enough, and with ranges narrow enough, for paths to leave their range on both sides and come back
+PRICES = GeometricBrownianMotion(1, 0.1, 2.0, 1. / 500., 1.).sample(COUNT, rng=0)[1:]
+
+
+def make_position():
+    price = np.ones(COUNT)
+    width = np.linspace(1.2, 3.0, COUNT)
+    position = Position(price, price / width, price * width, 1.0 / 100)
+    position.mint(np.ones(COUNT), np.ones(COUNT))
+    return position
+
+
+def test_prices_leave_the_range():
+    position = make_position()
+    assert np.any(PRICES.min(axis=0) < position.lower)
+    assert np.any(PRICES.max(axis=0) > position.upper)
+
+
+def test_update_inplace_matches_update():
+    expected = make_position()
+    position = make_position()
+
+    for price in PRICES:
+        amounts = expected.update(price.copy())
+        price_copy = price.copy()
+        assert np.array_equal(position.update_inplace(price_copy), amounts)
+        # the price itself is left alone
+        assert np.array_equal(price_copy, price)
+
+    assert np.array_equal(position._price_sqrt, expected._price_sqrt)
+    assert np.array_equal(position.collectable, expected.collectable)
+
+
+def test_update_inplace_mixed_with_update_mint_and_burn():
+    expected = make_position()
+    position = make_position()
+
+    for t, price in enumerate(PRICES):
+        amounts = expected.update(price.copy())
+        if t % 3 == 0:
+            assert np.array_equal(position.update(price.copy()), amounts)
+        else:
+            assert np.array_equal(position.update_inplace(price.copy()), amounts)
+
+        if t == 100:
+            assert np.array_equal(position.burn(0.5), expected.burn(0.5))
+        if t == 200:
+            assert np.array_equal(position.mint(np.ones(COUNT), np.ones(COUNT)),
+                                  expected.mint(np.ones(COUNT), np.ones(COUNT)))
+
+    assert np.array_equal(position.amounts, expected.amounts)
+    assert np.array_equal(position.burn(), expected.burn())
+
+
+def test_update_active_matches_update():
+    expected = make_position()
+    position = make_position()
+    fractions = []
+
+    for t, price in enumerate(PRICES):
+        amounts = expected.update(price.copy())
+        if t % 5 == 0:
+            assert np.array_equal(position.update(price.copy()), amounts)
+        else:
+            assert np.array_equal(position.update_active(price.copy()), amounts)
+            fractions.append(position.active_fraction)
+
+        if t == 100:
+            assert np.array_equal(position.burn(0.5), expected.burn(0.5))
+
+    assert np.array_equal(position._price_sqrt, expected._price_sqrt)
+    assert np.array_equal(position.collectable, expected.collectable)
+    # paths inside the fee band or outside their range are skipped
+    assert 0 < np.mean(fractions) < 1
+
+
+def test_simulate_matches_update():
+    expected = make_position()
+    expected_prices = PRICES.copy()
+    history = np.stack([expected.update(price) for price in expected_prices])
+
+    # starting part of the way in, so that fees earned before are carried over
+    position = make_position()
+    for price in PRICES[:50]:
+        position.update(price.copy())
+    prices = PRICES[50:].copy()
+    simulated = position.simulate(prices)
+
+    # like update, rows are overwritten with the prices the pool moved to
+    assert np.array_equal(prices, expected_prices[50:])
+    assert np.array_equal(simulated, history[50:])
+    assert np.array_equal(position._price_sqrt, expected._price_sqrt)
+    assert np.array_equal(position.collectable, expected.collectable)
+    assert np.array_equal(position.burn(), expected.burn())
+
+
+def test_move_to_copies_prices():
+    position = make_position()
+    price_sqrt = np.sqrt(PRICES[0])
+    position.move_to(price_sqrt)
+    position.update_inplace(PRICES[1].copy())
+    assert np.array_equal(price_sqrt, np.sqrt(PRICES[0]))
+
+
+def test_bounds_are_read_only_and_kept_across_rerange():
+    position = make_position()
+    lower, upper = position.lower, position.upper
+    expected_lower, expected_upper = lower.copy(), upper.copy()
+    with pytest.raises(ValueError):
+        lower[0] = 0.
+
+    position.update_inplace(PRICES[0].copy())
+    position.rerange(lower / 2, upper * 2)
+    assert np.array_equal(lower, expected_lower) and np.array_equal(upper, expected_upper)
+    assert np.allclose(position.lower, expected_lower / 2) and np.allclose(position.upper, expected_upper * 2)
@@ -0,0 +1,79 @@
+import numpy as np
+
+from uniswap_simulator import GeometricBrownianMotion, Position, PositionBook
+from uniswap_simulator.tick_math import tick_to_price
+
+
+COUNT = 40
+PRICES = GeometricBrownianMotion(1, 0.1, 2.0, 1. / 500., 1.).sample(COUNT, rng=0)[1:]
+WIDTHS = np.array([1.2, 2.0, 4.0])[:, np.newaxis]
+
+
+def value(amounts, price):
+    return amounts[..., 0] * price + amounts[..., 1]
+
+
+def test_book_matches_separate_positions():
+    price = np.ones(COUNT)
+    book = PositionBook(price, price / WIDTHS, price * WIDTHS, 1.0 / 100)
+    positions = [Position(price, price / width, price * width, 1.0 / 100) for width in WIDTHS]
+
+    amount0 = np.linspace(0.5, 1.5, COUNT)
+    used = book.mint(amount0, np.ones(COUNT))
+    for k, position in enumerate(positions):
+        assert np.allclose(used[k], position.mint(amount0, np.ones(COUNT)), rtol=1e-12)
+
+    for t, price in enumerate(PRICES):
+        total = book.update(price)
+        moved = [price.copy() for _ in positions]
+        amounts = [position.update(p) for position, p in zip(positions, moved)]
+
+        # the price the pool moved to is the one every position moved to
+        assert all(np.array_equal(book.price, p) for p in moved)
+        assert np.allclose(total, sum(amounts), rtol=1e-12)
+
+        if t == 300:
+            burned = book.burn(0.5, index=1)
+            assert np.allclose(burned, positions[1].burn(0.5), rtol=1e-12)
+
+    assert np.allclose(book.amounts, [position.amounts for position in positions], rtol=1e-12)
+    assert np.allclose(book.collectable, [position.collectable for position in positions], rtol=1e-12)
+
+
+def make_position():
+    price = np.ones(COUNT)
+    position = Position(price, price / 2, price * 2, 1.0 / 100)
+    position.mint(np.ones(COUNT), np.ones(COUNT))
+    for price in PRICES[:300]:
+        position.update(price.copy())
+    return position
+
+
+def test_rerange_burns_everything_at_its_value():
+    position = make_position()
+    before = position.amounts
+    price = position._price
+
+    mask = np.arange(COUNT) % 2 == 0
+    burned = position.rerange(price / 3, price * 3, mask=mask)
+
+    assert np.allclose(burned[mask], before[mask], rtol=1e-12)
+    assert np.all(burned[~mask] == 0)
+    assert np.all(position.amounts[mask] == 0)
+    assert np.allclose(position.amounts[~mask], before[~mask], rtol=1e-12)
+    assert np.allclose(position.lower[mask], price[mask] / 3, rtol=1e-12)
+    assert np.allclose(position.lower[~mask], 0.5, rtol=1e-12)
+
+
+def test_burn_and_remint_preserves_value_net_of_fees():
+    position = make_position()
+    price = position._price
+    before = value(position.amounts, price)
+
+    # what can't be minted at the new bounds stays collectable
+    ticks = np.floor(np.log(price) / np.log(1.0001)).astype(int)
+    used = position.burn_and_remint(ticks - 600, ticks + 600, ticks=True)
+
+    assert np.allclose(value(position.amounts, price), before, rtol=1e-12)
+    assert np.all(value(used, price) <= before * (1 + 1e-12))
+    assert np.allclose(position.upper, tick_to_price(ticks + 600), rtol=1e-12)
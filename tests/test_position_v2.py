@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from uniswap_simulator import GeometricBrownianMotion, PositionV2
+
+
+COUNT = 40
+PRICES = GeometricBrownianMotion(1, 0.1, 2.0, 1. / 500., 1.).sample(COUNT, rng=0)[1:]
+
+
+class BaselinePositionV2:
+    """The original per-step implementation, with separate x, y and k arrays."""
+
+    def __init__(self, price, fee):
+        self._price_sqrt = np.sqrt(price)
+        self._fee = fee
+        self._gamma = 1. - fee
+        self._k = np.zeros_like(price)
+        self._x = np.zeros_like(price)
+        self._y = np.zeros_like(price)
+
+    @property
+    def _price(self):
+        return np.square(self._price_sqrt)
+
+    @property
+    def amounts(self):
+        return np.vstack((self._x, self._y)).T
+
+    def update(self, price):
+        should_update = np.any((
+            price / self._price > 1. / (1. - self._fee),
+            price / self._price < 1. - self._fee
+        ), axis=0)
+        price[~should_update] = self._price[~should_update]
+        price_sqrt = np.sqrt(price)
+
+        mask = price > self._price
+
+        a = -self._x * (2. - self._fee) + np.sqrt(np.square(self._x * self._fee) + 4 * self._gamma * self._k / price)
+        a /= 2. * self._gamma
+        b = -self._y * (2. - self._fee) + np.sqrt(np.square(self._y * self._fee) + 4 * self._gamma * self._k * price)
+        b /= 2. * self._gamma
+
+        self._x[~mask] += a[~mask]
+        self._y[~mask] = price[~mask] * self._x[~mask]
+        self._y[mask] += b[mask]
+        self._x[mask] = self._y[mask] / price[mask]
+
+        self._x = np.clip(self._x, a_min=0, a_max=None)
+        self._y = np.clip(self._y, a_min=0, a_max=None)
+
+        self._k = self._x * self._y
+        self._price_sqrt = price_sqrt
+        return self.amounts
+
+    def mint(self, amount0, amount1):
+        value = np.minimum(amount0 * self._price, amount1)
+        self._x += value / self._price
+        self._y += value
+        self._k = self._x * self._y
+        return np.vstack((value / self._price, value)).T
+
+
+def make(cls):
+    position = cls(np.ones(COUNT), 1.0 / 100)
+    position.mint(np.full(COUNT, 2.), np.ones(COUNT))
+    return position
+
+
+def baseline_history():
+    baseline = make(BaselinePositionV2)
+    prices = PRICES.copy()
+    return baseline, prices, np.stack([baseline.update(price) for price in prices])
+
+
+def test_update_matches_baseline():
+    baseline, prices, history = baseline_history()
+    position = make(PositionV2)
+
+    for price, amounts in zip(PRICES, history):
+        assert np.array_equal(position.update(price.copy()), amounts)
+    assert np.array_equal(position._price_sqrt, baseline._price_sqrt)
+    assert np.array_equal(position.mint(np.ones(COUNT), np.ones(COUNT)), baseline.mint(np.ones(COUNT), np.ones(COUNT)))
+
+
+@pytest.mark.parametrize('engine', ['numpy', 'vectorized'])
+def test_batch_run_and_simulate_match_baseline(engine):
+    baseline, expected_prices, history = baseline_history()
+
+    position = make(PositionV2)
+    prices = PRICES.copy()
+    assert np.array_equal(position.simulate(prices, engine=engine), history)
+    assert np.array_equal(prices, expected_prices)
+
+    position = make(PositionV2)
+    assert np.array_equal(position.run(PRICES.copy(), engine=engine), baseline.amounts)
+    assert np.array_equal(position._k, baseline._k)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from uniswap_simulator import GeometricBrownianMotion, Position, PositionV2, run_cells
+from uniswap_simulator.precision import ACCUMULATOR_DTYPE, get_dtype, resolve_dtype, use_dtype
+from tests.factories import make_position, make_position_v2
+
+
+# reference sweep: a small (mu, sigma) grid covering calm and very volatile cells
+MUS, SIGMAS = (grid.ravel() for grid in np.meshgrid([-0.5, 0.0, 1.0], [0.2, 1.0, 2.0]))
+DT = 1. / 1000.
+T = 1.
+COUNT = 200
+
+# largest acceptable |G_float32 - G_float64|; observed errors are around 1e-6
+G_TOLERANCE = 1e-4
+
+
+@pytest.mark.parametrize('strategy_factory', [make_position, make_position_v2])
+@pytest.mark.parametrize('engine', [None, 'auto'])
+def test_float32_matches_float64_on_reference_sweep(strategy_factory, engine):
+    results = {
+        dtype: run_cells(strategy_factory, 1, MUS, SIGMAS, DT, T, COUNT, rng=0, engine=engine, dtype=dtype)
+        for dtype in ('float64', 'float32')
+    }
+    g_error, g_hodl_error = np.abs(results['float32'] - results['float64']).max(axis=0)
+    assert g_error < G_TOLERANCE
+    assert g_hodl_error < G_TOLERANCE
+
+
+def test_objects_follow_dtype_policy():
+    price = np.ones(10)
+
+    with use_dtype('float32'):
+        position = Position(price, price / 2, price * 2, 1.0 / 100)
+        position_v2 = PositionV2(price, 1.0 / 100)
+        block = next(GeometricBrownianMotion(1, 0.1, 0.5, DT, T).sample_blocks(10, 100, rng=0))
+
+    assert get_dtype() == np.float64
+    assert position._price_sqrt.dtype == np.float32
+    assert position._liquidity.dtype == np.float32
+    assert position_v2.amounts.dtype == np.float32
+    assert block.dtype == np.float32
+
+    # fees accumulate in full precision regardless
+    position.mint(np.ones(10), np.ones(10))
+    position.update(np.full(10, 1.5, dtype=np.float32))
+    assert position.collectable.dtype == ACCUMULATOR_DTYPE
+
+
+def test_float32_chunked_sampling_is_bit_identical():
+    gbm = GeometricBrownianMotion(1, 0.1, 0.5, DT, T, dtype='float32')
+    chunked = np.concatenate(list(gbm.sample_blocks(50, 37, rng=1)))
+
+    assert chunked.dtype == np.float32
+    assert np.array_equal(chunked, gbm.sample(50, rng=1))
+
+
+def test_unsupported_dtype_is_rejected():
+    with pytest.raises(ValueError):
+        resolve_dtype('float16')
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from uniswap_simulator.tick_math import MIN_TICK, MAX_TICK, ceil_to_spacing, floor_to_spacing, price_to_tick, \
+    tick_to_price, tick_to_sqrt_price
+
+
+def test_table_matches_direct_evaluation():
+    ticks = np.random.default_rng(0).integers(MIN_TICK, MAX_TICK, size=1000)
+    assert np.array_equal(tick_to_sqrt_price(ticks), np.sqrt(tick_to_price(ticks)))
+
+    ticks = floor_to_spacing(ticks, 60)
+    assert np.array_equal(tick_to_sqrt_price(ticks, 60), np.sqrt(tick_to_price(ticks)))
+
+
+def test_out_of_range_ticks_are_clamped():
+    assert tick_to_sqrt_price(MAX_TICK + 10) == np.sqrt(tick_to_price(MAX_TICK))
+    assert tick_to_sqrt_price(MIN_TICK - 10) == np.sqrt(tick_to_price(MIN_TICK))
+
+
+def test_misaligned_ticks_are_rejected():
+    with pytest.raises(ValueError, match='multiples of the table spacing 60'):
+        tick_to_sqrt_price(np.array([0, 60, 90]), 60)
+    with pytest.raises(ValueError, match='integers'):
+        tick_to_sqrt_price(np.array([0., 60.]), 60)
+
+
+def test_price_to_tick_and_spacing():
+    ticks = np.array([-887272, -61, -1, 0, 1, 59, 60, 887272])
+    assert np.array_equal(price_to_tick(tick_to_price(ticks) * 1.00001), ticks)
+
+    assert np.array_equal(floor_to_spacing(ticks, 60), [-887280, -120, -60, 0, 0, 0, 60, 887220])
+    assert np.array_equal(ceil_to_spacing(ticks, 60), [-887220, -60, 0, 0, 60, 60, 60, 887280])
@@ -0,0 +1,91 @@
+from importlib.util import find_spec
+
+import numpy as np
+import pytest
+
+from uniswap_simulator import GeometricBrownianMotion, compare_to_hodl, run_cells, sweep
+from uniswap_simulator.compare_to_hodl import estimate_growth, expected_hodl_log_growth
+from tests.factories import make_position
+
+
+GBM = GeometricBrownianMotion(1, 0.3, 1.0, 1. / 1000., 1.)
+
+
+def test_antithetic_paths_mirror_each_other():
+    prices = GBM.sample(64, rng=1, method='antithetic')
+    drift = 2 * (0.3 - 0.5) * GBM._dt * np.arange(len(GBM))[:, np.newaxis]
+    assert np.allclose(np.log(prices[:, ::2]) + np.log(prices[:, 1::2]), drift)
+
+
+@pytest.mark.skipif(find_spec('scipy') is None, reason='requires scipy')
+def test_sobol_blocks_match_full_sample():
+    prices = GBM.sample(64, rng=2, method='sobol')
+    blocks = list(GBM.sample_blocks(64, 100, rng=2, method='sobol'))
+
+    assert prices.shape == (len(GBM), 64)
+    assert np.all(prices[0] == 1)
+    assert np.array_equal(np.concatenate(blocks, axis=0), prices)
+
+
+@pytest.mark.skipif(find_spec('scipy') is None, reason='requires scipy')
+def test_sobol_reduces_error_of_terminal_mean():
+    t = (len(GBM) - 1) * GBM._dt
+    expected = np.exp(0.3 * t)
+    errors = {
+        method: np.std([GBM.sample(256, rng=seed, method=method)[-1].mean() - expected for seed in range(8)])
+        for method in ('mc', 'sobol')
+    }
+    assert errors['sobol'] < errors['mc'] / 3
+
+
+def test_expected_hodl_log_growth_matches_monte_carlo():
+    rng = np.random.default_rng(0)
+    mu, sigma, t = 0.3, 1.0, 0.999
+    log_return = (mu - 0.5 * sigma ** 2) * t + sigma * np.sqrt(t) * rng.standard_normal(1000000)
+    sample = np.log((1 + np.exp(log_return)) / 2)
+
+    assert abs(expected_hodl_log_growth(mu, sigma, t) - sample.mean()) < 4 * sample.std() / 1000
+    assert expected_hodl_log_growth(np.array([mu, mu]), np.array([sigma, 0.]), t).shape == (2,)
+
+
+def test_control_variate_keeps_mean_and_reduces_stderr():
+    rng = np.random.default_rng(1)
+    hodl = rng.normal(size=(3, 4000))
+    strategy = 0.5 + 2 * hodl + 0.1 * rng.normal(size=(3, 4000))
+
+    G, G_hodl, G_se, G_hodl_se = estimate_growth(strategy, hodl, 2., np.zeros(3))
+    plain = estimate_growth(strategy, hodl, 2.)
+
+    assert np.allclose(G, 0.25, atol=4 * G_se)
+    assert np.all(G_hodl == 0) and np.all(G_hodl_se == 0)
+    assert np.all(G_se < plain[2] / 10)
+
+
+def test_stderr_is_returned_on_request():
+    prices = GBM.sample(32, rng=3)
+    assert len(compare_to_hodl(make_position(prices[0]), prices, 1.)) == 2
+    G, G_hodl, G_se, G_hodl_se = compare_to_hodl(make_position(prices[0]), prices, 1., return_stderr=True)
+    assert G_se > 0 and G_hodl_se > 0
+
+    results = run_cells(make_position, 1., [0.1, 0.3], [1., 1.], 1. / 1000., 1., 16, rng=4,
+                        method='antithetic', control_variate=True, return_stderr=True)
+    assert results.shape == (2, 4)
+    assert np.allclose(results[:, 1], expected_hodl_log_growth(np.array([0.1, 0.3]), 1., 0.999))
+
+
+def test_antithetic_estimates_need_an_even_path_count():
+    log_growth = np.zeros((2, 15))
+    with pytest.raises(ValueError, match='even number of paths, got 15'):
+        estimate_growth(log_growth, log_growth, 1., antithetic=True)
+    with pytest.raises(ValueError, match='got 15'):
+        sweep(make_position, 1., [0.1], [1.], 1. / 1000., 1., 15, method='antithetic')
+
+
+@pytest.mark.parametrize('method', ['mc', 'antithetic'])
+def test_reported_stderr_matches_spread_across_seeds(method):
+    results = np.array([
+        run_cells(make_position, 1., [0.3], [1.], 1. / 200., 1., 64, rng=seed, method=method, return_stderr=True)[0]
+        for seed in range(40)
+    ])
+    ratio = results[:, 2:].mean(axis=0) / results[:, :2].std(axis=0, ddof=1)
+    assert np.all((ratio > 0.7) & (ratio < 1.4))
@@ -1,4 +1,13 @@
-from uniswap_simulator.gbm import GeometricBrownianMotion
+from uniswap_simulator.gbm import GeometricBrownianMotion, spawn_generators
 from uniswap_simulator.position import Position
 from uniswap_simulator.position_v2 import PositionV2
-from uniswap_simulator.compare_to_hodl import compare_to_hodl
+from uniswap_simulator.position_book import PositionBook
+from uniswap_simulator.pool import Pool
+from uniswap_simulator.compare_to_hodl import compare_to_hodl, compare_to_hodl_streaming
+from uniswap_simulator.path_store import PricePathStore
+from uniswap_simulator.history import PriceHistory, BlockBootstrap, convert_csv
+from uniswap_simulator.sweep import sweep, run_cells, compare_strategies
+from uniswap_simulator.adaptive import adaptive_sweep, adaptive_cells
+from uniswap_simulator.cache import ResultCache
+from uniswap_simulator import instrumentation
+from uniswap_simulator.tick_math import price_to_tick, tick_to_price, tick_to_sqrt_price
@@ -0,0 +1,4 @@
+from uniswap_simulator.executor import main
+
+
+main()
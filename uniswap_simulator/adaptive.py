@@ -0,0 +1,225 @@
+"""
+Adaptive path counts. Instead of simulating a fixed number of paths in every (mu, sigma) cell,
+`adaptive_cells` simulates cells in rounds of `batch_size` paths and keeps going only in the cells
+whose estimate of G - G_hodl is still too uncertain, so paths go where the variance is.
+"""
+import os
+
+import numpy as np
+
+from uniswap_simulator.cache import fingerprint
+from uniswap_simulator.checkpoint import check_run, load_snapshot, restore_state, save_snapshot, snapshot_state
+from uniswap_simulator.compare_to_hodl import expected_hodl_log_growth
+from uniswap_simulator.executor import _context, run_tasks
+from uniswap_simulator.gbm import SOBOL_REPLICATES, spawn_generators
+from uniswap_simulator.sweep import checkpoint_key, log_growth_cells
+
+
+class RunningMoments:
+    """
+    Per-cell running means and co-moments of paired samples (x, y), updated batch by batch with the
+    pairwise merge of Chan et al., so no samples have to be kept.
+    """
+
+    def __init__(self, cells):
+        self.n = np.zeros(cells)
+        self.mean_x = np.zeros(cells)
+        self.mean_y = np.zeros(cells)
+        self.c_xx = np.zeros(cells)
+        self.c_xy = np.zeros(cells)
+        self.c_yy = np.zeros(cells)
+
+    def add(self, cells, x, y):
+        """Merges the samples `x` and `y`, of shape (len(`cells`) x samples), into the given cells."""
+        m = x.shape[1]
+        mean_x = x.mean(axis=1)
+        mean_y = y.mean(axis=1)
+        dx = x - mean_x[:, np.newaxis]
+        dy = y - mean_y[:, np.newaxis]
+
+        n = self.n[cells]
+        total = n + m
+        delta_x = mean_x - self.mean_x[cells]
+        delta_y = mean_y - self.mean_y[cells]
+        weight = n * m / total
+
+        self.c_xx[cells] += (dx * dx).sum(axis=1) + weight * delta_x * delta_x
+        self.c_xy[cells] += (dx * dy).sum(axis=1) + weight * delta_x * delta_y
+        self.c_yy[cells] += (dy * dy).sum(axis=1) + weight * delta_y * delta_y
+        self.mean_x[cells] += delta_x * m / total
+        self.mean_y[cells] += delta_y * m / total
+        self.n[cells] = total
+
+    def estimate(self, y_expectation=None):
+        """
+        Returns the means of x and y, and the standard errors of the mean of x and of x - y. With
+        `y_expectation`, y is used as a control variate for x (see `compare_to_hodl.estimate_growth`),
+        and the returned mean of y is the expectation.
+        """
+        n = self.n
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if y_expectation is None:
+                var_x = self.c_xx / (n - 1)
+                var_diff = (self.c_xx - 2 * self.c_xy + self.c_yy) / (n - 1)
+                return self.mean_x, self.mean_y, np.sqrt(var_x / n), np.sqrt(var_diff / n)
+
+            beta = np.where(self.c_yy > 0, self.c_xy / self.c_yy, 0.)
+            mean_x = self.mean_x - beta * (self.mean_y - y_expectation)
+            var_residual = (self.c_xx - beta * self.c_xy) / (n - 1)
+            stderr = np.sqrt(np.maximum(var_residual, 0) / n)
+            return mean_x, np.broadcast_to(y_expectation, n.shape), stderr, stderr
+
+
+def _sample_units(values, method):
+    """Groups per-path values into independent samples: antithetic pairs, or Sobol replicates."""
+    if method == 'antithetic':
+        return values.reshape(len(values), -1, 2).mean(axis=2)
+    if method == 'sobol':
+        return values.reshape(len(values), -1, SOBOL_REPLICATES).mean(axis=1)
+    return values
+
+
+def adaptive_cells(strategy_factory, p0, mus, sigmas, dt, T, tolerance, batch_size=256, max_paths=10000, z=1.96,
+                   rng=None, block_size=256, price_bounds=None, engine=None, dtype=None, method='mc',
+                   control_variate=False, checkpoint=None, prefetch=False):
+    """
+    Simulates the given (mu, sigma) cells in rounds of `batch_size` paths per cell (all unfinished
+    cells in one vectorized run, see `run_cells`), until the confidence interval of G - G_hodl has a
+    half-width of at most `tolerance` in every cell, or a cell has used up `max_paths`. `z` is the
+    normal quantile of the confidence level (1.96 for 95%). `rng` is an int seed or a `SeedSequence`.
+
+    With 'antithetic' and 'sobol' `method`s, the independent samples are pairs of paths and the means
+    of each round's `SOBOL_REPLICATES` replicates respectively, so `batch_size` must be a multiple of
+    2 and `SOBOL_REPLICATES` respectively. The first round should be big enough to estimate the
+    variance reliably.
+
+    If `checkpoint` is a path, the state is saved there after every round, and a run with the same
+    arguments (and an explicit `rng`) resumes from it; one with other arguments raises a ValueError.
+    `prefetch` is passed on to `run_cells`.
+
+    Returns an array of shape (cells x 5) holding G, G_hodl, the standard errors of G and of
+    G - G_hodl, and the number of paths used.
+    """
+    mus = np.asarray(mus, dtype=float)
+    sigmas = np.asarray(sigmas, dtype=float)
+    cells = len(mus)
+    group = {'antithetic': 2, 'sobol': SOBOL_REPLICATES}.get(method, 1)
+    if batch_size % group != 0 or batch_size < 2 * group:
+        raise ValueError('batch_size must be a multiple of {}, and at least twice that'.format(group))
+
+    moments = RunningMoments(cells)
+    # counted separately, since moments count antithetic pairs and Sobol replicates rather than paths
+    paths = np.zeros(cells, dtype=int)
+    # one generator per round, so that a resumed run sees the same paths
+    rounds = spawn_generators(rng, max(max_paths // batch_size, 1))
+    start, active = 0, np.arange(cells)
+
+    run_key = None
+    if checkpoint is not None:
+        run_key = fingerprint(
+            checkpoint_key(strategy_factory, p0, mus, sigmas, dt, T, batch_size, rng, block_size, price_bounds, engine,
+                           dtype, method),
+            tolerance, max_paths, z, control_variate
+        )
+    saved = load_snapshot(checkpoint) if checkpoint is not None else None
+    check_run(saved, run_key, checkpoint)
+    if saved is not None:
+        restore_state(moments, {key[len('moments/'):]: array for key, array in saved.items() if key.startswith('moments/')})
+        start, active, paths = int(saved['round']), np.array(saved['active']), np.array(saved['paths'])
+
+    hodl_expectation = None
+    if control_variate:
+        hodl_expectation = expected_hodl_log_growth(mus, sigmas, (int(T / dt) - 1) * dt)
+
+    for i in range(start, len(rounds)):
+        if len(active) == 0:
+            break
+        log_growth, log_growth_hodl, _ = log_growth_cells(
+            strategy_factory, p0, mus[active], sigmas[active], dt, T, batch_size, rounds[i], block_size, price_bounds,
+            engine, dtype, method=method, prefetch=prefetch
+        )
+        moments.add(active, _sample_units(log_growth, method), _sample_units(log_growth_hodl, method))
+        paths[active] += batch_size
+
+        _, _, _, stderr_diff = moments.estimate(hodl_expectation)
+        active = active[z * stderr_diff[active] / T > tolerance]
+
+        if checkpoint is not None:
+            snapshot = {'round': np.array(i + 1), 'active': active, 'paths': paths, 'run': np.array(run_key)}
+            for key, array in snapshot_state(moments).items():
+                snapshot['moments/' + key] = array
+            save_snapshot(checkpoint, snapshot)
+
+    G, G_hodl, stderr, stderr_diff = moments.estimate(hodl_expectation)
+    return np.stack((G / T, G_hodl / T, stderr / T, stderr_diff / T, paths), axis=1)
+
+
+def _adaptive_cells(args):
+    return adaptive_cells(*args)
+
+
+def adaptive_sweep(strategy_factory, p0, mus, sigmas, dt, T, tolerance, batch_size=256, max_paths=10000, z=1.96,
+                   cells_per_batch=20, processes=None, seed=None, block_size=256, price_bounds=None, engine=None,
+                   dtype=None, method='mc', control_variate=False, checkpoint_dir=None, prefetch=False, transport=None,
+                   retries=2):
+    """
+    Same as `sweep`, but with adaptive path counts (see `adaptive_cells`). Each batch of
+    `cells_per_batch` cells is run adaptively on its own, in parallel across `processes` workers.
+    With a `checkpoint_dir`, each batch saves its progress there after every round. As with `sweep`,
+    batches can be run by the workers of a `transport` instead.
+
+    Returns `x_grid`, `y_grid` and `z_grid`, where `z_grid[i, j]` holds [G, G_hodl, stderr of G,
+    stderr of G - G_hodl, paths used] for `sigmas[i]` and `mus[j]`.
+    """
+    x_grid, y_grid = np.meshgrid(mus, sigmas)
+    z_grid = np.zeros((*x_grid.shape, 5))
+
+    mu_cells = x_grid.ravel()
+    sigma_cells = y_grid.ravel()
+    starts = range(0, len(mu_cells), cells_per_batch)
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+
+    checkpoints = [None] * len(starts)
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        # named after the batch and seed, so that a changed sweep doesn't resume them
+        checkpoints = [
+            os.path.join(checkpoint_dir, 'adaptive_{}.npz'.format(fingerprint(
+                mu_cells[start:start + cells_per_batch], sigma_cells[start:start + cells_per_batch], rng.entropy,
+                rng.spawn_key
+            )[:32]))
+            for start, rng in zip(starts, seeds)
+        ]
+
+    args = [(
+        strategy_factory,
+        p0,
+        mu_cells[start:start + cells_per_batch],
+        sigma_cells[start:start + cells_per_batch],
+        dt,
+        T,
+        tolerance,
+        batch_size,
+        max_paths,
+        z,
+        rng,
+        block_size,
+        price_bounds,
+        engine,
+        dtype,
+        method,
+        control_variate,
+        checkpoint,
+        prefetch
+    ) for start, rng, checkpoint in zip(starts, seeds, checkpoints)]
+
+    if transport is not None:
+        performances = run_tasks(_adaptive_cells, args, transport, retries)
+    elif processes is None:
+        performances = list(map(_adaptive_cells, args))
+    else:
+        with _context.Pool(processes) as p:
+            performances = p.map(_adaptive_cells, args)
+
+    z_grid.reshape(-1, 5)[:] = np.concatenate(performances, axis=0)
+    return x_grid, y_grid, z_grid
@@ -0,0 +1,213 @@
+"""
+On-disk cache of simulation results, addressed by content. Entries are stored under a `fingerprint`
+of everything they depend on, including the source code of this package and of the strategy, so
+changing any of it simply misses the cache. `sweep(..., cache=ResultCache(directory))` only simulates
+the cells that aren't cached yet.
+
+Writes are atomic (a temporary file is renamed into place), so several processes, or machines sharing
+the directory, can use the same cache at once. With `max_bytes`, the least recently used entries are
+evicted once the cache grows beyond it.
+"""
+import functools
+import hashlib
+import os
+import types
+import uuid
+import zipfile
+
+import numpy as np
+
+
+CACHE_VERSION = 1
+
+# objects from these packages are identified by name only; this package is covered by its source
+_LIBRARIES = ('numpy', 'scipy', 'numba', 'uniswap_simulator', 'builtins')
+
+
+def fingerprint(*parts):
+    """
+    Returns a hex digest that identifies `parts`: plain values, arrays, containers, functions (by
+    their code, defaults, closures and the functions and classes they refer to), classes (by their
+    methods) and objects (by their class and attributes). It's stable across processes and machines.
+    """
+    h = hashlib.sha256()
+    _update(h, parts, set())
+    return h.hexdigest()
+
+
+def _update(h, obj, seen):
+    def put(*tokens):
+        for token in tokens:
+            h.update(token if isinstance(token, bytes) else str(token).encode())
+            h.update(b'\0')
+
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes)):
+        put(type(obj).__name__, repr(obj))
+    elif isinstance(obj, (np.ndarray, np.generic)):
+        obj = np.ascontiguousarray(obj)
+        put('ndarray', obj.dtype.str, obj.shape, obj.tobytes())
+    elif isinstance(obj, (list, tuple)):
+        put(type(obj).__name__, len(obj))
+        for item in obj:
+            _update(h, item, seen)
+    elif isinstance(obj, dict):
+        put('dict', len(obj))
+        for key in sorted(obj, key=repr):
+            _update(h, key, seen)
+            _update(h, obj[key], seen)
+    elif isinstance(obj, types.ModuleType):
+        put('module', obj.__name__)
+    elif isinstance(obj, (types.FunctionType, type)) and getattr(obj, '__module__', '').split('.')[0] in _LIBRARIES:
+        put('library', obj.__module__, obj.__qualname__)
+    elif id(obj) in seen:
+        # recursive reference
+        put('seen', getattr(obj, '__qualname__', type(obj).__qualname__))
+    elif isinstance(obj, functools.partial):
+        put('partial')
+        _update(h, (obj.func, obj.args, obj.keywords), seen)
+    elif isinstance(obj, types.FunctionType):
+        seen.add(id(obj))
+        put('function', obj.__module__, obj.__qualname__)
+        _update_code(h, obj.__code__, put)
+        _update(h, (obj.__defaults__, obj.__kwdefaults__), seen)
+        _update(h, [cell.cell_contents for cell in obj.__closure__ or ()], seen)
+        names = sorted(name for name in _names(obj.__code__) if name in obj.__globals__)
+        _update(h, {name: obj.__globals__[name] for name in names}, seen)
+    elif isinstance(obj, type):
+        seen.add(id(obj))
+        put('class', obj.__module__, obj.__qualname__)
+        _update(h, [base for base in obj.__bases__ if base is not object], seen)
+        for name, value in sorted(vars(obj).items()):
+            if isinstance(value, (staticmethod, classmethod)):
+                value = value.__func__
+            if isinstance(value, property):
+                value = (value.fget, value.fset)
+            if not name.startswith('__') or isinstance(value, types.FunctionType):
+                _update(h, (name, value), seen)
+    elif isinstance(obj, types.MethodType):
+        put('method')
+        _update(h, (obj.__func__, obj.__self__), seen)
+    elif isinstance(obj, (types.BuiltinFunctionType, np.ufunc)):
+        put('builtin', getattr(obj, '__module__', None), obj.__name__)
+    elif hasattr(obj, '__dict__'):
+        seen.add(id(obj))
+        _update(h, (type(obj), vars(obj)), seen)
+    else:
+        raise TypeError("can't fingerprint {!r}".format(obj))
+
+
+def _update_code(h, code, put):
+    put(code.co_code, code.co_names, code.co_varnames)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_code(h, const, put)
+        else:
+            put(type(const).__name__, repr(const))
+
+
+def _names(code):
+    """Global names a code object (or any function nested in it) may refer to."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _names(const)
+    return names
+
+
+@functools.lru_cache(maxsize=None)
+def package_digest():
+    """Digest of this package's source, so that cached results don't outlive changes to the simulator."""
+    h = hashlib.sha256()
+    root = os.path.dirname(os.path.abspath(__file__))
+    for directory, subdirectories, files in sorted(os.walk(root)):
+        subdirectories.sort()
+        for name in sorted(files):
+            if name.endswith('.py'):
+                path = os.path.join(directory, name)
+                h.update(os.path.relpath(path, root).encode())
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """A directory of `.npz` entries, each a dict of arrays, stored under the key it was `put` with."""
+
+    def __init__(self, directory, max_bytes=None):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, *parts):
+        """The key of an entry that depends on `parts` (see `fingerprint`) and on this package's code."""
+        return fingerprint(CACHE_VERSION, package_digest(), parts)
+
+    def _path(self, key):
+        return os.path.join(self._directory, key[:2], key + '.npz')
+
+    def get(self, key):
+        """Returns the entry stored under `key`, or None."""
+        path = self._path(key)
+        try:
+            with np.load(path) as f:
+                entry = {name: f[name] for name in f.files}
+        except (OSError, ValueError, zipfile.BadZipFile):
+            # missing, or evicted by another process while being read
+            return None
+
+        try:
+            # the modification time is what eviction goes by
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, entry):
+        """Stores `entry` (a dict of arrays) under `key`, then evicts old entries if over `max_bytes`."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # unique, so that concurrent writers of the same entry don't clash
+        temporary = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(temporary, 'wb') as f:
+            np.savez(f, **entry)
+        os.replace(temporary, path)
+
+        if self._max_bytes is not None:
+            self.evict(self._max_bytes)
+
+    def _entries(self):
+        """(modification time, size, path) of every entry."""
+        entries = []
+        for directory in os.scandir(self._directory):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if not entry.name.endswith('.npz'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def __len__(self):
+        return len(self._entries())
+
+    def size(self):
+        """Total size of the entries in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_bytes):
+        """Removes the least recently used entries until the rest take up at most `max_bytes`."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # already evicted by another process
+                pass
+            total -= size
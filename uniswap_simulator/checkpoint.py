@@ -0,0 +1,181 @@
+"""
+Checkpointing for long runs. Simulation state is captured as a flat dict of arrays (a snapshot):
+`Position`, `PositionV2`, `PositionBook` and the GBM block sampler implement `snapshot`/`restore`
+themselves, and any other object (e.g. a strategy) is handled by `snapshot_state`/`restore_state`,
+which save its array attributes and recurse into attributes that can be snapshotted. Nested keys are
+joined with '/'. Snapshots are stored as uncompressed `.npz` files.
+"""
+import json
+import os
+import queue
+import random
+import threading
+
+import numpy as np
+
+from uniswap_simulator.compare_to_hodl import HodlComparison
+
+
+def snapshot_state(obj):
+    if hasattr(obj, 'snapshot'):
+        return obj.snapshot()
+
+    state = {}
+    for name, value in vars(obj).items():
+        if isinstance(value, np.ndarray):
+            state[name] = value
+        elif hasattr(value, 'snapshot') or _is_strategy(value):
+            for key, array in snapshot_state(value).items():
+                state[name + '/' + key] = array
+    return state
+
+
+def restore_state(obj, state):
+    if hasattr(obj, 'restore'):
+        obj.restore(state)
+        return
+
+    children = {}
+    for key, array in state.items():
+        name, _, rest = key.partition('/')
+        if rest:
+            children.setdefault(name, {})[rest] = array
+            continue
+
+        current = getattr(obj, name, None)
+        if isinstance(current, np.ndarray) and current.shape != array.shape:
+            raise ValueError('snapshot of {!r} has shape {}, expected {}'.format(name, array.shape, current.shape))
+        setattr(obj, name, np.array(array))
+
+    for name, child_state in children.items():
+        restore_state(getattr(obj, name), child_state)
+
+
+def _is_strategy(obj):
+    # objects that can be stepped through a simulation, like the example strategies
+    return callable(getattr(obj, 'update', None)) and callable(getattr(obj, 'mint', None))
+
+
+def save_snapshot(path, state):
+    """Writes `state` to `path`. The file is replaced atomically, so a crash never leaves it half-written."""
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        np.savez(f, **state)
+    os.replace(temporary, path)
+
+
+def load_snapshot(path):
+    """Reads a snapshot written by `save_snapshot`, or returns None if there is none."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as f:
+        return {key: f[key] for key in f.files}
+
+
+class SnapshotWriter:
+    """
+    Writes snapshots from a background thread, so that disk I/O overlaps with simulation. `submit`
+    only copies the arrays; if the previous snapshot is still being written, it waits for it first.
+    Errors raised while writing are re-raised by the next `submit` or by `close`.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._queue = queue.Queue(maxsize=1)
+        self._error = None
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def _write_loop(self):
+        while True:
+            state = self._queue.get()
+            if state is None:
+                return
+            try:
+                save_snapshot(self._path, state)
+            except Exception as e:
+                self._error = e
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, state):
+        self._raise_error()
+        # arrays keep changing after this returns, so the writer needs its own copies
+        self._queue.put({key: np.array(array) for key, array in state.items()})
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def log_growth_checkpointed(strategy, sampler, path, interval=10000, engine=None, price_bounds=None, run_key=None):
+    """
+    Same as `log_growth_streaming`, but snapshots the strategy, the price sampler (a
+    `GeometricBrownianMotion.sample_blocks` iterator with an rng) and the HODL comparison to `path`
+    roughly every `interval` time steps, at block boundaries. If `path` already holds a snapshot,
+    the run resumes from it, and gives exactly the result it would have without the interruption.
+    `path` must therefore be unique to the run's parameters; if a `run_key` identifying them is given,
+    it's stored in the snapshot, and resuming from a snapshot of a different run raises a ValueError.
+
+    The state of Python's `random` module is saved as well, for strategies that draw from it.
+    """
+    comparison = HodlComparison(strategy, engine)
+    parts = {'strategy': strategy, 'sampler': sampler, 'comparison': comparison}
+
+    state = load_snapshot(path)
+    check_run(state, run_key, path)
+    if state is not None:
+        for name, part in parts.items():
+            prefix = name + '/'
+            restore_state(part, {key[len(prefix):]: array for key, array in state.items() if key.startswith(prefix)})
+        random.setstate(_to_tuple(json.loads(str(state['random']))))
+
+    def take_snapshot():
+        state = {'random': np.array(json.dumps(random.getstate()))}
+        if run_key is not None:
+            state['run'] = np.array(run_key)
+        for name, part in parts.items():
+            for key, array in snapshot_state(part).items():
+                state[name + '/' + key] = array
+        return state
+
+    steps = 0
+    with SnapshotWriter(path) as writer:
+        for block in sampler:
+            if price_bounds is not None:
+                block = np.clip(block, *price_bounds)
+            comparison.step(block)
+
+            steps += len(block)
+            if steps >= interval:
+                writer.submit(take_snapshot())
+                steps = 0
+
+        # the final state too, so that resuming a finished run returns immediately
+        writer.submit(take_snapshot())
+
+    return comparison.log_growth()
+
+
+def check_run(state, run_key, path):
+    """Raises a ValueError if the snapshot `state` loaded from `path` was saved by a run other than `run_key`."""
+    if state is None or run_key is None:
+        return
+    if 'run' not in state or str(state['run']) != run_key:
+        raise ValueError('{} holds a snapshot of a different run; remove it to start over'.format(path))
+
+
+def _to_tuple(value):
+    # JSON turns the tuples of `random.getstate()` into lists
+    return tuple(_to_tuple(v) for v in value) if isinstance(value, list) else value
@@ -1,40 +1,187 @@
 import numpy as np
 
+from uniswap_simulator import instrumentation
+from uniswap_simulator.precision import ACCUMULATOR_DTYPE
+
 
 INITIAL_INVENTORY0 = 10000
 
 
-def compare_to_hodl(strategy, prices, T):
+def compare_to_hodl(strategy, prices, T, engine=None, hodl_expectation=None, return_stderr=False, replicates=None,
+                    antithetic=False):
+    """
+    Returns the average log growth rates of `strategy` and of HODLing over the (time x trajectories)
+    `prices`. If `hodl_expectation` (the exact expected log growth of HODLing, see
+    `expected_hodl_log_growth`) is given, it's used as a control variate: the strategy's estimate is
+    corrected by how far the paths' HODL growth is from it, and the exact HODL rate is returned. With
+    `return_stderr`, the standard errors of both rates are returned as well; for quasi-random paths,
+    pass the number of `replicates` they were generated with (see `GeometricBrownianMotion.sample_blocks`),
+    and set `antithetic` for antithetic paths.
+    """
     # price trajectories should start from the same value (at t=0)
     assert prices[0].std() == 0.
-    initial_price = prices[0].mean()
 
-    # array to store results
-    amounts = np.zeros((*prices.shape, 2))
+    # a dense (time x trajectories) array is just a stream with one block
+    return compare_to_hodl_streaming(
+        strategy, (prices,), T, engine, hodl_expectation, return_stderr, replicates, antithetic
+    )
+
+
+def compare_to_hodl_streaming(strategy, blocks, T, engine=None, hodl_expectation=None, return_stderr=False,
+                              replicates=None, antithetic=False):
+    """
+    Same as `compare_to_hodl`, but consumes prices as an iterable of (time x trajectories) blocks.
+    Only per-trajectory state is kept between steps, so memory does not grow with the horizon.
+    """
+    log_growth, log_growth_hodl = log_growth_streaming(strategy, blocks, engine)
+    G_end_point, G_end_point_hodl, G_stderr, G_hodl_stderr = estimate_growth(
+        log_growth, log_growth_hodl, T, hodl_expectation, replicates, antithetic
+    )
+
+    if return_stderr:
+        return G_end_point, G_end_point_hodl, G_stderr, G_hodl_stderr
+    return G_end_point, G_end_point_hodl
+
+
+def expected_hodl_log_growth(mu, sigma, t, nodes=64):
+    """
+    Exact (to quadrature precision) expectation of the log growth of HODLing, which starts out
+    with equal value in both tokens, over time `t` under a GBM with drift `mu` and volatility `sigma`.
+    Arguments may be arrays.
+    """
+    x, w = np.polynomial.hermite_e.hermegauss(nodes)
+    mean = np.multiply.outer((np.asarray(mu) - 0.5 * np.square(sigma)) * t, np.ones(nodes))
+    scale = np.multiply.outer(np.asarray(sigma) * np.sqrt(t), x)
+    # wealth grows by (1 + P_t / P_0) / 2
+    return (np.logaddexp(0, mean + scale) - np.log(2)) @ w / np.sqrt(2 * np.pi)
+
+
+def estimate_growth(log_growth, log_growth_hodl, T, hodl_expectation=None, replicates=None, antithetic=False):
+    """
+    Turns per-trajectory log growth (trajectories along the last axis) into growth rates and their
+    standard errors: (G, G_hodl, G_stderr, G_hodl_stderr). See `compare_to_hodl` for `hodl_expectation`.
+    If `replicates` is given, trajectory j belongs to replicate j % `replicates`, and standard errors
+    come from the spread of the replicates' means rather than of individual trajectories. Likewise,
+    with `antithetic`, trajectories 2k and 2k + 1 are a mirrored pair, and the spread is that of the
+    pairs' means, since the two are negatively correlated.
+    """
+    if antithetic:
+        check_antithetic_count(np.shape(log_growth)[-1])
+    if hodl_expectation is None:
+        G, G_stderr = _mean_and_stderr(log_growth, replicates, antithetic)
+        G_hodl, G_hodl_stderr = _mean_and_stderr(log_growth_hodl, replicates, antithetic)
+        return G / T, G_hodl / T, G_stderr / T, G_hodl_stderr / T
+
+    # control variate: with beta = cov(X, Y) / var(Y), X - beta (Y - E[Y]) has the mean of X but
+    # less variance, the more X and Y are correlated
+    x = log_growth - log_growth.mean(axis=-1, keepdims=True)
+    y = log_growth_hodl - log_growth_hodl.mean(axis=-1, keepdims=True)
+    var_y = (y * y).sum(axis=-1)
+    beta = np.divide((x * y).sum(axis=-1), var_y, out=np.zeros_like(var_y), where=var_y > 0)
+
+    residual = log_growth - beta[..., np.newaxis] * (log_growth_hodl - np.asarray(hodl_expectation)[..., np.newaxis])
+    G, G_stderr = _mean_and_stderr(residual, replicates, antithetic)
+    G_hodl = np.broadcast_to(hodl_expectation, G.shape)
+    return G / T, G_hodl / T, G_stderr / T, np.zeros_like(G_stderr)
+
+
+def check_antithetic_count(count):
+    """Antithetic paths come in mirrored pairs, so estimates from them need an even number of paths."""
+    if count % 2:
+        raise ValueError('antithetic sampling needs an even number of paths, got {}'.format(count))
+
 
-    # mint liquidity to get things rolling
-    m0 = np.full_like(prices[0], INITIAL_INVENTORY0)
-    m1 = np.full_like(prices[0], INITIAL_INVENTORY0 * initial_price)
-    strategy.reset(prices[0])
-    strategy.mint(m0, m1)
+def _mean_and_stderr(values, replicates=None, antithetic=False):
+    if antithetic:
+        values = values.reshape(*values.shape[:-1], -1, 2).mean(axis=-1)
+    if replicates is not None:
+        n = values.shape[-1]
+        # means of the groups j % replicates; trailing trajectories that don't fill a round are dropped
+        groups = values[..., :n - n % replicates].reshape(*values.shape[:-1], -1, replicates)
+        values = groups.mean(axis=-2)
+    return values.mean(axis=-1), values.std(axis=-1, ddof=1) / np.sqrt(values.shape[-1])
+
+
+def log_growth_streaming(strategy, blocks, engine=None):
+    """
+    Runs `strategy` over a stream of (time x trajectories) price blocks and returns the
+    per-trajectory log growth of its wealth, along with that of HODLing.
+
+    By default the strategy is stepped with `update`. If `engine` is given (see
+    `uniswap_simulator.engine`), each block is handed to `strategy.run(block, engine=engine)`
+    instead, for strategies that implement it (`Position` and `PositionV2` do).
+    """
+    comparison = HodlComparison(strategy, engine)
 
     # iterate through t=0 --> t=t_max
-    for i in range(len(prices)):
-        amounts[i] = strategy.update(prices[i])
+    for block in blocks:
+        comparison.step(block)
 
-    # 0th axis is time
-    # 1st axis is trajectories
-    # 2nd axis is [amount0, amount1]
+    return comparison.log_growth()
 
-    values = amounts.copy()
-    values[..., 0] *= prices
 
-    hodl = m0 * prices + m1
-    y = values.copy()
+class HodlComparison:
+    """
+    The per-trajectory state of `log_growth_streaming` between blocks: the HODL inventory, the
+    initial wealth and the strategy's latest amounts. Feed it blocks with `step`.
+    """
 
-    y = y.sum(axis=2) / hodl[0]
-    G_end_point = np.log(y[-1]).mean() / T
-    y = hodl[-1] / hodl[0]
-    G_end_point_hodl = np.log(y).mean() / T
+    def __init__(self, strategy, engine=None):
+        self._strategy = strategy
+        self._engine = engine
+        self._run = getattr(strategy, 'run', None) if engine is not None else None
 
-    return G_end_point, G_end_point_hodl
+        self._m0 = None
+        self._m1 = None
+        self._hodl_start = None
+        self._amounts = None
+        self._price = None
+
+    @instrumentation.timed
+    def step(self, block):
+        if len(block) == 0:
+            return
+
+        if self._m0 is None:
+            # price trajectories should start from the same value (at t=0)
+            assert block[0].std() == 0.
+            initial_price = block[0].mean()
+
+            # mint liquidity to get things rolling
+            self._m0 = np.full(block[0].shape, INITIAL_INVENTORY0, dtype=ACCUMULATOR_DTYPE)
+            self._m1 = np.full(block[0].shape, INITIAL_INVENTORY0 * initial_price, dtype=ACCUMULATOR_DTYPE)
+            self._strategy.reset(block[0])
+            self._strategy.mint(self._m0, self._m1)
+
+        # 0th axis is trajectories
+        # 1st axis is [amount0, amount1]
+        if self._run is None:
+            for price in block:
+                self._amounts = self._strategy.update(price)
+        else:
+            self._amounts = self._run(block, engine=self._engine)
+
+        # strategies may write to `price`, so HODL value is taken after the update
+        if self._hodl_start is None:
+            self._hodl_start = self._m0 * block[0] + self._m1
+        # copied, since blocks may be reused buffers (see `uniswap_simulator.pipeline`)
+        self._price = np.array(block[-1])
+
+    def log_growth(self):
+        assert self._amounts is not None, 'price stream was empty'
+
+        # log-wealth is always computed in full precision
+        amounts = self._amounts.astype(ACCUMULATOR_DTYPE, copy=False)
+        price = self._price.astype(ACCUMULATOR_DTYPE, copy=False)
+        y = (amounts[..., 0] * price + amounts[..., 1]) / self._hodl_start
+        y_hodl = (self._m0 * price + self._m1) / self._hodl_start
+
+        return np.log(y), np.log(y_hodl)
+
+    def snapshot(self):
+        names = ('m0', 'm1', 'hodl_start', 'amounts', 'price')
+        return {name: getattr(self, '_' + name) for name in names if getattr(self, '_' + name) is not None}
+
+    def restore(self, state):
+        for name, value in state.items():
+            setattr(self, '_' + name, np.array(value))
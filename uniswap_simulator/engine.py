@@ -0,0 +1,265 @@
+"""
+Compiled time-stepping kernels for `Position` and `PositionV2`. Each kernel takes a whole
+(time x trajectories) price block and runs the full time loop for every trajectory, replicating the
+arithmetic of the corresponding `update` method operation for operation. Numba is optional; without
+it, the 'numpy' engine simply steps through `update` one row at a time. Kernels only run on prices in
+the position's dtype: 'auto' steps through `update` for other prices, and 'numba' raises.
+"""
+import math
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+
+ENGINES = ('auto', 'numba', 'numpy')
+
+
+def resolve_engine(engine):
+    """Maps 'auto' onto the fastest engine that's available."""
+    if engine not in ENGINES:
+        raise ValueError('engine must be one of {}, got {!r}'.format(ENGINES, engine))
+    if engine == 'auto':
+        return 'numpy' if njit is None else 'numba'
+    if engine == 'numba' and njit is None:
+        raise RuntimeError('numba engine requested, but numba is not installed')
+    return engine
+
+
+def _compiled(engine, prices, dtype):
+    """
+    Whether `engine` runs a compiled kernel on `prices`. Kernels only reproduce the NumPy arithmetic
+    when the prices come in the working dtype, so for other prices 'auto' steps through NumPy instead
+    and 'numba' is refused.
+    """
+    if resolve_engine(engine) == 'numpy':
+        return False
+    if prices.dtype != dtype:
+        if engine == 'numba':
+            raise ValueError('the numba engine needs prices of dtype {}, got {}; cast them first'.format(
+                np.dtype(dtype), prices.dtype))
+        return False
+    return True
+
+
+def _band(fee, dtype):
+    # NumPy casts Python scalars to the array's dtype, whereas Numba would promote float32 arrays to
+    # float64 when combined with them, so kernels get their constants already in the working dtype
+    return dtype.type(fee), dtype.type(1 - fee), dtype.type(1 / (1 - fee))
+
+
+def _position_kernel(prices, price_sqrt, lower_sqrt, upper_sqrt, liquidity, earned, fee, band_lower, band_upper):
+    # `prices` is overwritten with the price the pool actually moved to, like `Position.update` does
+    for n in prange(prices.shape[1]):
+        a = lower_sqrt[n]
+        b = upper_sqrt[n]
+        L = liquidity[n]
+        s = price_sqrt[n]
+        earned0 = earned[n, 0]
+        earned1 = earned[n, 1]
+
+        for t in range(prices.shape[0]):
+            price_previous = s * s
+            price = prices[t, n]
+            ratio = price / price_previous
+            if not (ratio > band_upper or ratio < band_lower):
+                price = price_previous
+                prices[t, n] = price
+            s_next = math.sqrt(price)
+
+            c = min(max(s, a), b)
+            amount0_previous = (b - c) * L / c / b
+            amount1_previous = (c - a) * L
+            c = min(max(s_next, a), b)
+            amount0_current = (b - c) * L / c / b
+            amount1_current = (c - a) * L
+
+            diff0 = amount0_current - amount0_previous
+            if diff0 > 0:
+                earned0 += diff0 * fee
+            else:
+                earned1 += (amount1_current - amount1_previous) * fee
+            s = s_next
+
+        price_sqrt[n] = s
+        earned[n, 0] = earned0
+        earned[n, 1] = earned1
+
+
+def _position_v2_kernel(prices, price_sqrt, x, y, k, fee, band_lower, band_upper, two_minus_fee, four_gamma,
+                        two_gamma, history):
+    # `prices` is overwritten with the price the pool actually moved to, like `PositionV2.update` does.
+    # `history` (time x trajectories x 2) receives the amounts after each step, unless it's None
+    zero = x.dtype.type(0)
+
+    for n in prange(prices.shape[1]):
+        s = price_sqrt[n]
+        x_n = x[n]
+        y_n = y[n]
+        k_n = k[n]
+
+        for t in range(prices.shape[0]):
+            price_previous = s * s
+            price = prices[t, n]
+            ratio = price / price_previous
+            if not (ratio > band_upper or ratio < band_lower):
+                price = price_previous
+                prices[t, n] = price
+
+            if price > price_previous:
+                y_fee = y_n * fee
+                y_n += (-y_n * two_minus_fee + math.sqrt(y_fee * y_fee + four_gamma * k_n * price)) / two_gamma
+                x_n = y_n / price
+            else:
+                x_fee = x_n * fee
+                x_n += (-x_n * two_minus_fee + math.sqrt(x_fee * x_fee + four_gamma * k_n / price)) / two_gamma
+                y_n = price * x_n
+
+            x_n = max(x_n, zero)
+            y_n = max(y_n, zero)
+            k_n = x_n * y_n
+            s = math.sqrt(price)
+            if history is not None:
+                history[t, n, 0] = x_n
+                history[t, n, 1] = y_n
+
+        price_sqrt[n] = s
+        x[n] = x_n
+        y[n] = y_n
+        k[n] = k_n
+
+
+def _v2_constants(fee, dtype):
+    gamma = 1. - fee
+    return (*_band(fee, dtype), dtype.type(2. - fee), dtype.type(4 * gamma), dtype.type(2. * gamma))
+
+
+def _fee_band_kernel(prices, price_sqrt, band_lower, band_upper, out):
+    for n in prange(prices.shape[1]):
+        s = price_sqrt[n]
+
+        for t in range(prices.shape[0]):
+            price_previous = s * s
+            price = prices[t, n]
+            ratio = price / price_previous
+            if not (ratio > band_upper or ratio < band_lower):
+                price = price_previous
+                prices[t, n] = price
+            s = math.sqrt(price)
+            out[t, n] = s
+
+
+if njit is not None:
+    _position_kernel = njit(parallel=True, cache=True)(_position_kernel)
+    _position_v2_kernel = njit(parallel=True, cache=True)(_position_v2_kernel)
+    _fee_band_kernel = njit(parallel=True, cache=True)(_fee_band_kernel)
+
+
+def fee_band_filter(prices, price_sqrt, fee, out=None, engine='auto'):
+    """
+    Applies the fee-band hysteresis of `Position.update` to a whole (time x trajectories) block: the
+    pool price only follows the market once it has moved beyond the fee since the last pool price.
+    Starting from the pool's current `price_sqrt`, rows of `prices` are overwritten with the pool
+    price and the sqrt of each row is returned (in `out` if given).
+    """
+    if out is None:
+        out = np.empty(prices.shape, dtype=np.result_type(prices, price_sqrt))
+
+    if _compiled(engine, prices, np.result_type(prices, price_sqrt)):
+        _fee_band_kernel(prices, price_sqrt, *_band(fee, np.result_type(prices, price_sqrt))[1:], out)
+        return out
+
+    for price, s_next in zip(prices, out):
+        price_previous = np.square(price_sqrt)
+        ratio = price / price_previous
+        should_update = (ratio > 1 / (1 - fee)) | (ratio < 1 - fee)
+        np.copyto(price, price_previous, where=~should_update)
+        price_sqrt = np.sqrt(price, out=s_next)
+    return out
+
+
+def run_position(position, prices, engine='auto'):
+    """
+    Advances `position` (a `Position`) through every row of `prices` and returns its final amounts,
+    exactly as calling `position.update` on each row would. Like `update`, rows of `prices` are
+    overwritten with the price the pool actually moved to.
+
+    `engine='vectorized'` uses `Position.simulate`, which is only valid for positions that aren't
+    modified between steps.
+    """
+    if engine == 'vectorized':
+        position.simulate(prices)
+        return position.amounts
+
+    if not _compiled(engine, prices, position._price_sqrt.dtype):
+        amounts = None
+        for price in prices:
+            amounts = position.update(price)
+        return amounts
+
+    if position._earned is None:
+        position._earned = np.zeros((*position._liquidity.shape, 2), dtype=np.float64)
+    _position_kernel(
+        prices,
+        position._price_sqrt,
+        position._lower_sqrt,
+        position._upper_sqrt,
+        position._liquidity,
+        position._earned,
+        *_band(position._fee, position._price_sqrt.dtype)
+    )
+    position._invalidate_caches()
+    return position.amounts
+
+
+def run_position_v2(position, prices, engine='auto'):
+    """Same as `run_position`, for a `PositionV2`. 'vectorized' is an alias for the fastest engine."""
+    if engine == 'vectorized':
+        engine = 'auto'
+
+    if not _compiled(engine, prices, position._price_sqrt.dtype):
+        amounts = None
+        for price in prices:
+            amounts = position.update(price)
+        return amounts
+
+    _position_v2_kernel(
+        prices,
+        position._price_sqrt,
+        position._x,
+        position._y,
+        position._k,
+        *_v2_constants(position._fee, position._price_sqrt.dtype),
+        None
+    )
+    position._invalidate_caches()
+    return position.amounts
+
+
+def simulate_position_v2(position, prices, engine='auto'):
+    """Same as `run_position_v2`, but returns the amounts after each step (time x trajectories x 2)."""
+    if engine == 'vectorized':
+        engine = 'auto'
+    history = np.empty((*prices.shape, 2), dtype=position._amounts.dtype)
+
+    if not _compiled(engine, prices, position._price_sqrt.dtype):
+        for price, amounts in zip(prices, history):
+            position.update(price)
+            amounts[:] = position._amounts
+        return history
+
+    _position_v2_kernel(
+        prices,
+        position._price_sqrt,
+        position._x,
+        position._y,
+        position._k,
+        *_v2_constants(position._fee, position._price_sqrt.dtype),
+        history
+    )
+    position._invalidate_caches()
+    return history
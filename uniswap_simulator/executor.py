@@ -0,0 +1,446 @@
+"""
+Running sweep batches on many workers, possibly on several machines. `run_tasks` hands tasks out
+one at a time as workers become free, so slow batches (high sigma) don't hold up fast ones, and
+retries tasks whose worker raised or disappeared.
+
+Tasks are scheduled by work stealing: each worker owns a deque of tasks and takes from its front;
+a worker whose deque is empty steals half of the largest other deque, from its back. All tasks
+start out in a shared deque, so the first workers to connect split the grid between them.
+
+Workers talk to the coordinator through a transport:
+
+- `LocalTransport` runs worker processes on this machine over pipes.
+- `TCPTransport` listens on an address that workers connect to, from any machine:
+  `python -m uniswap_simulator tcp HOST:PORT AUTHKEY`. Unpickling runs arbitrary code, so
+  the address shouldn't be reachable from untrusted networks.
+- `FileTransport` exchanges messages as files in a directory shared by all machines (e.g. over
+  NFS): `python -m uniswap_simulator file DIRECTORY`.
+
+Messages are pickled, so tasks and their arguments (e.g. strategy factories) have to be picklable,
+and the same code has to be importable on every worker. Only connect workers you trust.
+"""
+import argparse
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from multiprocessing.connection import Client, Listener, wait
+
+
+# workers start from a fresh interpreter, like remote ones; forking a process that has started
+# threads (e.g. Numba's) can leave locks held forever
+_context = multiprocessing.get_context('spawn')
+
+
+class WorkStealingQueue:
+    """Per-worker deques of tasks. Tasks that aren't owned by any worker are in the shared deque."""
+
+    def __init__(self, tasks):
+        self._deques = {None: deque(tasks)}
+
+    def __len__(self):
+        return sum(len(tasks) for tasks in self._deques.values())
+
+    def next(self, worker):
+        tasks = self._deques.setdefault(worker, deque())
+        if not tasks:
+            victim = max(self._deques.values(), key=len)
+            for _ in range((len(victim) + 1) // 2):
+                tasks.appendleft(victim.pop())
+        return tasks.popleft() if tasks else None
+
+    def requeue(self, task):
+        self._deques[None].appendleft(task)
+
+    def remove_worker(self, worker):
+        """Hands the tasks of a worker that's gone back to the shared deque."""
+        self._deques[None].extendleft(reversed(self._deques.pop(worker, ())))
+
+
+def run_tasks(func, args, transport=None, retries=2, poll_interval=0.1):
+    """
+    Returns `[func(a) for a in args]`, computed by the workers of `transport` (a `LocalTransport` with
+    one worker per CPU by default). A task is attempted up to `retries + 1` times, counting attempts
+    whose worker died; after that, a RuntimeError with the last error is raised.
+    """
+    transport = LocalTransport() if transport is None else transport
+    with transport:
+        return _Coordinator(func, args, retries).run(transport, poll_interval)
+
+
+class _Coordinator:
+    def __init__(self, func, args, retries):
+        self._func = func
+        self._args = args
+        self._retries = retries
+        self._tasks = WorkStealingQueue(range(len(args)))
+        self._results = [None] * len(args)
+        self._attempts = [0] * len(args)
+        self._remaining = len(args)
+
+        self._connections = []
+        self._idle = []
+        # connection -> task it's working on
+        self._running = {}
+
+    def run(self, transport, poll_interval):
+        try:
+            while self._remaining:
+                self._connections.extend(transport.accept())
+                for connection in transport.wait(self._connections, poll_interval):
+                    self._receive(connection)
+                self._assign()
+        finally:
+            for connection in self._connections:
+                try:
+                    connection.send(('stop',))
+                except (EOFError, OSError):
+                    pass
+        return self._results
+
+    def _receive(self, connection):
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            self._drop(connection)
+            return
+
+        if message[0] == 'result':
+            self._results[message[1]] = message[2]
+            self._remaining -= 1
+            del self._running[connection]
+        elif message[0] == 'error':
+            del self._running[connection]
+            self._fail(message[1], message[2])
+        self._idle.append(connection)
+
+    def _assign(self):
+        for connection in list(self._idle):
+            task = self._tasks.next(connection)
+            if task is None:
+                return
+            try:
+                connection.send(('task', task, self._func, self._args[task]))
+            except (EOFError, OSError):
+                self._tasks.requeue(task)
+                self._drop(connection)
+                continue
+            self._idle.remove(connection)
+            self._running[connection] = task
+
+    def _fail(self, task, error):
+        self._attempts[task] += 1
+        if self._attempts[task] > self._retries:
+            raise RuntimeError('task {} failed after {} attempts:\n{}'.format(task, self._attempts[task], error))
+        self._tasks.requeue(task)
+
+    def _drop(self, connection):
+        self._connections.remove(connection)
+        if connection in self._idle:
+            self._idle.remove(connection)
+        self._tasks.remove_worker(connection)
+        if connection in self._running:
+            self._fail(self._running.pop(connection), 'worker disconnected')
+
+
+def serve(connection):
+    """Worker loop: runs the tasks the coordinator sends over `connection` until told to stop."""
+    connection.send(('ready',))
+    while True:
+        message = connection.recv()
+        if message[0] == 'stop':
+            return
+        _, task, func, args = message
+        try:
+            result = func(args)
+        except Exception:
+            connection.send(('error', task, traceback.format_exc()))
+        else:
+            connection.send(('result', task, result))
+
+
+class _Transport:
+    def accept(self):
+        """Returns connections to workers that have joined since the last call."""
+        raise NotImplementedError
+
+    def wait(self, connections, timeout):
+        """Returns the connections that have a message (or have failed), waiting up to `timeout`."""
+        if not connections:
+            time.sleep(timeout)
+            return []
+        return wait(connections, timeout)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class LocalTransport(_Transport):
+    """`processes` worker processes on this machine (one per CPU by default). Dead workers are replaced."""
+
+    def __init__(self, processes=None):
+        self._processes = [None] * (processes or os.cpu_count())
+
+    def accept(self):
+        connections = []
+        for i, process in enumerate(self._processes):
+            if process is None or not process.is_alive():
+                connection, child = _context.Pipe()
+                process = self._processes[i] = _context.Process(target=serve, args=(child,), daemon=True)
+                process.start()
+                # so that the worker dying shows up as EOF on `connection`
+                child.close()
+                connections.append(connection)
+        return connections
+
+    def close(self):
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+
+
+class TCPTransport(_Transport):
+    """
+    Listens on `address` for workers started with `run_tcp_worker` (port 0 picks a free one, see
+    `address` afterwards), which have to present `authkey` (bytes). `workers` local worker processes
+    are started as well, which is handy for testing on localhost.
+    """
+
+    def __init__(self, address=('localhost', 0), authkey=None, workers=0):
+        # remote workers need the key; a random one only works for the local ones
+        self.authkey = os.urandom(16) if authkey is None else authkey
+        self._listener = Listener(address, authkey=self.authkey)
+        self._joined = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._thread.start()
+        self._workers = [
+            _context.Process(target=run_tcp_worker, args=(self.address, self.authkey), daemon=True)
+            for _ in range(workers)
+        ]
+        for process in self._workers:
+            process.start()
+
+    @property
+    def address(self):
+        return self._listener.address
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                self._joined.put(self._listener.accept())
+            except OSError:
+                # the listener was closed
+                return
+            except Exception:
+                # failed handshake, e.g. a wrong authkey
+                continue
+
+    def accept(self):
+        connections = []
+        while not self._joined.empty():
+            connections.append(self._joined.get())
+        return connections
+
+    def close(self):
+        self._closed = True
+        # closing the listener doesn't interrupt a blocked accept, so wake it with a connection first
+        if self._thread.is_alive():
+            try:
+                Client(self.address, authkey=self.authkey).close()
+            except OSError:
+                pass
+            self._thread.join(timeout=5)
+        self._listener.close()
+        for process in self._workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+
+def run_tcp_worker(address, authkey):
+    connection = Client(address, authkey=authkey)
+    try:
+        serve(connection)
+    except EOFError:
+        pass
+    finally:
+        connection.close()
+
+
+class _FileConnection:
+    """
+    A connection whose messages are files, numbered in order, in an inbox and an outbox directory.
+    Files are written under a temporary name and renamed, so they are never read half-written. The
+    peer is considered gone if its heartbeat file hasn't been touched for `timeout` seconds.
+    """
+
+    def __init__(self, inbox, outbox, heartbeat, timeout):
+        self._inbox = inbox
+        self._outbox = outbox
+        self._heartbeat = heartbeat
+        self._timeout = timeout
+        self._sent = 0
+        self._received = 0
+
+    def _next_path(self):
+        return os.path.join(self._inbox, '{:012d}.pkl'.format(self._received))
+
+    def send(self, obj):
+        path = os.path.join(self._outbox, '{:012d}.pkl'.format(self._sent))
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(obj, f)
+        os.replace(path + '.tmp', path)
+        self._sent += 1
+
+    def poll(self):
+        return os.path.exists(self._next_path()) or self.is_stale()
+
+    def is_stale(self):
+        return _is_stale(self._heartbeat, self._timeout)
+
+    def recv(self, poll_interval=0.05):
+        while not os.path.exists(self._next_path()):
+            if self.is_stale():
+                raise EOFError('peer stopped sending heartbeats')
+            time.sleep(poll_interval)
+
+        path = self._next_path()
+        with open(path, 'rb') as f:
+            obj = pickle.load(f)
+        os.remove(path)
+        self._received += 1
+        return obj
+
+
+def _is_stale(heartbeat, timeout):
+    try:
+        return time.time() - os.path.getmtime(heartbeat) > timeout
+    except OSError:
+        return True
+
+
+def _beat(heartbeat, interval, stopped):
+    while True:
+        with open(heartbeat, 'a'):
+            os.utime(heartbeat)
+        if stopped.wait(interval):
+            return
+
+
+class FileTransport(_Transport):
+    """
+    Exchanges messages through `directory`, which workers started with `run_file_worker` join by
+    creating a subdirectory of `directory/workers`. The coordinator and the workers touch heartbeat
+    files every `timeout / 4` seconds, and either side gives up on the other after `timeout` seconds
+    without one. `workers` local worker processes are started as well, which is handy for testing.
+    """
+
+    def __init__(self, directory, workers=0, timeout=60.):
+        self._workers_dir = os.path.join(directory, 'workers')
+        os.makedirs(self._workers_dir, exist_ok=True)
+        self._timeout = timeout
+        self._known = set()
+        self._stopped = threading.Event()
+        threading.Thread(
+            target=_beat, args=(os.path.join(directory, 'heartbeat'), timeout / 4, self._stopped), daemon=True
+        ).start()
+        self._workers = [
+            _context.Process(target=run_file_worker, args=(directory, timeout), daemon=True) for _ in range(workers)
+        ]
+        for process in self._workers:
+            process.start()
+
+    def accept(self):
+        connections = []
+        for name in sorted(os.listdir(self._workers_dir)):
+            if name.startswith('.') or name in self._known:
+                continue
+            self._known.add(name)
+            worker = os.path.join(self._workers_dir, name)
+            connections.append(_FileConnection(
+                os.path.join(worker, 'to_coordinator'),
+                os.path.join(worker, 'to_worker'),
+                os.path.join(worker, 'heartbeat'),
+                self._timeout
+            ))
+        return connections
+
+    def wait(self, connections, timeout):
+        deadline = time.time() + timeout
+        while True:
+            ready = [connection for connection in connections if connection.poll()]
+            if ready or time.time() >= deadline:
+                return ready
+            time.sleep(min(0.01, timeout))
+
+    def close(self):
+        self._stopped.set()
+        for process in self._workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+
+def run_file_worker(directory, timeout=60., poll_interval=0.5):
+    """Joins the coordinator of a `FileTransport` on `directory`, waiting for one to be running first."""
+    coordinator = os.path.join(directory, 'heartbeat')
+    while _is_stale(coordinator, timeout):
+        time.sleep(poll_interval)
+
+    name = uuid.uuid4().hex
+    staging = os.path.join(directory, 'workers', '.' + name)
+    worker = os.path.join(directory, 'workers', name)
+    for subdirectory in ('to_worker', 'to_coordinator'):
+        os.makedirs(os.path.join(staging, subdirectory))
+
+    with open(os.path.join(staging, 'heartbeat'), 'a'):
+        pass
+    # the coordinator only sees the worker once its directory is complete
+    os.rename(staging, worker)
+
+    # started after the rename, so that it keeps touching the heartbeat where the coordinator looks for it
+    stopped = threading.Event()
+    threading.Thread(target=_beat, args=(os.path.join(worker, 'heartbeat'), timeout / 4, stopped), daemon=True).start()
+    try:
+        serve(_FileConnection(
+            os.path.join(worker, 'to_worker'),
+            os.path.join(worker, 'to_coordinator'),
+            coordinator,
+            timeout
+        ))
+    except EOFError:
+        pass
+    finally:
+        stopped.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs a worker for `run_tasks`.')
+    subparsers = parser.add_subparsers(dest='transport', required=True)
+    tcp = subparsers.add_parser('tcp', help='connect to a TCPTransport')
+    tcp.add_argument('address', help='HOST:PORT')
+    tcp.add_argument('authkey')
+    file = subparsers.add_parser('file', help='join a FileTransport')
+    file.add_argument('directory')
+    file.add_argument('--timeout', type=float, default=60.)
+    args = parser.parse_args()
+
+    if args.transport == 'tcp':
+        host, port = args.address.rsplit(':', 1)
+        run_tcp_worker((host, int(port)), args.authkey.encode())
+    else:
+        run_file_worker(args.directory, args.timeout)
@@ -1,22 +1,299 @@
+import json
+import warnings
+from importlib.util import find_spec
+
 import numpy as np
 
+from uniswap_simulator import instrumentation
+from uniswap_simulator.precision import resolve_dtype
+
+
+# 'mc' is plain Monte Carlo, 'antithetic' pairs each path with its mirror image (paths 2k and 2k + 1),
+# and 'sobol' builds paths from scrambled Sobol points through a Brownian bridge (requires scipy)
+SAMPLING_METHODS = ('mc', 'antithetic', 'sobol')
+# independently scrambled Sobol sequences per sample, for standard errors (see `sample_blocks`)
+SOBOL_REPLICATES = 8
+
+
+def spawn_generators(seed, count):
+    """
+    Creates `count` statistically independent generators from a single seed (an int or a
+    `np.random.SeedSequence`), e.g. one per parallel worker.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [np.random.default_rng(child) for child in seed.spawn(count)]
+
 
 class GeometricBrownianMotion:
-    def __init__(self, x0, mu, sigma, dt, T):
+    def __init__(self, x0, mu, sigma, dt, T, dtype=None):
+        self._dtype = resolve_dtype(dtype)
         self._x0 = x0
         self._mu = mu
         self._sigma = sigma
         self._dt = dt
         self._n = int(T / dt)
 
-    def sample(self, count=1):
-        noise = np.random.normal(
-            0,
-            np.sqrt(self._dt),
-            size=(self._n - 1, count)
-        )
+    def __len__(self):
+        return self._n
+
+    def sample(self, count=1, rng=None, method='mc', replicates=SOBOL_REPLICATES):
+        """
+        Samples `count` full trajectories, shape (time x trajectories). When `rng` is None the global
+        `np.random` state is used; otherwise `rng` may be a `np.random.Generator`, a `SeedSequence`
+        or an int seed. For a given `rng`, this matches `sample_blocks` bit for bit.
+        See `SAMPLING_METHODS` for `method`.
+        """
+        return np.concatenate(list(self.sample_blocks(count, self._n, rng, method, replicates)), axis=0)
+
+    def sample_blocks(self, count=1, block_size=1000, rng=None, method='mc', replicates=SOBOL_REPLICATES):
+        """
+        Yields the same trajectories as `sample`, but in blocks of at most `block_size` time steps
+        so that only one block needs to be in memory at a time. The cumulative growth of each
+        trajectory is carried across block boundaries, always in float64; blocks are only converted to
+        the working dtype on the way out.
+
+        With `method='sobol'`, the Brownian motion is first fixed at 64 evenly spaced times (fewer for
+        short paths) from Sobol points, in Brownian bridge order so that the coarsest features of
+        each path get the best-distributed coordinates, and the steps in between are filled in with
+        pseudo-random Brownian bridges. Path j takes its points from the (j % `replicates`)th of several
+        independently scrambled Sobol sequences: the spread between those replicates is what standard
+        errors have to be computed from (see `compare_to_hodl.estimate_growth`), since quasi-random
+        paths aren't independent. `count / replicates` should be a power of two (per cell, in a sweep).
+
+        The returned iterator can be snapshotted between blocks (see `uniswap_simulator.checkpoint`)
+        if `rng` is not None. Its `next_block(out)` writes the next block into the first rows of a
+        preallocated (`block_size` x `count`) array instead of allocating one, and returns those rows.
+        """
+        if method not in SAMPLING_METHODS:
+            raise ValueError('method must be one of {}, got {!r}'.format(SAMPLING_METHODS, method))
+        if method == 'sobol':
+            return _BridgeSampler(self, count, block_size, rng, replicates)
+        return _BlockSampler(self, count, block_size, rng, antithetic=method == 'antithetic')
+
+
+def stack_samplers(samplers):
+    """
+    Combines block samplers (e.g. one per (mu, sigma) cell, each with its own rng) into one whose
+    blocks are theirs side by side along the trajectory axis. They must have the same block size.
+    """
+    return _StackedSampler(samplers)
+
+
+class _StackedSampler:
+    def __init__(self, samplers):
+        self._samplers = list(samplers)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # each sampler raises StopIteration at the same block
+        return np.concatenate([next(sampler) for sampler in self._samplers], axis=1)
+
+    def next_block(self, out=None):
+        if out is None:
+            return next(self)
+
+        start, size = 0, 0
+        for sampler in self._samplers:
+            size = len(sampler.next_block(out[:, start:start + sampler._count]))
+            start += sampler._count
+        return out[:size]
+
+    def snapshot(self):
+        state = {}
+        for i, sampler in enumerate(self._samplers):
+            for key, array in sampler.snapshot().items():
+                state['{}/{}'.format(i, key)] = array
+        return state
+
+    def restore(self, state):
+        for i, sampler in enumerate(self._samplers):
+            prefix = '{}/'.format(i)
+            sampler.restore({key[len(prefix):]: array for key, array in state.items() if key.startswith(prefix)})
+
+
+class _BlockSampler:
+    def __init__(self, gbm, count, block_size, rng, antithetic=False):
+        self._gbm = gbm
+        self._block_size = block_size
+        self._rng = np.random if rng is None else np.random.default_rng(rng)
+        self._antithetic = antithetic
+
+        self._drift = (gbm._mu - 0.5 * gbm._sigma ** 2) * gbm._dt
+        self._start = 0
+        self._count = count
+        self._growth = np.ones(count)
+        # float64 scratch for the cumulative growth, reused from block to block
+        self._x = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.next_block()
+
+    @instrumentation.timed(name='GeometricBrownianMotion.sample_blocks')
+    def next_block(self, out=None):
+        gbm = self._gbm
+        if self._start >= gbm._n:
+            raise StopIteration
+
+        size = min(self._block_size, gbm._n - self._start)
+        # the first row of the first block is t=0, for which there is no noise
+        first = self._start == 0
+        steps = size - 1 if first else size
+
+        if self._x is None:
+            self._x = np.empty((min(self._block_size, gbm._n) + 1, self._count))
+        x = self._x[:steps + 1]
+        x[0] = self._growth
+        noise = self._normal(x[1:])
+        noise *= gbm._sigma
+        noise += self._drift
+        np.exp(noise, out=noise)
+        growth = np.cumprod(x, axis=0, out=x)
+        self._growth = growth[-1].copy()
+
+        if out is None:
+            out = np.empty((size, self._count), dtype=gbm._dtype)
+        self._start += size
+        return np.multiply(gbm._x0, growth if first else growth[1:], out=out[:size])
+
+    def _normal(self, out):
+        """Fills `out` with normal increments of standard deviation sqrt(dt)."""
+        steps, count = out.shape
+        if self._antithetic:
+            half = self._rng.standard_normal((steps, (count + 1) // 2))
+            out[:, 0::2] = half
+            np.negative(half[:, :count // 2], out=out[:, 1::2])
+        elif self._rng is np.random:
+            # the legacy global state can't write into `out`
+            out[...] = np.random.standard_normal((steps, count))
+        else:
+            self._rng.standard_normal(out=out)
+        out *= np.sqrt(self._gbm._dt)
+        return out
+
+    def snapshot(self):
+        if self._rng is np.random:
+            raise ValueError('sampling from the global np.random state cannot be snapshotted, pass an rng')
+        return {
+            'start': np.array(self._start),
+            'growth': self._growth,
+            'rng': np.array(json.dumps(self._rng.bit_generator.state))
+        }
+
+    def restore(self, state):
+        self._start = int(state['start'])
+        self._growth = np.array(state['growth'], dtype=np.float64)
+        self._rng.bit_generator.state = json.loads(str(state['rng']))
+
+
+class _BridgeSampler:
+    BRIDGE_LEVELS = 6
+
+    def __init__(self, gbm, count, block_size, rng, replicates):
+        if find_spec('scipy') is None:
+            raise RuntimeError('Sobol sampling requires scipy')
+        if rng is None:
+            raise ValueError('Sobol sampling needs an rng, to scramble the points with')
+        self._gbm = gbm
+        self._block_size = block_size
+        self._rng = np.random.default_rng(rng)
+
+        # times of the skeleton, in steps. The last row of the path is at step n - 1
+        steps = max(gbm._n - 1, 0)
+        levels = min(self.BRIDGE_LEVELS, int(np.log2(steps)) if steps > 0 else 0)
+        self._times = np.rint(np.linspace(0, steps, 2 ** levels + 1)).astype(np.int64)
+        self._skeleton = self._sample_skeleton(count, levels, replicates)
+
+        self._interval = 0
+        self._buffer = np.ones((1, count))
+        self._start = 0
+        self._count = count
+
+    def _sample_skeleton(self, count, levels, replicates):
+        """Brownian motion (in units of sqrt(step)) at `_times`, from one Sobol point per path."""
+        # imported here, since scipy.stats takes a while to import
+        from scipy.special import ndtri
+        from scipy.stats import qmc
+
+        times = self._times.astype(np.float64)
+        points = np.empty((count, 2 ** levels))
+        with warnings.catch_warnings():
+            # in a sweep, each cell takes an aligned power-of-two chunk of the sequence, which is balanced
+            # even though the total isn't a power of two
+            warnings.filterwarnings('ignore', message='The balance properties')
+            for r in range(min(replicates, count)):
+                points[r::replicates] = qmc.Sobol(d=2 ** levels, scramble=True, seed=self._rng).random(
+                    len(range(r, count, replicates))
+                )
+        z = ndtri(points).T
+
+        w = np.zeros((len(times), count))
+        w[-1] = np.sqrt(times[-1]) * z[0]
+        dimension = 1
+        for level in range(levels):
+            step = 2 ** (levels - level)
+            for left in range(0, 2 ** levels, step):
+                middle, right = left + step // 2, left + step
+                t_l, t_m, t_r = times[left], times[middle], times[right]
+                mean = ((t_r - t_m) * w[left] + (t_m - t_l) * w[right]) / (t_r - t_l)
+                w[middle] = mean + np.sqrt((t_m - t_l) * (t_r - t_m) / (t_r - t_l)) * z[dimension]
+                dimension += 1
+        return w
+
+    def _fill(self, interval):
+        """Log growth of every step in the given skeleton interval, excluding its first row."""
+        gbm = self._gbm
+        left, right = self._times[interval], self._times[interval + 1]
+        m = right - left
+        w_left, w_right = self._skeleton[interval], self._skeleton[interval + 1]
+
+        walk = np.cumsum(self._rng.normal(size=(m, len(w_left))), axis=0)
+        fraction = (np.arange(1, m + 1) / m)[:, np.newaxis]
+        w = w_left + walk - fraction * walk[-1] + fraction * (w_right - w_left)
+
+        t = np.arange(left + 1, right + 1)[:, np.newaxis] * gbm._dt
+        return np.exp((gbm._mu - 0.5 * gbm._sigma ** 2) * t + gbm._sigma * np.sqrt(gbm._dt) * w)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.next_block()
+
+    @instrumentation.timed(name='GeometricBrownianMotion.sample_blocks')
+    def next_block(self, out=None):
+        gbm = self._gbm
+        if self._start >= gbm._n:
+            raise StopIteration
+
+        size = min(self._block_size, gbm._n - self._start)
+        while len(self._buffer) < size:
+            self._buffer = np.concatenate((self._buffer, self._fill(self._interval)), axis=0)
+            self._interval += 1
+
+        block, self._buffer = self._buffer[:size], self._buffer[size:]
+        if out is None:
+            out = np.empty((size, self._count), dtype=gbm._dtype)
+        self._start += size
+        return np.multiply(gbm._x0, block, out=out[:size])
 
-        x = np.exp((self._mu - 0.5 * self._sigma ** 2) * self._dt + self._sigma * noise)
-        x = np.pad(x, ((1, 0), (0, 0)), mode='constant', constant_values=1)
+    def snapshot(self):
+        return {
+            'start': np.array(self._start),
+            'interval': np.array(self._interval),
+            'skeleton': self._skeleton,
+            'buffer': self._buffer,
+            'rng': np.array(json.dumps(self._rng.bit_generator.state))
+        }
 
-        return self._x0 * x.cumprod(axis=0)
+    def restore(self, state):
+        self._start = int(state['start'])
+        self._interval = int(state['interval'])
+        self._skeleton = np.array(state['skeleton'])
+        self._buffer = np.array(state['buffer'])
+        self._rng.bit_generator.state = json.loads(str(state['rng']))
@@ -0,0 +1,201 @@
+"""
+Price paths from historical data. A `PriceHistory` memory-maps a price series stored as `.npy` (see
+`convert_csv`) or raw binary, and streams it in (time x 1) blocks like the ones
+`GeometricBrownianMotion.sample_blocks` yields. `BlockBootstrap` generates any number of synthetic
+paths of any length by stationary block bootstrap of the history's log returns, in the same blocks.
+Neither ever loads the whole history, or all paths, into memory.
+"""
+import json
+from itertools import islice
+
+import numpy as np
+
+from uniswap_simulator import instrumentation
+from uniswap_simulator.precision import resolve_dtype
+
+
+def convert_csv(csv_path, npy_path, column=1, delimiter=',', header=True, dtype='float64', chunk_rows=1000000):
+    """
+    Converts one column of a CSV file (by index, or by name if there is a `header`) into an `.npy`
+    file that `PriceHistory` can memory-map. Rows are processed `chunk_rows` at a time. Returns the
+    number of rows written.
+    """
+    with open(csv_path) as f:
+        if header:
+            names = next(f).rstrip('\r\n').split(delimiter)
+            if isinstance(column, str):
+                column = names.index(column)
+        rows = sum(1 for line in f if line.strip())
+
+    out = np.lib.format.open_memmap(npy_path, mode='w+', dtype=np.dtype(dtype), shape=(rows,))
+    with open(csv_path) as f:
+        if header:
+            next(f)
+        lines = (line for line in f if line.strip())
+
+        start = 0
+        while start < rows:
+            chunk = [line.split(delimiter)[column].strip() for line in islice(lines, chunk_rows)]
+            out[start:start + len(chunk)] = np.array(chunk, dtype=float)
+            start += len(chunk)
+
+    out.flush()
+    del out
+    return rows
+
+
+class PriceHistory:
+    """
+    A memory-mapped historical price series, oldest first. `path` is an `.npy` file, or a raw binary
+    file of `dtype` values (shaped (time,) or, with `columns`, (time x columns)).
+    """
+
+    def __init__(self, path, dtype='float64', columns=None):
+        if str(path).endswith('.npy'):
+            self._prices = np.load(path, mmap_mode='r')
+        else:
+            prices = np.memmap(path, dtype=dtype, mode='r')
+            self._prices = prices if columns is None else prices.reshape(-1, columns)
+
+    def __len__(self):
+        return len(self._prices)
+
+    @property
+    def prices(self):
+        return self._prices
+
+    def blocks(self, block_size=1000, start=0, stop=None, dtype=None):
+        """
+        Yields rows `start` through `stop` as (time x series) blocks of at most `block_size` rows,
+        converted to the working dtype. A 1-D history is a single series.
+        """
+        dtype = resolve_dtype(dtype)
+        stop = len(self) if stop is None else min(stop, len(self))
+
+        for i in range(start, stop, block_size):
+            block = np.array(self._prices[i:min(i + block_size, stop)], dtype=dtype)
+            yield block.reshape(len(block), -1)
+
+    def log_returns(self, path=None, chunk_rows=1000000):
+        """
+        Log returns between consecutive prices of a 1-D history, computed `chunk_rows` at a time. If
+        `path` is given they're written to an `.npy` file there and returned memory-mapped.
+        """
+        n = max(len(self) - 1, 0)
+        if path is None:
+            returns = np.empty(n)
+        else:
+            returns = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=(n,))
+
+        for i in range(0, n, chunk_rows):
+            prices = np.log(np.asarray(self._prices[i:min(i + chunk_rows, n) + 1], dtype=np.float64))
+            returns[i:i + len(prices) - 1] = np.diff(prices)
+
+        if path is not None:
+            returns.flush()
+        return returns
+
+
+class BlockBootstrap:
+    """
+    Stationary block bootstrap (Politis & Romano) of a 1-D array of historical log returns, which
+    may be memory-mapped. Each synthetic path strings together blocks of consecutive returns, starting
+    at uniformly random positions (wrapping around the end), with geometrically distributed lengths of
+    mean `mean_block_length`. Paths have `n` rows, the first of which is `x0`.
+    """
+
+    def __init__(self, returns, n, mean_block_length=100, x0=1., dtype=None):
+        if len(returns) == 0:
+            raise ValueError('need at least one historical return')
+        self._dtype = resolve_dtype(dtype)
+        self._returns = returns
+        self._n = int(n)
+        self._p = 1. / mean_block_length
+        self._x0 = x0
+
+    def __len__(self):
+        return self._n
+
+    def sample(self, count=1, rng=None):
+        return np.concatenate(list(self.sample_blocks(count, self._n, rng)), axis=0)
+
+    def sample_blocks(self, count=1, block_size=1000, rng=None):
+        """
+        Yields `count` synthetic paths in (time x trajectories) blocks of at most `block_size` rows.
+        `rng` is anything `np.random.default_rng` accepts. The iterator can be snapshotted between
+        blocks (see `uniswap_simulator.checkpoint`).
+        """
+        return _BootstrapSampler(self, count, block_size, rng)
+
+
+class _BootstrapSampler:
+    def __init__(self, bootstrap, count, block_size, rng):
+        self._bootstrap = bootstrap
+        self._block_size = block_size
+        self._rng = np.random.default_rng(rng)
+
+        self._start = 0
+        # position in `returns` of the last return used by each path, and each path's log price
+        self._index = self._rng.integers(0, len(bootstrap._returns), size=count)
+        self._log_price = np.zeros(count)
+
+    def __iter__(self):
+        return self
+
+    @instrumentation.timed(name='BlockBootstrap.sample_blocks')
+    def __next__(self):
+        bootstrap = self._bootstrap
+        if self._start >= bootstrap._n:
+            raise StopIteration
+
+        size = min(self._block_size, bootstrap._n - self._start)
+        # the first row of the first block is t=0, which has no return
+        steps = size - 1 if self._start == 0 else size
+        count = len(self._index)
+        m = len(bootstrap._returns)
+
+        # each step either starts a new block at a random position, or moves on to the next return.
+        # A step's position is the start of the latest block plus the number of steps since then.
+        restart = self._rng.random((steps, count)) < bootstrap._p
+        starts = self._rng.integers(0, m, size=(steps, count))
+        t = np.arange(steps)[:, np.newaxis]
+        last = np.maximum.accumulate(np.where(restart, t, -1), axis=0)
+
+        index = np.where(
+            last >= 0,
+            np.take_along_axis(starts, np.maximum(last, 0), axis=0) + (t - last),
+            self._index + t + 1
+        ) % m
+
+        # sorted gathers are friendlier to memory-mapped returns
+        order = np.argsort(index, axis=None)
+        returns = np.empty(index.size)
+        returns[order] = bootstrap._returns[index.ravel()[order]]
+        returns = returns.reshape(index.shape)
+
+        log_price = np.empty((steps + 1, count))
+        log_price[0] = self._log_price
+        np.cumsum(returns, axis=0, out=log_price[1:])
+        log_price[1:] += self._log_price
+
+        if steps > 0:
+            self._index = index[-1]
+        self._log_price = log_price[-1]
+
+        block = bootstrap._x0 * np.exp(log_price if self._start == 0 else log_price[1:])
+        self._start += size
+        return block.astype(bootstrap._dtype, copy=False)
+
+    def snapshot(self):
+        return {
+            'start': np.array(self._start),
+            'index': self._index,
+            'log_price': self._log_price,
+            'rng': np.array(json.dumps(self._rng.bit_generator.state))
+        }
+
+    def restore(self, state):
+        self._start = int(state['start'])
+        self._index = np.array(state['index'], dtype=np.int64)
+        self._log_price = np.array(state['log_price'], dtype=np.float64)
+        self._rng.bit_generator.state = json.loads(str(state['rng']))
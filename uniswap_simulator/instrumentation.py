@@ -0,0 +1,160 @@
+"""
+Lightweight instrumentation of the hot paths. It is off by default, in which case an instrumented
+call costs one extra function call and a flag check. Once enabled (`enable` or `recording`), every
+function wrapped with `timed` records its call count and wall time, plus how far traced memory
+peaked above where it started if `track_memory` is set (which uses `tracemalloc` and is much
+slower). Code can also bump named counters with `count`; `Position` and `PositionV2` count
+path-steps, fee band crossings, out-of-range paths and rebalanced paths this way.
+
+    with instrumentation.recording():
+        sweep(...)
+    print(instrumentation.format_table())
+"""
+import json
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+
+_enabled = False
+_track_memory = False
+# whether `enable` started tracemalloc, and so `disable` should stop it again
+_started_tracing = False
+
+_timings = defaultdict(lambda: {'calls': 0, 'total': 0., 'max': 0., 'peak_bytes': 0})
+_counters = defaultdict(int)
+# per thread, the highest traced memory seen by each timed call in progress (innermost last)
+_local = threading.local()
+
+
+def is_enabled():
+    return _enabled
+
+
+def enable(track_memory=False):
+    global _enabled, _track_memory, _started_tracing
+    _enabled = True
+    _track_memory = track_memory
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracing = True
+
+
+def disable():
+    global _enabled, _track_memory, _started_tracing
+    if _started_tracing:
+        tracemalloc.stop()
+        _started_tracing = False
+    _enabled = False
+    _track_memory = False
+
+
+def reset():
+    """Discards everything recorded so far."""
+    _timings.clear()
+    _counters.clear()
+
+
+@contextmanager
+def recording(track_memory=False):
+    """Enables instrumentation for a block of code. Recorded data is kept afterwards."""
+    enable(track_memory)
+    try:
+        yield
+    finally:
+        disable()
+
+
+def count(name, value=1):
+    """Adds `value` to counter `name`. Callers should skip computing `value` unless `is_enabled()`."""
+    if _enabled:
+        _counters[name] += int(value)
+
+
+def timed(func=None, name=None):
+    """
+    Decorator that records calls to `func` under `name` (its qualified name by default). Nested
+    timed calls are included in the time and memory of the outer call. With `track_memory`,
+    'peak_bytes' adds up, over calls, the peak traced memory during the call minus that at its start.
+    """
+    if func is None:
+        return lambda func: timed(func, name)
+    name = name or func.__qualname__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+
+        track_memory = _track_memory and tracemalloc.is_tracing()
+        if track_memory:
+            peaks = _peaks()
+            memory_start, peak = tracemalloc.get_traced_memory()
+            # resetting the peak below hides it from enclosing calls, so it is carried over by hand
+            if peaks:
+                peaks[-1] = max(peaks[-1], peak)
+            peaks.append(memory_start)
+            # without `reset_peak` (Python < 3.9), the peak is the process-wide one since tracing started
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            timing = _timings[name]
+            timing['calls'] += 1
+            timing['total'] += elapsed
+            timing['max'] = max(timing['max'], elapsed)
+            if track_memory:
+                peak = max(peaks.pop(), tracemalloc.get_traced_memory()[1])
+                timing['peak_bytes'] += peak - memory_start
+                if peaks:
+                    peaks[-1] = max(peaks[-1], peak)
+
+    return wrapper
+
+
+def _peaks():
+    if not hasattr(_local, 'peaks'):
+        _local.peaks = []
+    return _local.peaks
+
+
+def summary():
+    """Returns everything recorded so far as a dict of plain Python types."""
+    timings = {}
+    for name, timing in _timings.items():
+        timings[name] = dict(timing, mean=timing['total'] / timing['calls'])
+    return {'timings': timings, 'counters': dict(_counters)}
+
+
+def to_json(path=None):
+    """Returns the `summary` as a JSON string, and writes it to `path` if given."""
+    text = json.dumps(summary(), indent=2, sort_keys=True)
+    if path is not None:
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+    return text
+
+
+def format_table():
+    """Formats the `summary` as a text table, with the functions that took the most time first."""
+    data = summary()
+    lines = ['{:<40} {:>10} {:>12} {:>12} {:>12} {:>12}'.format(
+        'function', 'calls', 'total (s)', 'mean (ms)', 'max (ms)', 'peak (MB)')]
+    for name, timing in sorted(data['timings'].items(), key=lambda item: -item[1]['total']):
+        lines.append('{:<40} {:>10} {:>12.3f} {:>12.4f} {:>12.4f} {:>12.1f}'.format(
+            name, timing['calls'], timing['total'], 1e3 * timing['mean'], 1e3 * timing['max'],
+            timing['peak_bytes'] / 2 ** 20))
+
+    if data['counters']:
+        lines.append('')
+        lines.append('{:<40} {:>10}'.format('counter', 'value'))
+        for name, value in sorted(data['counters'].items()):
+            lines.append('{:<40} {:>10}'.format(name, value))
+    return '\n'.join(lines)
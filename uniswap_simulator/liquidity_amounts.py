@@ -1,5 +1,7 @@
 import numpy as np
 
+from uniswap_simulator.instrumentation import timed
+
 
 def liquidity_for_amount0(sqrt_ratio_a, sqrt_ratio_b, amount0):
     """
@@ -26,6 +28,7 @@ def liquidity_for_amount1(sqrt_ratio_a, sqrt_ratio_b, amount1):
     return liquidity
 
 
+@timed
 def liquidity_for_amounts(sqrt_ratio, sqrt_ratio_a, sqrt_ratio_b, amount0, amount1):
     """
     Computes the maximum amount of liquidity received for a given amount of token0, token1, the current
@@ -75,6 +78,7 @@ def amount1_for_liquidity(sqrt_ratio_a, sqrt_ratio_b, liquidity):
     return amount1
 
 
+@timed
 def amounts_for_liquidity(sqrt_ratio, sqrt_ratio_a, sqrt_ratio_b, liquidity):
     """
     Computes the token0 and token1 value for a given amount of liquidity, the current
@@ -97,3 +101,62 @@ def amounts_for_liquidity(sqrt_ratio, sqrt_ratio_a, sqrt_ratio_b, liquidity):
 
     assert not np.any(np.isnan(amounts))
     return amounts
+
+
+@timed
+def amounts_for_liquidity_fused(sqrt_ratio, sqrt_ratio_a, sqrt_ratio_b, liquidity, out=None):
+    """
+    Single-pass equivalent of `amounts_for_liquidity`. The current price is clipped into the range
+    once, so each amount is evaluated with one formula and no masking. Results are written to `out`
+    (shape `(..., 2)`) when given, in which case nothing is allocated.
+    Input args are broadcast against each other.
+    """
+    if out is None:
+        shape = np.broadcast(sqrt_ratio, sqrt_ratio_a, sqrt_ratio_b, liquidity).shape
+        out = np.empty((*shape, 2), dtype=np.result_type(sqrt_ratio, liquidity))
+    amount0 = out[..., 0]
+    amount1 = out[..., 1]
+
+    # amount1 temporarily holds the clipped price
+    np.clip(sqrt_ratio, sqrt_ratio_a, sqrt_ratio_b, out=amount1)
+
+    np.subtract(sqrt_ratio_b, amount1, out=amount0)
+    amount0 *= liquidity
+    amount0 /= amount1
+    amount0 /= sqrt_ratio_b
+
+    amount1 -= sqrt_ratio_a
+    amount1 *= liquidity
+    return out
+
+
+@timed
+def liquidity_for_amounts_fused(sqrt_ratio, sqrt_ratio_a, sqrt_ratio_b, amount0, amount1, out=None):
+    """
+    Single-pass equivalent of `liquidity_for_amounts`. The current price is clipped into the range
+    once; at either edge of the range one of the two candidate liquidities becomes infinite (or
+    undefined), and it is discarded by taking the NaN-ignoring minimum. Empty ranges (lower == upper),
+    which `liquidity_for_amounts` rejects, get no liquidity. Results are written to `out` when given.
+    Input args are broadcast against each other.
+    """
+    shape = np.broadcast(sqrt_ratio, sqrt_ratio_a, sqrt_ratio_b, amount0, amount1).shape
+    if out is None:
+        out = np.empty(shape, dtype=np.result_type(sqrt_ratio, amount0, amount1))
+
+    # full shape, since the amounts may broadcast beyond the prices
+    clipped = np.empty(shape, dtype=np.result_type(sqrt_ratio, sqrt_ratio_a, sqrt_ratio_b))
+    np.clip(sqrt_ratio, sqrt_ratio_a, sqrt_ratio_b, out=clipped)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # liquidity for amount1 over [a, clipped]
+        np.subtract(clipped, sqrt_ratio_a, out=out)
+        np.divide(amount1, out, out=out)
+
+        # liquidity for amount0 over [clipped, b], computed in place of `clipped`
+        sub = sqrt_ratio_b - clipped
+        clipped *= sqrt_ratio_b
+        clipped *= amount0
+        clipped /= sub
+
+    np.fmin(out, clipped, out=out)
+    np.copyto(out, 0, where=sqrt_ratio_a >= sqrt_ratio_b)
+    return out
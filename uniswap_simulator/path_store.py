@@ -0,0 +1,119 @@
+import os
+import tempfile
+import uuid
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+
+class PricePathStore:
+    """
+    A (time x trajectories) price array that lives outside of any one process, either in a
+    `multiprocessing.shared_memory` segment or in an `np.memmap` file. One process creates and fills
+    the store; others attach to it through its (small, picklable) `handle` and get zero-copy,
+    read-only views of the same paths.
+    """
+
+    def __init__(self, handle, prices, owner, shm=None):
+        self._handle = handle
+        self._prices = prices
+        self._owner = owner
+        self._shm = shm
+
+    @classmethod
+    def create(cls, shape, dtype='float64', backend='memmap', name=None, directory=None):
+        dtype = np.dtype(dtype)
+        shape = tuple(int(n) for n in shape)
+
+        if backend == 'shm':
+            if shared_memory is None:
+                raise RuntimeError('shared memory backend requires Python 3.8+, use backend="memmap"')
+            shm = shared_memory.SharedMemory(name=name, create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+            prices = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            return cls((backend, shm.name, shape, dtype.str), prices, owner=True, shm=shm)
+
+        if backend == 'memmap':
+            if name is None:
+                name = os.path.join(directory or tempfile.gettempdir(), 'price-paths-{}.dat'.format(uuid.uuid4().hex))
+            prices = np.memmap(name, dtype=dtype, mode='w+', shape=shape)
+            return cls((backend, name, shape, dtype.str), prices, owner=True)
+
+        raise ValueError('unknown backend {!r}'.format(backend))
+
+    @classmethod
+    def attach(cls, handle):
+        backend, name, shape, dtype = handle
+
+        if backend == 'shm':
+            shm = shared_memory.SharedMemory(name=name)
+            prices = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            prices.flags.writeable = False
+            return cls(handle, prices, owner=False, shm=shm)
+
+        if backend == 'memmap':
+            prices = np.memmap(name, dtype=dtype, mode='r', shape=shape)
+            return cls(handle, prices, owner=False)
+
+        raise ValueError('unknown backend {!r}'.format(backend))
+
+    @property
+    def handle(self):
+        return self._handle
+
+    @property
+    def prices(self):
+        return self._prices
+
+    @property
+    def shape(self):
+        return self._prices.shape
+
+    def write(self, blocks):
+        """
+        Fills the store from an iterable of (time x trajectories) blocks, e.g.
+        `GeometricBrownianMotion.sample_blocks`. Returns the number of time steps written.
+        """
+        assert self._owner, 'only the process that created the store may write to it'
+
+        start = 0
+        for block in blocks:
+            self._prices[start:start + len(block)] = block
+            start += len(block)
+
+        if isinstance(self._prices, np.memmap):
+            self._prices.flush()
+        return start
+
+    def blocks(self, block_size=256, paths=slice(None)):
+        """
+        Yields copies of consecutive time blocks for the selected trajectories. Strategies are free
+        to modify these, while the shared paths stay untouched.
+        """
+        for start in range(0, len(self._prices), block_size):
+            yield np.array(self._prices[start:start + block_size, paths])
+
+    def close(self):
+        self._prices = None
+        if self._shm is not None:
+            self._shm.close()
+
+    def unlink(self):
+        """Frees the underlying memory or file. Only the creator should call this."""
+        self.close()
+        if self._handle[0] == 'shm':
+            self._shm.unlink()
+        else:
+            os.remove(self._handle[1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._owner:
+            self.unlink()
+        else:
+            self.close()
@@ -0,0 +1,130 @@
+"""
+Overlapping path generation with simulation. Generating prices (random draws, cumulative sums,
+exponentials) and stepping a strategy are both NumPy-bound and release the GIL for most of their
+time, so within a single process they can run side by side: `prefetch` produces the next block of
+prices on a background thread while the caller simulates the current one.
+
+    blocks = prefetch(gbm.sample_blocks(count, block_size, rng))
+    log_growth, log_growth_hodl = log_growth_streaming(strategy, blocks)
+"""
+import queue
+import threading
+
+import numpy as np
+
+
+class DoubleBuffer:
+    """
+    Iterates over `blocks` (any iterable of arrays, e.g. `GeometricBrownianMotion.sample_blocks`) with
+    a producer thread that puts each block into one of two buffers, clipped to `price_bounds` if
+    given. Samplers with a `next_block(out)` method (those of `GeometricBrownianMotion`) generate
+    blocks directly into the buffers; blocks of other iterables are copied into them. The producer
+    only starts on a block once the consumer has released a buffer, so at most two blocks are held at
+    any time. Each block yielded is a view of a buffer, and is only valid until the next one is
+    requested. Errors raised by `blocks` are re-raised in the consumer.
+
+    A sampler iterated through a `DoubleBuffer` runs one block ahead, so it can't be snapshotted
+    consistently with the strategy (see `uniswap_simulator.checkpoint`).
+    """
+
+    def __init__(self, blocks, price_bounds=None):
+        self._blocks = iter(blocks)
+        self._next_block = getattr(blocks, 'next_block', None)
+        self._price_bounds = price_bounds
+        self._buffers = [None, None]
+        self._free = queue.Queue()
+        self._full = queue.Queue()
+        self._held = None
+        self._closed = False
+
+        self._free.put(0)
+        self._free.put(1)
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _produce(self):
+        try:
+            while True:
+                index = self._free.get()
+                if index is None or self._closed:
+                    return
+                block = self._generate(index) if self._next_block is not None else self._copy(index)
+                if block is None:
+                    self._full.put((None, None))
+                    return
+                self._full.put((index, block))
+        except Exception as e:
+            self._full.put((None, e))
+
+    def _generate(self, index):
+        other = self._buffers[1 - index]
+        try:
+            if other is None:
+                # the first block becomes the first buffer, and tells the shape of the second
+                block = self._buffers[index] = self._next_block()
+            else:
+                if self._buffers[index] is None:
+                    self._buffers[index] = np.empty_like(other)
+                block = self._next_block(out=self._buffers[index])
+        except StopIteration:
+            return None
+
+        if self._price_bounds is not None:
+            np.clip(block, *self._price_bounds, out=block)
+        return block
+
+    def _copy(self, index):
+        block = next(self._blocks, None)
+        if block is None:
+            return None
+
+        block = np.asarray(block)
+        buffer = self._buffers[index]
+        if buffer is None or buffer.dtype != block.dtype or buffer.shape[1:] != block.shape[1:] \
+                or len(buffer) < len(block):
+            buffer = self._buffers[index] = np.empty_like(block)
+
+        out = buffer[:len(block)]
+        if self._price_bounds is None:
+            np.copyto(out, block)
+        else:
+            np.clip(block, *self._price_bounds, out=out)
+        return out
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._held is not None:
+            self._free.put(self._held)
+            self._held = None
+        if self._closed:
+            raise StopIteration
+
+        index, item = self._full.get()
+        if index is None:
+            self.close()
+            if item is not None:
+                raise item
+            raise StopIteration
+
+        self._held = index
+        return item
+
+    def close(self):
+        self._closed = True
+        # wakes up the producer if it's waiting for a buffer
+        self._free.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def prefetch(blocks, price_bounds=None):
+    """Generator over `blocks` through a `DoubleBuffer`, which is shut down when the generator is."""
+    with DoubleBuffer(blocks, price_bounds) as buffer:
+        yield from buffer
@@ -0,0 +1,433 @@
+"""
+A tick-level model of a Uniswap v3 pool, vectorized over N independent price trajectories (one pool
+per trajectory, all sharing the same set of initialized ticks). Liquidity is added and removed at
+ticks, and swaps move the price tick by tick: within the range between two initialized ticks the
+active liquidity is constant, and crossing a tick adds its net liquidity. Initialized ticks are
+found through a word-packed bitmap, so a swap's cost depends on the number of bitmap words and
+initialized ticks it crosses, not on the number of ticks or positions.
+
+Fees are accounted for like in the protocol: each swap step adds its fee per unit of active liquidity
+to a global accumulator, and every initialized tick records the fee growth on its "outside", which
+flips when the tick is crossed. The fee growth inside any range follows from those, so positions'
+fees are only computed when they are touched (`mint`, `burn` or `collect`).
+"""
+import numpy as np
+
+from uniswap_simulator import instrumentation
+from uniswap_simulator.liquidity_amounts import amounts_for_liquidity_fused
+from uniswap_simulator.tick_math import MIN_TICK, MAX_TICK, LOG_TICK_BASE, tick_to_sqrt_price
+
+
+WORD_BITS = 64
+_ALL_BITS = np.uint64(2 ** 64 - 1)
+
+MIN_SQRT_PRICE = float(tick_to_sqrt_price(MIN_TICK))
+MAX_SQRT_PRICE = float(tick_to_sqrt_price(MAX_TICK))
+
+
+def _lsb(words):
+    # index of the least significant set bit of each (nonzero) word. Isolated bits are powers of two,
+    # so they convert to float exactly
+    isolated = words & (~words + np.uint64(1))
+    return np.frexp(isolated.astype(np.float64))[1] - 1
+
+
+def _msb(words):
+    # index of the most significant set bit of each (nonzero) word. Rounding to float can carry into
+    # the next power of two, which is corrected for
+    bits = np.minimum(np.frexp(words.astype(np.float64))[1] - 1, WORD_BITS - 1)
+    return bits - ((words >> bits.astype(np.uint64)) == 0)
+
+
+class TickBitmap:
+    """
+    One bit per multiple of `spacing` in [MIN_TICK, MAX_TICK], packed into 64-bit words, that marks
+    whether the tick is initialized. Lookups are vectorized over arrays of ticks.
+    """
+
+    def __init__(self, spacing=1):
+        self.spacing = spacing
+        # a spare word on either side keeps lookups next to the extreme ticks in bounds
+        self._offset = MIN_TICK // spacing - WORD_BITS
+        self._words = np.zeros((MAX_TICK // spacing - self._offset) // WORD_BITS + 2, dtype=np.uint64)
+
+    def _position(self, compressed):
+        offset = compressed - self._offset
+        return offset // WORD_BITS, (offset % WORD_BITS).astype(np.uint64)
+
+    def set(self, ticks, initialized=True):
+        word, bit = self._position(np.asarray(ticks) // self.spacing)
+        masks = np.left_shift(np.uint64(1), bit)
+        if initialized:
+            np.bitwise_or.at(self._words, word, masks)
+        else:
+            np.bitwise_and.at(self._words, word, ~masks)
+
+    def is_initialized(self, ticks):
+        word, bit = self._position(np.asarray(ticks) // self.spacing)
+        return (self._words[word] >> bit) & np.uint64(1) == 1
+
+    def next_initialized_tick_within_one_word(self, ticks, lte):
+        """
+        Like `TickBitmap.nextInitializedTickWithinOneWord` in the protocol: for each tick, the next
+        initialized tick at or below it (where `lte`) or above it (elsewhere), looking no further than
+        the end of its word. Returns the ticks and whether they are initialized; if they're not, they
+        are the last tick of the word.
+        """
+        compressed = np.floor_divide(ticks, self.spacing) + np.where(lte, 0, 1)
+        word, bit = self._position(compressed)
+        masks = np.where(lte, _ALL_BITS >> (np.uint64(WORD_BITS - 1) - bit), _ALL_BITS << bit)
+        masked = self._words[word] & masks
+        initialized = masked != 0
+
+        nonzero = np.where(initialized, masked, np.uint64(1))
+        found = np.where(lte, _msb(nonzero), _lsb(nonzero))
+        edge = np.where(lte, 0, WORD_BITS - 1)
+        next_bit = np.where(initialized, found, edge)
+
+        return (compressed + (next_bit - bit.astype(np.int64))) * self.spacing, initialized
+
+
+class Pool:
+    """
+    Concentrated liquidity pools over N price trajectories, starting at `price` (shape (N,)). Ticks
+    used by `mint` must be multiples of `tick_spacing`. Besides liquidity minted directly, existing
+    `Position` objects can be attached (see `attach`), after which every swap moves them too.
+    """
+
+    # arrays that hold per-tick state, one row per initialized tick
+    _TICK_ARRAYS = ('_liquidity_net', '_liquidity_gross', '_fee_growth_outside')
+
+    def __init__(self, price, fee, tick_spacing=1):
+        self._fee = fee
+        self._spacing = tick_spacing
+        self._price_sqrt = np.sqrt(np.array(price, dtype=np.float64))
+        self._tick = self._tick_at(self._price_sqrt)
+        self._liquidity = np.zeros_like(self._price_sqrt)
+        # fees per unit of liquidity, [token0, token1], ever earned on each trajectory
+        self._fee_growth_global = np.zeros((len(self), 2))
+
+        self._bitmap = TickBitmap(tick_spacing)
+        # state of initialized ticks lives in rows of (ticks x trajectories) arrays; `_rows` maps
+        # compressed ticks to those rows
+        self._rows = np.full(len(self._bitmap._words) * WORD_BITS, -1, dtype=np.int64)
+        self._row_ticks = np.zeros(0, dtype=np.int64)
+        self._liquidity_net = np.zeros((0, len(self)))
+        self._liquidity_gross = np.zeros((0, len(self)))
+        self._fee_growth_outside = np.zeros((0, len(self), 2))
+        self._free_rows = []
+
+        # liquidity minted through `mint`, one row per position id
+        self._position_lower = []
+        self._position_upper = []
+        self._position_liquidity = []
+        self._position_fee_growth_inside = []
+        self._position_owed = []
+
+        self._attached = {}
+
+    def __len__(self):
+        return len(self._price_sqrt)
+
+    @property
+    def fee(self):
+        return self._fee
+
+    @property
+    def tick_spacing(self):
+        return self._spacing
+
+    @property
+    def price(self):
+        return np.square(self._price_sqrt)
+
+    @property
+    def price_sqrt(self):
+        return self._price_sqrt.copy()
+
+    @property
+    def tick(self):
+        return self._tick.copy()
+
+    @property
+    def liquidity(self):
+        """Liquidity that is active at the current price of each trajectory."""
+        return self._liquidity.copy()
+
+    @property
+    def initialized_ticks(self):
+        return np.sort(self._row_ticks[self._row_ticks != np.iinfo(np.int64).min])
+
+    def _tick_at(self, price_sqrt):
+        # the greatest tick whose sqrt price is at most `price_sqrt`, corrected for rounding in the log
+        tick = np.floor(2 * np.log(price_sqrt) / LOG_TICK_BASE).astype(np.int64)
+        tick = np.clip(tick, MIN_TICK, MAX_TICK - 1)
+        tick += tick_to_sqrt_price(tick + 1) <= price_sqrt
+        tick -= tick_to_sqrt_price(tick) > price_sqrt
+        return tick
+
+    def _compressed(self, ticks):
+        return ticks // self._spacing - self._bitmap._offset
+
+    def _get_rows(self, ticks):
+        """Rows of `ticks`, initializing the ticks that don't have one yet."""
+        ticks = np.asarray(ticks)
+        rows = self._rows[self._compressed(ticks)]
+        new_ticks = np.unique(ticks[rows < 0])
+
+        for tick in new_ticks:
+            if not self._free_rows:
+                self._grow(max(len(self._row_ticks), 16))
+            row = self._free_rows.pop()
+            self._rows[self._compressed(tick)] = row
+            self._row_ticks[row] = tick
+            self._liquidity_net[row] = 0
+            self._liquidity_gross[row] = 0
+            # by convention, all growth so far happened below the tick
+            self._fee_growth_outside[row] = np.where(
+                (tick <= self._tick)[:, np.newaxis], self._fee_growth_global, 0
+            )
+
+        if len(new_ticks):
+            self._bitmap.set(new_ticks)
+            rows = self._rows[self._compressed(ticks)]
+        return rows
+
+    def _grow(self, extra):
+        size = len(self._row_ticks)
+        self._row_ticks = np.concatenate((self._row_ticks, np.full(extra, np.iinfo(np.int64).min)))
+        for name in self._TICK_ARRAYS:
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate((array, np.zeros((extra, *array.shape[1:]))), axis=0))
+        self._free_rows.extend(range(size + extra - 1, size - 1, -1))
+
+    def _release_rows(self, rows):
+        """Uninitializes the ticks of `rows` that no longer hold any liquidity."""
+        rows = np.unique(rows)
+        empty = rows[~np.any(self._liquidity_gross[rows] > 0, axis=1)]
+        if len(empty) == 0:
+            return
+
+        ticks = self._row_ticks[empty]
+        self._bitmap.set(ticks, False)
+        self._rows[self._compressed(ticks)] = -1
+        self._row_ticks[empty] = np.iinfo(np.int64).min
+        self._free_rows.extend(empty.tolist())
+
+    def _check_ticks(self, lower, upper):
+        if np.any(lower % self._spacing) or np.any(upper % self._spacing):
+            raise ValueError('ticks must be multiples of the tick spacing ({})'.format(self._spacing))
+        if np.any(lower >= upper) or np.any(lower < MIN_TICK) or np.any(upper > MAX_TICK):
+            raise ValueError('ticks must satisfy MIN_TICK <= lower < upper <= MAX_TICK')
+
+    def _update_ticks(self, lower, upper, liquidity):
+        """Adds `liquidity` (which may be negative) to [lower, upper) on every trajectory."""
+        paths = np.arange(len(self))
+        lower_rows = self._get_rows(lower)
+        upper_rows = self._get_rows(upper)
+
+        np.add.at(self._liquidity_net, (lower_rows, paths), liquidity)
+        np.add.at(self._liquidity_net, (upper_rows, paths), -liquidity)
+        np.add.at(self._liquidity_gross, (lower_rows, paths), liquidity)
+        np.add.at(self._liquidity_gross, (upper_rows, paths), liquidity)
+
+        in_range = (lower <= self._tick) & (self._tick < upper)
+        self._liquidity += np.where(in_range, liquidity, 0)
+        return lower_rows, upper_rows
+
+    def _amounts(self, lower, upper, liquidity):
+        return amounts_for_liquidity_fused(
+            self._price_sqrt,
+            tick_to_sqrt_price(lower),
+            tick_to_sqrt_price(upper),
+            liquidity
+        )
+
+    def _fee_growth_inside(self, lower, upper):
+        paths = np.arange(len(self))
+        outside_lower = self._fee_growth_outside[self._rows[self._compressed(lower)], paths]
+        outside_upper = self._fee_growth_outside[self._rows[self._compressed(upper)], paths]
+
+        below = np.where((self._tick >= lower)[:, np.newaxis], outside_lower, self._fee_growth_global - outside_lower)
+        above = np.where((self._tick < upper)[:, np.newaxis], outside_upper, self._fee_growth_global - outside_upper)
+        return self._fee_growth_global - below - above
+
+    def _touch(self, position_id):
+        """Credits a position with the fees its liquidity earned since it was last touched."""
+        if not np.any(self._position_liquidity[position_id] > 0):
+            # its ticks may not be initialized anymore, and there's nothing to credit anyway
+            return
+        inside = self._fee_growth_inside(self._position_lower[position_id], self._position_upper[position_id])
+        last = self._position_fee_growth_inside[position_id]
+        liquidity = self._position_liquidity[position_id]
+
+        self._position_owed[position_id] += liquidity[:, np.newaxis] * (inside - last)
+        last[...] = inside
+
+    @instrumentation.timed
+    def mint(self, lower, upper, liquidity):
+        """
+        Adds `liquidity` between ticks `lower` and `upper` (each a scalar or one value per trajectory).
+        Returns the id of the new position and the amounts (N x 2) it took.
+        """
+        lower, upper, liquidity = (np.broadcast_to(x, (len(self),)) for x in (lower, upper, liquidity))
+        lower = lower.astype(np.int64)
+        upper = upper.astype(np.int64)
+        liquidity = np.array(liquidity, dtype=np.float64)
+        self._check_ticks(lower, upper)
+
+        self._update_ticks(lower, upper, liquidity)
+        self._position_lower.append(lower)
+        self._position_upper.append(upper)
+        self._position_liquidity.append(liquidity)
+        self._position_fee_growth_inside.append(self._fee_growth_inside(lower, upper))
+        self._position_owed.append(np.zeros((len(self), 2)))
+        return len(self._position_liquidity) - 1, self._amounts(lower, upper, liquidity)
+
+    @instrumentation.timed
+    def burn(self, position_id, liquidity=None):
+        """
+        Removes `liquidity` (all of it by default) from a position created by `mint`. Returns the
+        amounts (N x 2) that the removed liquidity was worth. Fees stay with the position until they're
+        collected.
+        """
+        self._touch(position_id)
+        lower = self._position_lower[position_id]
+        upper = self._position_upper[position_id]
+        available = self._position_liquidity[position_id]
+        liquidity = available.copy() if liquidity is None else np.minimum(liquidity, available)
+
+        lower_rows, upper_rows = self._update_ticks(lower, upper, -liquidity)
+        available -= liquidity
+        self._release_rows(np.concatenate((lower_rows, upper_rows)))
+        return self._amounts(lower, upper, liquidity)
+
+    @instrumentation.timed
+    def collect(self, position_id):
+        """Returns the fees (N x 2) a position created by `mint` has earned, and resets them to 0."""
+        self._touch(position_id)
+        owed = self._position_owed[position_id].copy()
+        self._position_owed[position_id][...] = 0
+        return owed
+
+    def position_liquidity(self, position_id):
+        return self._position_liquidity[position_id].copy()
+
+    def attach(self, position):
+        """
+        Adds the liquidity of a `Position` over the same trajectories to the pool, at the ticks closest
+        to its bounds, and moves the position along with every swap from then on. If the position's
+        liquidity or bounds change, `detach` and re-`attach` it.
+        """
+        if id(position) in self._attached:
+            raise ValueError('position is already attached')
+        lower = np.rint(2 * np.log(position._lower_sqrt) / LOG_TICK_BASE).astype(np.int64)
+        upper = np.rint(2 * np.log(position._upper_sqrt) / LOG_TICK_BASE).astype(np.int64)
+        lower -= np.mod(lower, self._spacing)
+        upper -= np.mod(upper, self._spacing)
+        upper = np.maximum(upper, lower + self._spacing)
+
+        position_id, _ = self.mint(lower, upper, position._liquidity)
+        self._attached[id(position)] = (position, position_id)
+
+    def detach(self, position):
+        _, position_id = self._attached.pop(id(position))
+        self.burn(position_id)
+
+    @instrumentation.timed
+    def swap(self, amount_in, zero_for_one, price_limit=None):
+        """
+        Swaps `amount_in` (including fees) of token0 for token1 where `zero_for_one`, and of token1 for
+        token0 elsewhere, stopping early at `price_limit` if given. All arguments are scalars or have
+        one value per trajectory. Returns the amounts (N x 2) that went into the pool, so the amount
+        that came out is negative.
+        """
+        zero_for_one = np.broadcast_to(zero_for_one, (len(self),))
+        if price_limit is None:
+            limit = np.where(zero_for_one, MIN_SQRT_PRICE, MAX_SQRT_PRICE)
+        else:
+            limit = np.sqrt(np.broadcast_to(price_limit, (len(self),)))
+        amount = np.array(np.broadcast_to(amount_in, (len(self),)), dtype=np.float64)
+        return self._swap(zero_for_one, amount, limit)
+
+    @instrumentation.timed
+    def swap_to_price(self, price):
+        """
+        Swaps each trajectory to `price`, like an arbitrageur would after the price moves elsewhere.
+        Returns the amounts (N x 2) that went into the pool.
+        """
+        limit = np.sqrt(np.broadcast_to(price, (len(self),)).astype(np.float64))
+        return self._swap(limit < self._price_sqrt, np.full(len(self), np.inf), limit)
+
+    def run(self, prices):
+        """Calls `swap_to_price` on each row of the (time x trajectories) `prices` block."""
+        for price in prices:
+            self.swap_to_price(price)
+
+    def _swap(self, zero_for_one, amount_remaining, limit):
+        limit = np.clip(limit, MIN_SQRT_PRICE, MAX_SQRT_PRICE)
+        gamma = 1. - self._fee
+        amounts = np.zeros((len(self), 2))
+
+        active = np.flatnonzero(
+            (amount_remaining > 0) & np.where(zero_for_one, limit < self._price_sqrt, limit > self._price_sqrt)
+        )
+        steps = 0
+        while active.size:
+            steps += 1
+            down = zero_for_one[active]
+            price_sqrt = self._price_sqrt[active]
+            liquidity = self._liquidity[active]
+            remaining = amount_remaining[active]
+
+            next_tick, initialized = self._bitmap.next_initialized_tick_within_one_word(self._tick[active], down)
+            next_tick = np.clip(next_tick, MIN_TICK, MAX_TICK)
+            next_sqrt = tick_to_sqrt_price(next_tick)
+            target = np.where(down, np.maximum(next_sqrt, limit[active]), np.minimum(next_sqrt, limit[active]))
+
+            # input (before fees) needed to reach the target, and the most that's available
+            with np.errstate(divide='ignore', invalid='ignore'):
+                needed = liquidity * np.where(down, 1. / target - 1. / price_sqrt, target - price_sqrt)
+                available = np.maximum(remaining, 0) * gamma
+                reached = needed <= available
+                new_sqrt = np.where(
+                    reached,
+                    target,
+                    np.where(down, liquidity * price_sqrt / (liquidity + available * price_sqrt),
+                             price_sqrt + available / liquidity)
+                )
+                amount_in = np.where(reached, needed, available)
+                fee_amount = np.where(reached, needed * self._fee / gamma, np.maximum(remaining, 0) - available)
+                amount_out = liquidity * np.where(down, price_sqrt - new_sqrt, 1. / price_sqrt - 1. / new_sqrt)
+
+            amount_remaining[active] -= amount_in + fee_amount
+            has_liquidity = liquidity > 0
+            self._fee_growth_global[active[has_liquidity], np.where(down, 0, 1)[has_liquidity]] += \
+                fee_amount[has_liquidity] / liquidity[has_liquidity]
+            amounts[active, np.where(down, 0, 1)] += amount_in + fee_amount
+            amounts[active, np.where(down, 1, 0)] -= amount_out
+            self._price_sqrt[active] = new_sqrt
+
+            crossed = reached & (new_sqrt == next_sqrt)
+            cross = crossed & initialized
+            if np.any(cross):
+                paths = active[cross]
+                rows = self._rows[self._compressed(next_tick[cross])]
+                self._fee_growth_outside[rows, paths] = self._fee_growth_global[paths] - self._fee_growth_outside[rows, paths]
+                net = self._liquidity_net[rows, paths]
+                self._liquidity[paths] += np.where(down[cross], -net, net)
+
+            self._tick[active] = np.where(
+                crossed,
+                np.where(down, next_tick - 1, next_tick),
+                self._tick_at(new_sqrt)
+            )
+            done = ~reached | (new_sqrt == limit[active]) | (amount_remaining[active] <= 0)
+            active = active[~done]
+
+        if instrumentation.is_enabled():
+            instrumentation.count('Pool.swap_steps', steps)
+
+        for position, _ in self._attached.values():
+            position.move_to(self._price_sqrt)
+        return amounts
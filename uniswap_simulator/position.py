@@ -1,22 +1,80 @@
 import numpy as np
 
-from uniswap_simulator.liquidity_amounts import liquidity_for_amounts, amounts_for_liquidity
+from uniswap_simulator.liquidity_amounts import liquidity_for_amounts, amounts_for_liquidity, \
+    amounts_for_liquidity_fused
+from uniswap_simulator import instrumentation
+from uniswap_simulator.engine import run_position, fee_band_filter
+from uniswap_simulator.precision import resolve_dtype, ACCUMULATOR_DTYPE
+from uniswap_simulator.tick_math import tick_to_sqrt_price
+
+
+class _Workspace:
+    """Scratch buffers reused by `Position.update_inplace` from one step to the next."""
+
+    def __init__(self, shape, dtype):
+        self.shape = shape
+        self.ratio = np.empty(shape, dtype=dtype)
+        self.price = np.empty(shape, dtype=dtype)
+        self.price_sqrt = np.empty(shape, dtype=dtype)
+        self.moved = np.empty(shape, dtype=bool)
+        self.flag = np.empty(shape, dtype=bool)
+        self.amounts_previous = np.empty((*shape, 2), dtype=dtype)
+        self.amounts_current = np.empty((*shape, 2), dtype=dtype)
+        self.amounts = np.empty((*shape, 2), dtype=dtype)
 
 
 class Position:
-    def __init__(self, price, lower, upper, fee):
-        self._price_sqrt = np.sqrt(price)
-        self._lower_sqrt = np.sqrt(lower)
-        self._upper_sqrt = np.sqrt(upper)
+    def __init__(self, price, lower, upper, fee, dtype=None):
+        # see `uniswap_simulator.precision`; fees are always accumulated in ACCUMULATOR_DTYPE
+        self._dtype = resolve_dtype(dtype)
+        self._price_sqrt = np.sqrt(price, dtype=self._dtype)
+        self._lower_sqrt = np.sqrt(lower, dtype=self._dtype)
+        self._upper_sqrt = np.sqrt(upper, dtype=self._dtype)
         self._fee = fee
+        self._cache_range()
 
-        self._liquidity = np.zeros_like(price)
+        self._liquidity = np.zeros_like(self._price_sqrt)
         self._earned = None
 
+        self._workspace = None
+        self._price_cache = None
+        self._amounts_cache = None
+        self._active_fraction = None
+
     def reset(self, price):
-        self._price_sqrt = np.sqrt(price)
-        self._liquidity = np.zeros_like(price)
+        self._price_sqrt = np.sqrt(price, dtype=self._dtype)
+        self._liquidity = np.zeros_like(self._price_sqrt)
         self._earned = None
+        self._invalidate_caches()
+
+    def snapshot(self):
+        """Returns the position's state as a dict of arrays (see `uniswap_simulator.checkpoint`)."""
+        state = {
+            'price_sqrt': self._price_sqrt,
+            'lower_sqrt': self._lower_sqrt,
+            'upper_sqrt': self._upper_sqrt,
+            'liquidity': self._liquidity
+        }
+        if self._earned is not None:
+            state['earned'] = self._earned
+        return state
+
+    def restore(self, state):
+        self._price_sqrt = np.array(state['price_sqrt'], dtype=self._dtype)
+        self._lower_sqrt = np.array(state['lower_sqrt'], dtype=self._dtype)
+        self._upper_sqrt = np.array(state['upper_sqrt'], dtype=self._dtype)
+        self._liquidity = np.array(state['liquidity'], dtype=self._dtype)
+        self._earned = np.array(state['earned'], dtype=ACCUMULATOR_DTYPE) if 'earned' in state else None
+        self._cache_range()
+
+        self._workspace = None
+        self._active_fraction = None
+        self._invalidate_caches()
+
+    def _invalidate_caches(self):
+        # must be called whenever `_price_sqrt` is changed by anything but `update_inplace`/`update_active`
+        self._price_cache = None
+        self._amounts_cache = None
 
     @property
     def _price(self):
@@ -24,11 +82,19 @@ class Position:
 
     @property
     def lower(self):
-        return np.square(self._lower_sqrt)
+        return self._lower
 
     @property
     def upper(self):
-        return np.square(self._upper_sqrt)
+        return self._upper
+
+    def _cache_range(self):
+        # bounds only change on a rerange, so there's no need to square them on every access. They are
+        # handed out read-only, and replaced rather than modified, so callers can keep them
+        self._lower = np.square(self._lower_sqrt)
+        self._upper = np.square(self._upper_sqrt)
+        self._lower.flags.writeable = False
+        self._upper.flags.writeable = False
 
     @property
     def fee(self):
@@ -36,7 +102,8 @@ class Position:
 
     @property
     def amounts(self):
-        return self._earned + amounts_for_liquidity(
+        # the same kernel as the stepping methods, so that they all return identical amounts
+        return self._earned + amounts_for_liquidity_fused(
             self._price_sqrt,
             self._lower_sqrt,
             self._upper_sqrt,
@@ -47,6 +114,7 @@ class Position:
     def collectable(self):
         return self._earned
 
+    @instrumentation.timed
     def update(self, price):
         # If price movement is less than fee, it's not guaranteed that the AMM will
         # be arb'd to match new price
@@ -55,16 +123,31 @@ class Position:
             price / self._price < 1 - self._fee
         ), axis=0)
         price[~should_update] = self._price[~should_update]
-        price_sqrt = np.sqrt(price)
+        amounts = self._move_to(np.sqrt(price, dtype=self._dtype))
+
+        if instrumentation.is_enabled():
+            self._count_step(np.count_nonzero(should_update))
+        return amounts
 
-        amounts_previous = amounts_for_liquidity(
-            self._price_sqrt.clip(min=self._lower_sqrt, max=self._upper_sqrt),
+    @instrumentation.timed
+    def move_to(self, price_sqrt):
+        """
+        Moves every path to `price_sqrt` and earns fees on the way, like `update` but without the fee
+        band filter. This is for prices that actual swaps moved the pool to (see `uniswap_simulator.pool`).
+        `price_sqrt` is copied, since the position updates its prices in place.
+        """
+        return self._move_to(np.array(price_sqrt, dtype=self._dtype))
+
+    def _move_to(self, price_sqrt):
+        # takes ownership of `price_sqrt`; the fused kernel clips prices into [lower, upper] itself
+        amounts_previous = amounts_for_liquidity_fused(
+            self._price_sqrt,
             self._lower_sqrt,
             self._upper_sqrt,
             self._liquidity
         )
-        amounts_current = amounts_for_liquidity(
-            price_sqrt.clip(min=self._lower_sqrt, max=self._upper_sqrt),
+        amounts_current = amounts_for_liquidity_fused(
+            price_sqrt,
             self._lower_sqrt,
             self._upper_sqrt,
             self._liquidity
@@ -73,14 +156,195 @@ class Position:
         diff = amounts_current - amounts_previous
         mask = diff[..., 0] > 0
         if self._earned is None:
-            self._earned = np.zeros_like(diff)
+            self._earned = np.zeros(diff.shape, dtype=ACCUMULATOR_DTYPE)
         
         self._earned[mask, 0] += diff[mask, 0] * self._fee
         self._earned[~mask, 1] += diff[~mask, 1] * self._fee
 
         self._price_sqrt = price_sqrt
+        self._invalidate_caches()
         return self.amounts
 
+    @instrumentation.timed
+    def update_inplace(self, price):
+        """
+        Equivalent to `update`, except that `price` is left untouched and, once the workspace has been
+        allocated on the first call, no arrays are allocated. The returned amounts live in that
+        workspace, so they are only valid until the next call.
+        """
+        ws = self._workspace
+        if ws is None or ws.shape != self._price_sqrt.shape:
+            ws = self._workspace = _Workspace(self._price_sqrt.shape, self._price_sqrt.dtype)
+            self._invalidate_caches()
+        if self._price_cache is None:
+            self._price_cache = np.square(self._price_sqrt)
+        if self._earned is None:
+            self._earned = np.zeros(ws.amounts.shape, dtype=ACCUMULATOR_DTYPE)
+        price_previous = self._price_cache
+
+        # If price movement is less than fee, it's not guaranteed that the AMM will
+        # be arb'd to match new price
+        np.divide(price, price_previous, out=ws.ratio)
+        np.greater(ws.ratio, 1 / (1 - self._fee), out=ws.moved)
+        np.less(ws.ratio, 1 - self._fee, out=ws.flag)
+        ws.moved |= ws.flag
+        np.copyto(ws.price, price_previous)
+        np.copyto(ws.price, price, where=ws.moved)
+        np.sqrt(ws.price, out=ws.price_sqrt)
+
+        amounts_previous = amounts_for_liquidity_fused(
+            self._price_sqrt,
+            self._lower_sqrt,
+            self._upper_sqrt,
+            self._liquidity,
+            out=ws.amounts_previous
+        )
+        amounts_current = amounts_for_liquidity_fused(
+            ws.price_sqrt,
+            self._lower_sqrt,
+            self._upper_sqrt,
+            self._liquidity,
+            out=ws.amounts_current
+        )
+
+        # diff is computed in place of `amounts_previous`
+        diff = np.subtract(amounts_current, amounts_previous, out=amounts_previous)
+        diff *= self._fee
+        np.greater(diff[..., 0], 0, out=ws.flag)
+        np.add(self._earned[..., 0], diff[..., 0], out=self._earned[..., 0], where=ws.flag)
+        np.logical_not(ws.flag, out=ws.flag)
+        np.add(self._earned[..., 1], diff[..., 1], out=self._earned[..., 1], where=ws.flag)
+
+        np.copyto(self._price_sqrt, ws.price_sqrt)
+        np.square(self._price_sqrt, out=self._price_cache)
+        self._amounts_cache = None
+        if instrumentation.is_enabled():
+            self._count_step(np.count_nonzero(ws.moved))
+        return np.add(self._earned, amounts_current, out=ws.amounts)
+
+    def _count_step(self, crossings):
+        # per-step counters, only collected while instrumentation is enabled
+        instrumentation.count('Position.path_steps', self._price_sqrt.size)
+        instrumentation.count('Position.fee_band_crossings', crossings)
+        instrumentation.count('Position.out_of_range', np.count_nonzero(
+            (self._price_sqrt <= self._lower_sqrt) | (self._price_sqrt >= self._upper_sqrt)
+        ))
+
+    @property
+    def active_fraction(self):
+        """Fraction of paths that `update_active` had to evaluate on its last call."""
+        return self._active_fraction
+
+    @instrumentation.timed
+    def update_active(self, price):
+        """
+        Equivalent to `update`, except that `price` is left untouched and work is only done for the
+        active set: paths whose price moved beyond the fee band and didn't stay outside
+        [lower, upper] on the same side. Nothing else can earn fees or change composition,
+        so the liquidity amounts of those paths are kept from the previous call.
+        """
+        if self._price_cache is None:
+            self._price_cache = np.square(self._price_sqrt)
+        if self._amounts_cache is None:
+            self._amounts_cache = amounts_for_liquidity_fused(
+                self._price_sqrt,
+                self._lower_sqrt,
+                self._upper_sqrt,
+                self._liquidity
+            )
+        if self._earned is None:
+            self._earned = np.zeros(self._amounts_cache.shape, dtype=ACCUMULATOR_DTYPE)
+
+        # If price movement is less than fee, it's not guaranteed that the AMM will
+        # be arb'd to match new price
+        ratio = price / self._price_cache
+        moved = np.flatnonzero((ratio > 1 / (1 - self._fee)) | (ratio < 1 - self._fee))
+        price_sqrt = np.sqrt(price[moved])
+        price_sqrt_previous = self._price_sqrt[moved]
+        lower_sqrt = self._lower_sqrt[moved]
+        upper_sqrt = self._upper_sqrt[moved]
+
+        self._price_sqrt[moved] = price_sqrt
+        self._price_cache[moved] = np.square(price_sqrt)
+
+        keep = ~(
+            ((price_sqrt_previous <= lower_sqrt) & (price_sqrt <= lower_sqrt)) |
+            ((price_sqrt_previous >= upper_sqrt) & (price_sqrt >= upper_sqrt))
+        )
+        active = moved[keep]
+        self._active_fraction = len(active) / max(self._price_sqrt.size, 1)
+
+        amounts_previous = self._amounts_cache[active]
+        amounts_current = amounts_for_liquidity_fused(
+            price_sqrt[keep],
+            lower_sqrt[keep],
+            upper_sqrt[keep],
+            self._liquidity[active]
+        )
+
+        diff = amounts_current - amounts_previous
+        mask = diff[..., 0] > 0
+        earned = self._earned[active]
+        earned[mask, 0] += diff[mask, 0] * self._fee
+        earned[~mask, 1] += diff[~mask, 1] * self._fee
+
+        self._earned[active] = earned
+        self._amounts_cache[active] = amounts_current
+        if instrumentation.is_enabled():
+            self._count_step(len(moved))
+        return self._earned + self._amounts_cache
+
+    @instrumentation.timed
+    def run(self, prices, engine='auto'):
+        """
+        Calls `update` on each row of the (time x trajectories) `prices` block, possibly through a
+        compiled engine (see `uniswap_simulator.engine`). Returns the final amounts.
+        Subclasses that override `update` are always stepped through it.
+        """
+        if type(self).update is not Position.update:
+            engine = 'numpy'
+        return run_position(self, prices, engine)
+
+    @instrumentation.timed
+    def simulate(self, prices, engine='auto'):
+        """
+        Whole-trajectory alternative to calling `update` on each row of the (time x trajectories)
+        `prices` block, for positions that aren't minted into, burned or reranged along the way.
+        Only the fee-band filter steps through time (see `engine.fee_band_filter`); amounts and fees
+        are then computed for all rows at once and accumulated with a cumulative sum. Like `update`,
+        rows of `prices` are overwritten with the price the pool actually moved to.
+        Returns the amounts after each step (time x trajectories x 2).
+        """
+        price_sqrt = np.empty((len(prices) + 1, *self._price_sqrt.shape), dtype=self._price_sqrt.dtype)
+        price_sqrt[0] = self._price_sqrt
+        fee_band_filter(prices, self._price_sqrt, self._fee, out=price_sqrt[1:], engine=engine)
+
+        amounts = amounts_for_liquidity_fused(
+            price_sqrt,
+            self._lower_sqrt,
+            self._upper_sqrt,
+            self._liquidity
+        )
+        diff = amounts[1:] - amounts[:-1]
+        diff *= self._fee
+        mask = diff[..., 0] > 0
+
+        # row 0 holds the fees earned so far, so the cumulative sum adds fees in the same order as `update`
+        earned = np.zeros(amounts.shape, dtype=ACCUMULATOR_DTYPE)
+        if self._earned is not None:
+            earned[0] = self._earned
+        earned[1:, ..., 0] = np.where(mask, diff[..., 0], 0)
+        earned[1:, ..., 1] = np.where(mask, 0, diff[..., 1])
+        np.cumsum(earned, axis=0, out=earned)
+
+        self._price_sqrt = price_sqrt[-1].copy()
+        self._earned = earned[-1].copy()
+        self._invalidate_caches()
+
+        earned[1:] += amounts[1:]
+        return earned[1:]
+
+    @instrumentation.timed
     def mint(self, amount0, amount1):
         liquidity = liquidity_for_amounts(
             self._price_sqrt,
@@ -90,6 +354,7 @@ class Position:
             amount1
         )
         self._liquidity += liquidity
+        self._amounts_cache = None
         return amounts_for_liquidity(
             self._price_sqrt,
             self._lower_sqrt,
@@ -97,9 +362,11 @@ class Position:
             liquidity
         )
 
+    @instrumentation.timed
     def burn(self, fraction=1.0):
         liquidity_to_burn = self._liquidity * fraction
         self._liquidity -= liquidity_to_burn
+        self._amounts_cache = None
 
         burned = amounts_for_liquidity(
             self._price_sqrt,
@@ -112,9 +379,11 @@ class Position:
         self._earned -= earned
         return burned + earned
 
+    @instrumentation.timed
     def burn_at(self, mask, fraction=1.0):
         liquidity_to_burn = self._liquidity * fraction * mask
         self._liquidity -= liquidity_to_burn
+        self._amounts_cache = None
 
         burned = amounts_for_liquidity(
             self._price_sqrt,
@@ -126,3 +395,47 @@ class Position:
 
         self._earned -= earned
         return burned + earned
+
+    @instrumentation.timed
+    def rerange(self, lower, upper, mask=None, ticks=False, spacing=1):
+        """
+        Burns all liquidity and earnings on the paths selected by `mask` (every path by default) and
+        moves those paths to the new bounds in place. Returns the amounts burned.
+
+        With `ticks=True`, `lower` and `upper` are integer ticks (multiples of `spacing`) and their sqrt
+        prices are looked up with `tick_math.tick_to_sqrt_price` rather than computed.
+        """
+        if self._earned is None:
+            self._earned = np.zeros((*self._liquidity.shape, 2), dtype=ACCUMULATOR_DTYPE)
+
+        def to_sqrt(bound):
+            return tick_to_sqrt_price(bound, spacing) if ticks else np.sqrt(bound)
+
+        if mask is None:
+            burned = self.burn()
+            self._lower_sqrt[...] = to_sqrt(lower)
+            self._upper_sqrt[...] = to_sqrt(upper)
+        else:
+            burned = self.burn_at(mask)
+            self._lower_sqrt[mask] = to_sqrt(lower[mask])
+            self._upper_sqrt[mask] = to_sqrt(upper[mask])
+
+        self._cache_range()
+        self._amounts_cache = None
+        if instrumentation.is_enabled():
+            instrumentation.count('Position.rebalanced', self._liquidity.size if mask is None else np.count_nonzero(mask))
+        return burned
+
+    @instrumentation.timed
+    def burn_and_remint(self, lower, upper, mask=None, ticks=False, spacing=1):
+        """
+        Moves the selected paths to the new bounds (see `rerange`) and mints everything that was
+        burned back into the position. Whatever can't be used stays collectable. Returns the amounts
+        minted.
+        """
+        burned = self.rerange(lower, upper, mask, ticks, spacing)
+        used = self.mint(burned[..., 0], burned[..., 1])
+
+        # earnings of the selected paths are 0 after the burn
+        self._earned += np.clip(burned - used, a_min=0, a_max=None)
+        return used
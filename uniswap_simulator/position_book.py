@@ -0,0 +1,185 @@
+import numpy as np
+
+from uniswap_simulator import instrumentation
+from uniswap_simulator.liquidity_amounts import liquidity_for_amounts_fused, amounts_for_liquidity_fused
+from uniswap_simulator.precision import resolve_dtype, ACCUMULATOR_DTYPE
+
+
+class PositionBook:
+    """
+    K Uniswap v3 positions over the same N price trajectories. Bounds, liquidity and earnings are
+    stored as (K x N) arrays (earnings as K x N x 2), so a single `update` advances every position.
+    Methods that act on a subset of positions take an `index` into the first axis (an int, a slice,
+    or a boolean mask of length K).
+    """
+
+    def __init__(self, price, lower, upper, fee, dtype=None):
+        self._dtype = resolve_dtype(dtype)
+        self._lower_sqrt = np.sqrt(lower, dtype=self._dtype)
+        self._upper_sqrt = np.sqrt(upper, dtype=self._dtype)
+        self._fee = fee
+        self.reset(price)
+
+    def reset(self, price):
+        shape = self._lower_sqrt.shape
+        self._price_sqrt = np.sqrt(price, dtype=self._dtype)
+        self._liquidity = np.zeros(shape, dtype=self._dtype)
+        self._earned = np.zeros((*shape, 2), dtype=ACCUMULATOR_DTYPE)
+
+        self._price = np.square(self._price_sqrt)
+        self._price_moved = self._price
+        self._amounts_previous = np.empty((*shape, 2), dtype=self._dtype)
+        self._amounts_current = np.empty((*shape, 2), dtype=self._dtype)
+
+    def snapshot(self):
+        """Returns the book's state as a dict of arrays (see `uniswap_simulator.checkpoint`)."""
+        return {
+            'price_sqrt': self._price_sqrt,
+            'lower_sqrt': self._lower_sqrt,
+            'upper_sqrt': self._upper_sqrt,
+            'liquidity': self._liquidity,
+            'earned': self._earned
+        }
+
+    def restore(self, state):
+        self._lower_sqrt = np.array(state['lower_sqrt'], dtype=self._dtype)
+        self._upper_sqrt = np.array(state['upper_sqrt'], dtype=self._dtype)
+        self._price_sqrt = np.array(state['price_sqrt'], dtype=self._dtype)
+        self._liquidity = np.array(state['liquidity'], dtype=self._dtype)
+        self._earned = np.array(state['earned'], dtype=ACCUMULATOR_DTYPE)
+
+        shape = self._lower_sqrt.shape
+        self._price = np.square(self._price_sqrt)
+        self._price_moved = self._price
+        self._amounts_previous = np.empty((*shape, 2), dtype=self._dtype)
+        self._amounts_current = np.empty((*shape, 2), dtype=self._dtype)
+
+    def __len__(self):
+        return self._lower_sqrt.shape[0]
+
+    @property
+    def price(self):
+        """The price the pool moved to on the last `update`, as `Position.update` writes it into its argument."""
+        return self._price_moved
+
+    @property
+    def lower(self):
+        return np.square(self._lower_sqrt)
+
+    @property
+    def upper(self):
+        return np.square(self._upper_sqrt)
+
+    @property
+    def fee(self):
+        return self._fee
+
+    @property
+    def liquidity(self):
+        return self._liquidity
+
+    @property
+    def amounts(self):
+        """Amounts held by each position (K x N x 2), including uncollected earnings."""
+        return self._earned + amounts_for_liquidity_fused(
+            self._price_sqrt,
+            self._lower_sqrt,
+            self._upper_sqrt,
+            self._liquidity
+        )
+
+    @property
+    def collectable(self):
+        return self._earned
+
+    def set_bounds(self, lower, upper, index=slice(None)):
+        """
+        Moves the selected positions to new bounds without touching their liquidity. Meant for
+        positions that were just burned, before minting into them again.
+        """
+        self._lower_sqrt[index] = np.sqrt(lower)
+        self._upper_sqrt[index] = np.sqrt(upper)
+
+    @instrumentation.timed
+    def update(self, price):
+        """
+        Advances every position to `price` and returns the amounts held by the whole book (N x 2).
+        Unlike `Position.update`, `price` is not modified; the price the pool actually moved to is
+        available as `self.price` afterwards.
+        """
+        # If price movement is less than fee, it's not guaranteed that the AMM will
+        # be arb'd to match new price
+        ratio = price / self._price
+        should_update = (ratio > 1 / (1 - self._fee)) | (ratio < 1 - self._fee)
+        self._price_moved = np.where(should_update, price, self._price)
+        price_sqrt = np.sqrt(self._price_moved, dtype=self._dtype)
+
+        # one pass over all K positions; the (N,) price broadcasts over the first axis
+        amounts_previous = amounts_for_liquidity_fused(
+            self._price_sqrt,
+            self._lower_sqrt,
+            self._upper_sqrt,
+            self._liquidity,
+            out=self._amounts_previous
+        )
+        amounts_current = amounts_for_liquidity_fused(
+            price_sqrt,
+            self._lower_sqrt,
+            self._upper_sqrt,
+            self._liquidity,
+            out=self._amounts_current
+        )
+
+        diff = np.subtract(amounts_current, amounts_previous, out=amounts_previous)
+        diff *= self._fee
+        mask = diff[..., 0] > 0
+        self._earned[..., 0] += np.where(mask, diff[..., 0], 0)
+        self._earned[..., 1] += np.where(mask, 0, diff[..., 1])
+
+        self._price_sqrt = price_sqrt
+        self._price = np.square(price_sqrt)
+        return self._earned.sum(axis=0) + amounts_current.sum(axis=0)
+
+    @instrumentation.timed
+    def mint(self, amount0, amount1, index=slice(None)):
+        """
+        Mints into the selected positions. `amount0` and `amount1` broadcast against the selection,
+        e.g. (N,) for a single position or (k x N) for k of them. Returns the amounts used.
+        """
+        liquidity = liquidity_for_amounts_fused(
+            self._price_sqrt,
+            self._lower_sqrt[index],
+            self._upper_sqrt[index],
+            amount0,
+            amount1
+        )
+        self._liquidity[index] += liquidity
+        return amounts_for_liquidity_fused(
+            self._price_sqrt,
+            self._lower_sqrt[index],
+            self._upper_sqrt[index],
+            liquidity
+        )
+
+    @instrumentation.timed
+    def burn(self, fraction=1.0, index=slice(None), mask=None):
+        """
+        Burns `fraction` of the selected positions' liquidity and earnings, restricted to the paths
+        where `mask` is True if one is given. Returns the amounts removed, shaped like the selection.
+        """
+        liquidity_to_burn = self._liquidity[index] * fraction
+        earned = self._earned[index] * fraction
+        if mask is not None:
+            liquidity_to_burn *= mask
+            earned *= mask[..., np.newaxis]
+
+        self._liquidity[index] -= liquidity_to_burn
+        self._earned[index] -= earned
+
+        burned = amounts_for_liquidity_fused(
+            self._price_sqrt,
+            self._lower_sqrt[index],
+            self._upper_sqrt[index],
+            liquidity_to_burn
+        )
+        return burned + earned
@@ -1,28 +1,49 @@
 import numpy as np
 
 from uniswap_simulator.liquidity_amounts import liquidity_for_amounts, amounts_for_liquidity
+from uniswap_simulator import instrumentation
+from uniswap_simulator.engine import run_position_v2, simulate_position_v2
+from uniswap_simulator.precision import resolve_dtype
 
 
 class PositionV2:
-    def __init__(self, price, fee):
-        self._price_sqrt = np.sqrt(price)
+    def __init__(self, price, fee, dtype=None):
+        self._dtype = resolve_dtype(dtype)
         self._fee = fee
         self._gamma = 1. - fee
-
-        self._k = np.zeros_like(price)
-        self._x = np.zeros_like(price)
-        self._y = np.zeros_like(price)
+        self.reset(price)
 
     def reset(self, price):
-        self._price_sqrt = np.sqrt(price)
-
-        self._k = np.zeros_like(price)
-        self._x = np.zeros_like(price)
-        self._y = np.zeros_like(price)
+        self._price_sqrt = np.sqrt(price, dtype=self._dtype)
+
+        # [x, y] for each trajectory, in one contiguous buffer that's updated in place
+        self._amounts = np.zeros((*self._price_sqrt.shape, 2), dtype=self._price_sqrt.dtype)
+        self._x = self._amounts[..., 0]
+        self._y = self._amounts[..., 1]
+        self._k = np.zeros_like(self._price_sqrt)
+        self._invalidate_caches()
+
+    def snapshot(self):
+        """Returns the position's state as a dict of arrays (see `uniswap_simulator.checkpoint`)."""
+        return {'price_sqrt': self._price_sqrt, 'amounts': self._amounts}
+
+    def restore(self, state):
+        self._price_sqrt = np.array(state['price_sqrt'], dtype=self._dtype)
+        self._amounts = np.array(state['amounts'], dtype=self._dtype)
+        self._x = self._amounts[..., 0]
+        self._y = self._amounts[..., 1]
+        self._k = np.multiply(self._x, self._y)
+        self._invalidate_caches()
+
+    def _invalidate_caches(self):
+        # must be called whenever `_price_sqrt` is changed by anything but `update`
+        self._price_cache = None
 
     @property
     def _price(self):
-        return np.square(self._price_sqrt)
+        if self._price_cache is None:
+            self._price_cache = np.square(self._price_sqrt)
+        return self._price_cache
 
     @property
     def fee(self):
@@ -30,42 +51,74 @@ class PositionV2:
 
     @property
     def amounts(self):
-        return np.vstack((self._x, self._y)).T
+        return self._amounts.copy()
 
+    @instrumentation.timed
     def update(self, price):
+        price_previous = self._price
+
         # If price movement is less than fee, it's not guaranteed that the AMM will
         # be arb'd to match new price
-        should_update = np.any((
-            price / self._price > 1. / (1. - self._fee),
-            price / self._price < 1. - self._fee
-        ), axis=0)
-        price[~should_update] = self._price[~should_update]
-        price_sqrt = np.sqrt(price)
-
-        mask = price > self._price # where price is growing
-
-        a = -self._x * (2. - self._fee) + np.sqrt(np.square(self._x * self._fee) + 4 * self._gamma * self._k / price)
-        a /= 2. * self._gamma
-        b = -self._y * (2. - self._fee) + np.sqrt(np.square(self._y * self._fee) + 4 * self._gamma * self._k * price)
-        b /= 2. * self._gamma
-
-        self._x[~mask] += a[~mask]
-        self._y[~mask] = price[~mask] * self._x[~mask]
-        self._y[mask] += b[mask]
-        self._x[mask] = self._y[mask] / price[mask]
-
-        self._x = np.clip(self._x, a_min=0, a_max=None)
-        self._y = np.clip(self._y, a_min=0, a_max=None)
-
-        self._k = self._x * self._y
-        self._price_sqrt = price_sqrt
+        ratio = price / price_previous
+        should_update = (ratio > 1. / (1. - self._fee)) | (ratio < 1. - self._fee)
+        np.copyto(price, price_previous, where=~should_update)
+        if instrumentation.is_enabled():
+            instrumentation.count('PositionV2.path_steps', price.size)
+            instrumentation.count('PositionV2.fee_band_crossings', np.count_nonzero(should_update))
+
+        # each trajectory only needs the branch for the direction its price moved in
+        mask = price > price_previous
+        down = np.flatnonzero(~mask)
+        up = np.flatnonzero(mask)
+
+        p = price[down]
+        x = self._x[down]
+        x += (-x * (2. - self._fee) + np.sqrt(np.square(x * self._fee) + 4 * self._gamma * self._k[down] / p)) / \
+            (2. * self._gamma)
+        self._x[down] = x
+        self._y[down] = p * x
+
+        p = price[up]
+        y = self._y[up]
+        y += (-y * (2. - self._fee) + np.sqrt(np.square(y * self._fee) + 4 * self._gamma * self._k[up] * p)) / \
+            (2. * self._gamma)
+        self._y[up] = y
+        self._x[up] = y / p
+
+        np.maximum(self._amounts, 0, out=self._amounts)
+        np.multiply(self._x, self._y, out=self._k)
+
+        np.sqrt(price, out=self._price_sqrt)
+        np.square(self._price_sqrt, out=self._price_cache)
         return self.amounts
 
+    @instrumentation.timed
+    def run(self, prices, engine='auto'):
+        """
+        Calls `update` on each row of the (time x trajectories) `prices` block, possibly through a
+        compiled engine (see `uniswap_simulator.engine`). Returns the final amounts.
+        Subclasses that override `update` are always stepped through it.
+        """
+        if type(self).update is not PositionV2.update:
+            engine = 'numpy'
+        return run_position_v2(self, prices, engine)
+
+    @instrumentation.timed
+    def simulate(self, prices, engine='auto'):
+        """
+        Same as `run`, but returns the amounts after each step (time x trajectories x 2).
+        """
+        if type(self).update is not PositionV2.update:
+            engine = 'numpy'
+        return simulate_position_v2(self, prices, engine)
+
+    @instrumentation.timed
     def mint(self, amount0, amount1):
-        value = np.minimum(amount0 * self._price, amount1)
+        price = self._price
+        value = np.minimum(amount0 * price, amount1)
 
-        self._x += value / self._price
+        self._x += value / price
         self._y += value
-        self._k = self._x * self._y
+        np.multiply(self._x, self._y, out=self._k)
 
-        return np.vstack((value / self._price, value)).T
+        return np.stack((value / price, value), axis=-1)
@@ -0,0 +1,49 @@
+"""
+Floating point precision policy. Prices, liquidity and per-step amounts use the working dtype, which
+is float64 unless changed globally (`set_dtype`), for a block of code (`use_dtype`) or per object
+(the `dtype` argument of `Position`, `PositionV2`, `PositionBook` and `GeometricBrownianMotion`).
+float32 halves memory traffic. Quantities that accumulate over many steps (earned fees, the GBM's
+cumulative growth) and the final log-wealth reductions always stay in `ACCUMULATOR_DTYPE`.
+"""
+from contextlib import contextmanager
+
+import numpy as np
+
+
+SUPPORTED_DTYPES = (np.dtype(np.float32), np.dtype(np.float64))
+ACCUMULATOR_DTYPE = np.dtype(np.float64)
+
+_dtype = np.dtype(np.float64)
+
+
+def _validate(dtype):
+    dtype = np.dtype(dtype)
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError('dtype must be float32 or float64, got {}'.format(dtype))
+    return dtype
+
+
+def get_dtype():
+    return _dtype
+
+
+def set_dtype(dtype):
+    """Sets the working dtype for objects created from now on. Returns the previous one."""
+    global _dtype
+    previous = _dtype
+    _dtype = _validate(dtype)
+    return previous
+
+
+@contextmanager
+def use_dtype(dtype):
+    previous = set_dtype(dtype)
+    try:
+        yield
+    finally:
+        set_dtype(previous)
+
+
+def resolve_dtype(dtype=None):
+    """Returns `dtype` if given, otherwise the current working dtype."""
+    return _dtype if dtype is None else _validate(dtype)
@@ -0,0 +1,352 @@
+import os
+
+import numpy as np
+
+from uniswap_simulator.cache import fingerprint
+from uniswap_simulator.gbm import GeometricBrownianMotion, SOBOL_REPLICATES, spawn_generators, stack_samplers
+from uniswap_simulator.checkpoint import log_growth_checkpointed
+from uniswap_simulator.compare_to_hodl import check_antithetic_count, estimate_growth, expected_hodl_log_growth, \
+    log_growth_streaming
+from uniswap_simulator.executor import _context, run_tasks
+from uniswap_simulator.path_store import PricePathStore
+from uniswap_simulator.pipeline import prefetch as prefetch_blocks
+from uniswap_simulator.precision import resolve_dtype, use_dtype
+
+
+def run_cells(strategy_factory, p0, mus, sigmas, dt, T, count, rng=None, block_size=256, price_bounds=None,
+              engine=None, dtype=None, checkpoint=None, checkpoint_interval=10000, method='mc',
+              control_variate=False, return_stderr=False, prefetch=False):
+    """
+    Simulates several (mu, sigma) cells in a single strategy run by stacking `count` trajectories
+    per cell along the trajectory axis. `strategy_factory(price)` must build a strategy for the
+    given initial price array. `engine` is passed on to `log_growth_streaming`, and `dtype` sets the
+    working precision for the run (see `uniswap_simulator.precision`). If `checkpoint` is a path,
+    the run is snapshotted there every `checkpoint_interval` steps and resumed from it if it exists
+    (see `uniswap_simulator.checkpoint`); a snapshot of a run with other arguments raises a ValueError.
+
+    `method` picks how paths are sampled (see `GeometricBrownianMotion.sample_blocks`); with 'sobol',
+    `count` should be a power of two times `SOBOL_REPLICATES`. With `control_variate`, each cell's
+    exact expected HODL growth is used to reduce the variance of G (see `compare_to_hodl`).
+
+    With `prefetch`, prices are generated on a background thread while the strategy is simulated
+    (see `uniswap_simulator.pipeline`). It has no effect on checkpointed runs.
+
+    Returns an array of shape (cells x 2) holding G and G_hodl, or (cells x 4) with their standard
+    errors appended if `return_stderr` is set.
+    """
+    if method == 'antithetic':
+        check_antithetic_count(count)
+    mus = np.asarray(mus, dtype=float)
+    sigmas = np.asarray(sigmas, dtype=float)
+    log_growth, log_growth_hodl, horizon = log_growth_cells(
+        strategy_factory, p0, mus, sigmas, dt, T, count, rng, block_size, price_bounds, engine, dtype, checkpoint,
+        checkpoint_interval, method, prefetch
+    )
+    return _estimates(log_growth, log_growth_hodl, horizon, mus, sigmas, T, method, control_variate, return_stderr)
+
+
+def _estimates(log_growth, log_growth_hodl, horizon, mus, sigmas, T, method, control_variate, return_stderr):
+    hodl_expectation = expected_hodl_log_growth(mus, sigmas, horizon) if control_variate else None
+    estimates = np.stack(estimate_growth(
+        log_growth,
+        log_growth_hodl,
+        T,
+        hodl_expectation,
+        SOBOL_REPLICATES if method == 'sobol' else None,
+        method == 'antithetic'
+    ), axis=1)
+    return estimates if return_stderr else estimates[:, :2]
+
+
+def log_growth_cells(strategy_factory, p0, mus, sigmas, dt, T, count, rng=None, block_size=256, price_bounds=None,
+                     engine=None, dtype=None, checkpoint=None, checkpoint_interval=10000, method='mc',
+                     prefetch=False):
+    """
+    The simulation behind `run_cells`. Returns the per-trajectory log growth of the strategy and of
+    HODLing, each of shape (cells x `count`), and the time horizon the paths actually span.
+
+    `rng` may also be a list with one seed per cell, in which case each cell's paths are generated
+    separately, and its results don't depend on which other cells it's simulated with.
+    """
+    cells = len(mus)
+    if checkpoint is not None:
+        # before the rng is used, if it's a generator
+        run_key = checkpoint_key(
+            strategy_factory, p0, mus, sigmas, dt, T, count, rng, block_size, price_bounds, engine, dtype, method
+        )
+
+    # applied here rather than by the caller so that it also holds inside worker processes
+    with use_dtype(resolve_dtype(dtype)):
+        gbm = GeometricBrownianMotion(p0, np.repeat(mus, count), np.repeat(sigmas, count), dt, T)
+        strategy = strategy_factory(np.full(cells * count, p0, dtype=resolve_dtype()))
+
+        if isinstance(rng, (list, tuple)):
+            sampler = stack_samplers(
+                GeometricBrownianMotion(p0, mu, sigma, dt, T).sample_blocks(
+                    count, block_size, np.random.default_rng(cell_rng), method
+                ) for mu, sigma, cell_rng in zip(mus, sigmas, rng)
+            )
+        else:
+            # snapshots need a generator whose state can be saved
+            sampler = gbm.sample_blocks(
+                cells * count, block_size, rng if checkpoint is None else np.random.default_rng(rng), method
+            )
+
+        if checkpoint is not None:
+            log_growth, log_growth_hodl = log_growth_checkpointed(
+                strategy, sampler, checkpoint, checkpoint_interval, engine, price_bounds, run_key
+            )
+        else:
+            blocks = sampler
+            if prefetch:
+                blocks = prefetch_blocks(blocks, price_bounds)
+            elif price_bounds is not None:
+                blocks = (np.clip(block, *price_bounds) for block in blocks)
+            log_growth, log_growth_hodl = log_growth_streaming(strategy, blocks, engine)
+
+    return log_growth.reshape(cells, count), log_growth_hodl.reshape(cells, count), (len(gbm) - 1) * dt
+
+
+def checkpoint_key(strategy_factory, p0, mus, sigmas, dt, T, count, rng, block_size, price_bounds, engine, dtype,
+                   method):
+    """Identifies the results of `log_growth_cells`, so that checkpoints aren't resumed by other runs."""
+    return fingerprint(
+        strategy_factory, p0, np.asarray(mus, dtype=float), np.asarray(sigmas, dtype=float), dt, T, count,
+        _seed_state(rng), block_size, price_bounds, engine, np.dtype(resolve_dtype(dtype)).name, method
+    )
+
+
+def _seed_state(rng):
+    if isinstance(rng, (list, tuple)):
+        return [_seed_state(r) for r in rng]
+    if isinstance(rng, np.random.SeedSequence):
+        return rng.entropy, rng.spawn_key
+    if isinstance(rng, np.random.Generator):
+        return rng.bit_generator.state
+    return rng
+
+
+def _run_cells(args):
+    return run_cells(*args)
+
+
+def _log_growth_cells(args):
+    return log_growth_cells(*args)
+
+
+def _map(func, args, processes=None, transport=None, retries=2):
+    """Yields `func(a)` for each of `args` in order, computed as configured for `sweep`."""
+    if transport is not None:
+        yield from run_tasks(func, args, transport, retries)
+    elif processes is None:
+        yield from map(func, args)
+    else:
+        with _context.Pool(processes) as p:
+            yield from p.imap(func, args)
+
+
+def sweep(strategy_factory, p0, mus, sigmas, dt, T, count=1000, cells_per_batch=20, processes=None,
+          seed=None, block_size=256, price_bounds=None, engine=None, dtype=None, checkpoint_dir=None,
+          checkpoint_interval=10000, method='mc', control_variate=False, return_stderr=False, prefetch=False,
+          transport=None, retries=2, cache=None):
+    """
+    Evaluates a strategy over the (mu, sigma) grid. Cells are grouped into batches of
+    `cells_per_batch`, each of which is a single vectorized run (see `run_cells`); batches are
+    spread across `processes` workers if given. `strategy_factory` has to be picklable in that case.
+
+    Alternatively, batches can be handed out dynamically to the workers of a `transport` (see
+    `uniswap_simulator.executor`), which may be on other machines. Failed batches are retried up to
+    `retries` times. Smaller batches balance the load better, at some cost in vectorization.
+
+    With a `checkpoint_dir`, each batch keeps a snapshot there (see `run_cells`), so an interrupted
+    sweep can be restarted with the same arguments and picks up where it left off. Pass a `seed`
+    in that case, since resumed batches have to see the same prices. Snapshots are named after the
+    batch's arguments, so a sweep with different ones starts afresh.
+
+    `method`, `control_variate`, `return_stderr` and `prefetch` are passed on to `run_cells`.
+
+    With a `cache` (a `uniswap_simulator.cache.ResultCache`), each cell's per-path results are stored
+    under a key made from the strategy factory, the cell and the other arguments that affect them, and
+    only cells that aren't cached yet are simulated. Cells then get their own seeds, derived from
+    `seed` (which is required) and their mu and sigma, so a cell's results don't depend on the grid it
+    is part of, and a sweep over a grown grid only simulates the new cells.
+
+    Returns `x_grid`, `y_grid` (the meshgrid of mus and sigmas) and `z_grid`, where
+    `z_grid[i, j]` holds [G, G_hodl] for `sigmas[i]` and `mus[j]`, followed by their standard
+    errors if `return_stderr` is set.
+    """
+    if method == 'antithetic':
+        # before anything is simulated
+        check_antithetic_count(count)
+    x_grid, y_grid = np.meshgrid(mus, sigmas)
+    z_grid = np.zeros((*x_grid.shape, 4 if return_stderr else 2))
+
+    mu_cells = x_grid.ravel()
+    sigma_cells = y_grid.ravel()
+
+    if cache is not None:
+        entries = _cached_cells(
+            cache, strategy_factory, p0, mu_cells, sigma_cells, dt, T, count, cells_per_batch, processes, seed,
+            block_size, price_bounds, engine, dtype, checkpoint_dir, checkpoint_interval, method, prefetch, transport,
+            retries
+        )
+        z_grid.reshape(-1, z_grid.shape[-1])[:] = _estimates(
+            np.stack([entry['log_growth'] for entry in entries]),
+            np.stack([entry['log_growth_hodl'] for entry in entries]),
+            float(entries[0]['horizon']),
+            mu_cells,
+            sigma_cells,
+            T,
+            method,
+            control_variate,
+            return_stderr
+        )
+        return x_grid, y_grid, z_grid
+
+    starts = range(0, len(mu_cells), cells_per_batch)
+    rngs = spawn_generators(seed, len(starts))
+
+    checkpoints = [None] * len(starts)
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        # named after what they're a checkpoint of, so that a changed sweep doesn't resume them
+        checkpoints = [
+            os.path.join(checkpoint_dir, 'batch_{}.npz'.format(checkpoint_key(
+                strategy_factory, p0, mu_cells[start:start + cells_per_batch],
+                sigma_cells[start:start + cells_per_batch], dt, T, count, rng, block_size, price_bounds, engine, dtype,
+                method
+            )[:32]))
+            for start, rng in zip(starts, rngs)
+        ]
+
+    args = [(
+        strategy_factory,
+        p0,
+        mu_cells[start:start + cells_per_batch],
+        sigma_cells[start:start + cells_per_batch],
+        dt,
+        T,
+        count,
+        rng,
+        block_size,
+        price_bounds,
+        engine,
+        dtype,
+        checkpoint,
+        checkpoint_interval,
+        method,
+        control_variate,
+        return_stderr,
+        prefetch
+    ) for start, rng, checkpoint in zip(starts, rngs, checkpoints)]
+
+    performances = list(_map(_run_cells, args, processes, transport, retries))
+    z_grid.reshape(-1, z_grid.shape[-1])[:] = np.concatenate(performances, axis=0)
+    return x_grid, y_grid, z_grid
+
+
+def _cached_cells(cache, strategy_factory, p0, mus, sigmas, dt, T, count, cells_per_batch, processes, seed,
+                  block_size, price_bounds, engine, dtype, checkpoint_dir, checkpoint_interval, method, prefetch,
+                  transport, retries):
+    """
+    The part of `sweep` that looks cells up in `cache`, and simulates and stores the missing ones.
+    Returns each cell's cache entry: its per-path log growth, that of HODLing, the time horizon
+    and a summary (G, G_hodl and their standard errors).
+    """
+    if seed is None:
+        raise ValueError('caching results requires a seed')
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    # the same cell always gets the same seed, whatever grid it's in; children of a common root get
+    # different ones, since the cell is appended to their spawn key
+    seeds = [
+        np.random.SeedSequence(
+            seed.entropy, spawn_key=tuple(seed.spawn_key) + tuple(np.array([mu, sigma]).view(np.uint32).tolist())
+        )
+        for mu, sigma in zip(mus, sigmas)
+    ]
+    dtype_name = np.dtype(resolve_dtype(dtype)).name
+    keys = [
+        cache.key('sweep', strategy_factory, p0, mu, sigma, dt, T, count, seed.entropy, seed.spawn_key, block_size,
+                  price_bounds, engine, dtype_name, method)
+        for mu, sigma in zip(mus, sigmas)
+    ]
+
+    entries = [cache.get(key) for key in keys]
+    missing = [i for i, entry in enumerate(entries) if entry is None]
+    batches = [missing[start:start + cells_per_batch] for start in range(0, len(missing), cells_per_batch)]
+
+    checkpoints = [None] * len(batches)
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        # named after the cells in them, since batches change as cells get cached
+        checkpoints = [
+            os.path.join(checkpoint_dir, 'cells_{}.npz'.format(fingerprint([keys[i] for i in batch])[:32]))
+            for batch in batches
+        ]
+
+    args = [(
+        strategy_factory,
+        p0,
+        mus[batch],
+        sigmas[batch],
+        dt,
+        T,
+        count,
+        [seeds[i] for i in batch],
+        block_size,
+        price_bounds,
+        engine,
+        dtype,
+        checkpoint,
+        checkpoint_interval,
+        method,
+        prefetch
+    ) for batch, checkpoint in zip(batches, checkpoints)]
+
+    # cells are stored as their batches finish, so an interrupted sweep keeps them
+    for batch, (log_growth, log_growth_hodl, horizon) in zip(batches, _map(_log_growth_cells, args, processes,
+                                                                            transport, retries)):
+        for j, i in enumerate(batch):
+            entries[i] = {
+                'log_growth': log_growth[j],
+                'log_growth_hodl': log_growth_hodl[j],
+                'horizon': np.array(horizon),
+                'summary': np.array(estimate_growth(
+                    log_growth[j], log_growth_hodl[j], T, None, SOBOL_REPLICATES if method == 'sobol' else None,
+                    method == 'antithetic'
+                ))
+            }
+            cache.put(keys[i], entries[i])
+
+    return entries
+
+
+def _run_on_store(args):
+    strategy_factory, handle, T, block_size = args
+
+    store = PricePathStore.attach(handle)
+    try:
+        strategy = strategy_factory(np.array(store.prices[0]))
+        log_growth, log_growth_hodl = log_growth_streaming(strategy, store.blocks(block_size))
+    finally:
+        store.close()
+
+    return np.array((log_growth.mean() / T, log_growth_hodl.mean() / T))
+
+
+def compare_strategies(strategy_factories, store, T, processes=None, block_size=256):
+    """
+    Runs each strategy on the common price paths held in `store` (a `PricePathStore`). Workers
+    attach to the store by name, so paths are neither regenerated nor copied between processes.
+    Returns an array of shape (strategies x 2) holding G and G_hodl.
+    """
+    args = [(strategy_factory, store.handle, T, block_size) for strategy_factory in strategy_factories]
+
+    if processes is None:
+        performances = list(map(_run_on_store, args))
+    else:
+        with _context.Pool(processes) as p:
+            performances = p.map(_run_on_store, args)
+
+    return np.stack(performances, axis=0)
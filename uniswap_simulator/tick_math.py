@@ -0,0 +1,82 @@
+"""
+Conversions between prices and integer Uniswap v3 ticks (price = 1.0001 ** tick). Sqrt prices for ticks
+are looked up in tables that are built once per tick spacing, so holding range bounds as integer ticks
+replaces `np.power` / `np.sqrt` calls on every path with a gather.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+
+TICK_BASE = 1.0001
+LOG_TICK_BASE = np.log(TICK_BASE)
+
+MIN_TICK = -887272
+MAX_TICK = +887272
+MIN_PRICE = TICK_BASE ** MIN_TICK
+MAX_PRICE = TICK_BASE ** MAX_TICK
+
+# at most this many tables (one per tick spacing) are kept around; with spacing 1, a table is ~14 MB
+MAX_CACHED_TABLES = 4
+
+
+def price_to_tick(price):
+    """Returns the greatest integer tick whose price is at most `price`."""
+    return np.floor(np.log(price) / LOG_TICK_BASE).astype(np.int64)
+
+
+def tick_to_price(ticks):
+    return np.power(TICK_BASE, np.asarray(ticks, dtype=np.float64))
+
+
+def floor_to_spacing(ticks, spacing):
+    """Rounds integer ticks down to the nearest multiple of `spacing`."""
+    return ticks - np.mod(ticks, spacing)
+
+
+def ceil_to_spacing(ticks, spacing):
+    """Rounds integer ticks up to the nearest multiple of `spacing`."""
+    return ticks + np.mod(-ticks, spacing)
+
+
+class SqrtPriceTable:
+    """Sqrt prices of every multiple of `spacing` in [MIN_TICK, MAX_TICK], indexed by tick."""
+
+    def __init__(self, spacing=1):
+        self.spacing = spacing
+        self.min_tick = int(ceil_to_spacing(MIN_TICK, spacing))
+        self.max_tick = int(floor_to_spacing(MAX_TICK, spacing))
+
+        ticks = np.arange(self.min_tick, self.max_tick + 1, spacing, dtype=np.int64)
+        # same operations as `np.sqrt(tick_to_price(ticks))`, so lookups match direct evaluation exactly
+        self.sqrt_prices = np.sqrt(tick_to_price(ticks))
+
+    def __len__(self):
+        return len(self.sqrt_prices)
+
+    def __call__(self, ticks):
+        """
+        Gathers the sqrt prices of `ticks`, which must be integer multiples of `spacing` (a ValueError
+        is raised otherwise). Like in the protocol, ticks outside [MIN_TICK, MAX_TICK] are clamped to
+        that range.
+        """
+        ticks = np.asarray(ticks)
+        if ticks.dtype.kind not in 'iu':
+            raise ValueError('ticks must be integers, got {}'.format(ticks.dtype))
+        if np.any(ticks % self.spacing):
+            raise ValueError('ticks must be multiples of the table spacing {}'.format(self.spacing))
+        ticks = np.clip(ticks, self.min_tick, self.max_tick)
+        return self.sqrt_prices[(ticks - self.min_tick) // self.spacing]
+
+
+@lru_cache(maxsize=MAX_CACHED_TABLES)
+def get_sqrt_price_table(spacing=1):
+    return SqrtPriceTable(spacing)
+
+
+def tick_to_sqrt_price(ticks, spacing=1):
+    """
+    Sqrt price of integer `ticks`, looked up in the (lazily built) table for `spacing`. Ticks must be
+    multiples of `spacing`; the coarser the spacing, the smaller the table.
+    """
+    return get_sqrt_price_table(spacing)(ticks)